@@ -6,6 +6,12 @@ import google.generativeai as genai
 from openai import OpenAI
 import os
 import tempfile
+from resilience import retry_call, classify_error, RetryPolicy, FATAL
+from metrics import metrics
+
+
+# Captions are cheap to fall back from, so retry briefly
+CAPTION_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=1, max_delay=10, max_retry_after=30)
 
 
 class AICaptionGenerator:
@@ -52,37 +58,53 @@ class AICaptionGenerator:
         
         Args:
             filename: Video filename
-            
+        
         Returns:
-            dict with 'title' and 'caption'
+            dict with 'title', 'caption' and 'provider' ('gemini', 'openai' or 'default')
         """
+        with metrics.span('caption'):
+            return self._generate_caption(filename)
+    
+    def _generate_caption(self, filename):
+        """Generate with the first provider that works"""
         # Try Gemini first
         if self.gemini_available:
             try:
-                result = self._generate_with_gemini(filename)
+                result = retry_call(self._generate_with_gemini, filename,
+                                    policy=CAPTION_RETRY_POLICY, description="Gemini generation")
                 if result:
                     print("✓ Generated caption with Gemini AI")
+                    metrics.incr('captions_gemini')
+                    result['provider'] = 'gemini'
                     return result
             except Exception as e:
                 print(f"Gemini generation failed: {e}")
-                self.gemini_available = False
+                # Only give up on the provider for errors that will not go away
+                if classify_error(e)[0] == FATAL:
+                    self.gemini_available = False
         
         # Fallback to OpenAI
         if self.openai_available:
             try:
-                result = self._generate_with_openai(filename)
+                result = retry_call(self._generate_with_openai, filename,
+                                    policy=CAPTION_RETRY_POLICY, description="OpenAI generation")
                 if result:
                     print("✓ Generated caption with OpenAI")
+                    metrics.incr('captions_openai')
+                    result['provider'] = 'openai'
                     return result
             except Exception as e:
                 print(f"OpenAI generation failed: {e}")
-                self.openai_available = False
+                if classify_error(e)[0] == FATAL:
+                    self.openai_available = False
         
         # Use default
         print("Using default caption")
+        metrics.incr('captions_default')
         return {
             'title': filename[:50],
-            'caption': self.default_caption
+            'caption': self.default_caption,
+            'provider': 'default'
         }
     
     def _generate_with_gemini(self, filename):
@@ -0,0 +1,348 @@
+"""
+Offline end-to-end benchmark
+Runs the main.py workflow repeatedly against in-process fakes for Google
+Drive, Instagram and the AI providers, and mongomock (or a local mongod),
+then reports throughput, stage latency percentiles and peak memory
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+import main
+import multi_account
+from metrics import metrics, percentile
+from mongo_tracker import MongoVideoTracker
+from manifest import VideoManifest
+from fakes import (FaultProfile, FakeDriveFolder, FakeDriveHttp, FakeDriveDownloader, FakeInstagramClient,
+                   FakeInstagramUploader, FakeRuploadServer, FakeLLM, FakeCaptionGenerator)
+
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Offline benchmark of the upload workflow")
+    parser.add_argument('--files', type=int, default=2000, help="Videos in the fake Drive folder")
+    parser.add_argument('--file-size-kb', type=int, default=256, help="Size of every fake video")
+    parser.add_argument('--iterations', type=int, default=50, help="Number of main() runs")
+    parser.add_argument('--per-run', type=int, default=1, help="Uploads due in each run")
+    parser.add_argument('--accounts', type=int, default=0, help="Run in multi-account mode with N accounts")
+    parser.add_argument('--drive-latency', type=float, default=0.0, help="Seconds per Drive request")
+    parser.add_argument('--drive-bandwidth', type=float, default=None, help="Drive download bytes/second")
+    parser.add_argument('--drive-failure-rate', type=float, default=0.0)
+    parser.add_argument('--ig-latency', type=float, default=0.0, help="Seconds per Instagram upload")
+    parser.add_argument('--ig-bandwidth', type=float, default=None, help="Instagram upload bytes/second")
+    parser.add_argument('--ig-failure-rate', type=float, default=0.0)
+    parser.add_argument('--rupload', action='store_true',
+                        help="Upload through the segmented transport to a local rupload stand-in "
+                             "(--ig-failure-rate then drops connections mid-segment)")
+    parser.add_argument('--segment-kb', type=int, default=64, help="Segment size for --rupload")
+    parser.add_argument('--compact-listing', action='store_true',
+                        help="Keep the folder listing in a VideoManifest (google_drive.compact_listing)")
+    parser.add_argument('--listing-memory', action='store_true',
+                        help="Only compare listing memory, next-video queries and reloads: dicts vs manifest")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="Seconds per caption generation")
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0)
+    parser.add_argument('--retry-budget', type=float, default=0,
+                        help="Per-run retry budget in seconds (0 fails fast instead of sleeping)")
+    parser.add_argument('--mongo-uri', default=None,
+                        help="Use a local mongod instead of mongomock (a throwaway database is used)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for failure injection")
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (faster, no peak memory)")
+    parser.add_argument('--json', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the workflow's own output")
+    return parser.parse_args(argv)
+
+
+def create_mongo_client(mongo_uri=None):
+    """Connect to a local mongod, or create an in-memory mongomock client"""
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)
+    try:
+        import mongomock
+    except ImportError:
+        print("✗ mongomock is not installed (pip install -r requirements-dev.txt), or pass --mongo-uri")
+        sys.exit(1)
+    return mongomock.MongoClient()
+
+
+def build_config(args, database, videos_per_day):
+    """Config for one run where exactly the next uploads are due"""
+    upload_options = {'segment_size_mb': args.segment_kb / 1024, 'max_resumes': 10}
+    config = {
+        'instagram': {'username': 'benchmark', 'password': 'benchmark', 'upload': upload_options},
+        'google_drive': {
+            'credentials_file': 'unused.json',
+            'folder_id': 'benchmark-folder',
+            'compact_listing': args.compact_listing
+        },
+        'mongodb': {'connection_string': None, 'database': database, 'collection': 'uploaded_videos'},
+        'ai': {'default_caption': 'Benchmark video'},
+        'posting': {
+            'videos_per_day': videos_per_day,
+            # Every slot is at midnight so all of today's quota is due now
+            'upload_times': ['00:00'] * videos_per_day,
+            'jitter_minutes': 0,
+            'min_interval_minutes': 0,
+            'burst': max(1, args.per_run)
+        },
+        # Fake videos are not decodable, so only the md5 check applies
+        'duplicates': {'enabled': True, 'fingerprint': False},
+        'metrics': {'json_path': ''},
+        'retry': {'budget_seconds': args.retry_budget}
+    }
+    if args.accounts:
+        config['accounts'] = [{'username': f"benchmark{i}", 'upload': upload_options} for i in range(args.accounts)]
+    return config
+
+
+def count_uploads(client, database):
+    """Uploads recorded so far across all upload collections"""
+    db = client[database]
+    return sum(
+        db[name].count_documents({})
+        for name in db.list_collection_names()
+        if name.startswith('uploaded_videos')
+    )
+
+
+def run_benchmark(args):
+    """
+    Run the benchmark
+    
+    Returns:
+        dict of results
+    """
+    folder = FakeDriveFolder(file_count=args.files, file_size=args.file_size_kb * 1024)
+    drive_http = FakeDriveHttp(folder, FaultProfile(
+        args.drive_latency, args.drive_bandwidth, args.drive_failure_rate, seed=args.seed
+    ))
+    ig_profile = FaultProfile(args.ig_latency, args.ig_bandwidth, args.ig_failure_rate, seed=args.seed + 1)
+    rupload = FakeRuploadServer(ig_profile) if args.rupload else None
+    # With the stand-in, transfer time and failures are charged to it
+    ig_client = FakeInstagramClient(FaultProfile(args.ig_latency) if rupload else ig_profile)
+    llm = FakeLLM(FaultProfile(args.llm_latency, failure_rate=args.llm_failure_rate, seed=args.seed + 2))
+    mongo_client = create_mongo_client(args.mongo_uri)
+    database = f"ig_automation_benchmark_{os.getpid()}"
+    
+    uploader = functools.partial(FakeInstagramUploader, client=ig_client, rupload=rupload)
+    patches = [
+        mock.patch.object(main, 'GoogleDriveDownloader', functools.partial(FakeDriveDownloader, http=drive_http)),
+        mock.patch.object(main, 'InstagramUploader', uploader),
+        mock.patch.object(multi_account, 'InstagramUploader', uploader),
+        mock.patch.object(main, 'MongoVideoTracker', functools.partial(MongoVideoTracker, client=mongo_client)),
+        mock.patch.object(multi_account, 'MongoVideoTracker', functools.partial(MongoVideoTracker, client=mongo_client)),
+        mock.patch.object(main, 'AICaptionGenerator', functools.partial(FakeCaptionGenerator, gemini=llm, openai=llm))
+    ]
+    
+    per_run = 1 if args.accounts else max(1, args.per_run)
+    stages = {}
+    counters = {}
+    run_seconds = []
+    failed_runs = 0
+    config_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    config_file.close()
+    
+    if not args.no_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            
+            for i in range(args.iterations):
+                with open(config_file.name, 'w') as f:
+                    json.dump(build_config(args, database, (i + 1) * per_run), f)
+                
+                output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                run_start = time.perf_counter()
+                try:
+                    with output:
+                        main.main(['--config', config_file.name])
+                except SystemExit:
+                    failed_runs += 1
+                run_seconds.append(time.perf_counter() - run_start)
+                
+                # main() resets the metrics at the start of every run
+                for stage, values in metrics.stages.items():
+                    stages.setdefault(stage, []).extend(values)
+                for name, value in metrics.counters.items():
+                    counters[name] = counters.get(name, 0) + value
+        elapsed = time.perf_counter() - started
+    finally:
+        peak_memory = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        os.remove(config_file.name)
+        if rupload:
+            rupload.close()
+    
+    uploads = count_uploads(mongo_client, database)
+    mongo_client.drop_database(database)
+    mongo_client.close()
+    
+    return {
+        'files': args.files,
+        'iterations': args.iterations,
+        'failed_runs': failed_runs,
+        'uploads': uploads,
+        'uploads_expected': args.iterations * per_run * max(1, args.accounts),
+        'elapsed_seconds': elapsed,
+        'uploads_per_second': uploads / elapsed if elapsed else 0.0,
+        'run_p50_seconds': percentile(run_seconds, 0.50),
+        'run_p99_seconds': percentile(run_seconds, 0.99),
+        'stages': {
+            stage: {
+                'count': len(values),
+                'p50_seconds': percentile(values, 0.50),
+                'p99_seconds': percentile(values, 0.99),
+                'max_seconds': max(values)
+            }
+            for stage, values in stages.items()
+        },
+        'counters': counters,
+        'rupload': {
+            'bytes_received': rupload.bytes_received,
+            'disconnects': rupload.disconnects
+        } if rupload else None,
+        'peak_memory_bytes': peak_memory
+    }
+
+
+def _traced(build):
+    """Call build() and return its result with the memory it still holds"""
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def run_listing_benchmark(args):
+    """
+    Compare a folder listing held as Drive file dicts with a VideoManifest
+    
+    Measures retained memory, the time to find the next videos when the
+    oldest half of the folder is already uploaded (for the manifest, with
+    the selection kept across queries as get_next_videos does, and its
+    one-time build separately), and save/reload of the listing (JSON for
+    dicts, the binary manifest format).
+    
+    Returns:
+        dict of results
+    """
+    folder = FakeDriveFolder(file_count=args.files, file_size=args.file_size_kb * 1024)
+    # Fresh copies, as list_videos would return them
+    videos, dict_bytes = _traced(lambda: [
+        dict(json.loads(json.dumps(video)), folder_id=folder.folder_id) for video in folder.files
+    ])
+    manifest, manifest_bytes = _traced(lambda: VideoManifest.from_videos(videos))
+    uploaded = {video['id'] for video in videos[:len(videos) // 2]}
+    count = max(1, args.per_run)
+    
+    def timed(func, repeat=5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - started) / repeat
+    
+    dict_next, dict_query = timed(lambda: [
+        video for _, video in zip(range(count), (v for v in videos if v['id'] not in uploaded))
+    ])
+    selection, selection_build = timed(lambda: manifest.selection(uploaded), repeat=1)
+    manifest_next, manifest_query = timed(lambda: [
+        video for _, video in zip(range(count), selection.available())
+    ])
+    
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'listing.json')
+        manifest_path = os.path.join(directory, 'listing.manifest')
+        with open(json_path, 'w') as f:
+            json.dump(videos, f)
+        manifest.save(manifest_path)
+        
+        def load_json():
+            with open(json_path) as f:
+                return json.load(f)
+        
+        _, json_load = timed(load_json)
+        _, manifest_load = timed(lambda: VideoManifest.load(manifest_path))
+        json_size = os.path.getsize(json_path)
+        manifest_size = os.path.getsize(manifest_path)
+    
+    return {
+        'files': args.files,
+        'same_selection': [v['id'] for v in dict_next] == [v['id'] for v in manifest_next],
+        'dicts': {'memory_bytes': dict_bytes, 'next_seconds': dict_query, 'file_bytes': json_size,
+                  'load_seconds': json_load},
+        'manifest': {'memory_bytes': manifest_bytes, 'next_seconds': manifest_query, 'file_bytes': manifest_size,
+                     'load_seconds': manifest_load, 'selection_seconds': selection_build}
+    }
+
+
+def print_listing_results(results):
+    """Print a listing benchmark summary"""
+    print("=" * 60)
+    print("LISTING BENCHMARK RESULTS")
+    print("=" * 60)
+    print(f"Folder size: {results['files']} videos, oldest half uploaded")
+    print(f"{'':10} {'memory':>10} {'next videos':>12} {'file':>10} {'reload':>10}")
+    for name in ('dicts', 'manifest'):
+        values = results[name]
+        print(f"{name:10} {values['memory_bytes'] / (1024 * 1024):>8.1f}MB "
+              f"{values['next_seconds'] * 1000:>10.2f}ms "
+              f"{values['file_bytes'] / (1024 * 1024):>8.1f}MB "
+              f"{values['load_seconds'] * 1000:>8.1f}ms")
+    print(f"Manifest selection built once in {results['manifest']['selection_seconds'] * 1000:.1f}ms")
+    if not results['same_selection']:
+        print("✗ The manifest selected different videos")
+    print("=" * 60)
+
+
+def print_results(results):
+    """Print a benchmark summary"""
+    print("=" * 60)
+    print("BENCHMARK RESULTS")
+    print("=" * 60)
+    print(f"Folder size: {results['files']} videos, {results['iterations']} run(s)")
+    print(f"Uploads: {results['uploads']}/{results['uploads_expected']} in "
+          f"{results['elapsed_seconds']:.2f}s ({results['uploads_per_second']:.1f}/s)")
+    if results['failed_runs']:
+        print(f"Failed runs: {results['failed_runs']}")
+    print(f"Run latency: p50 {results['run_p50_seconds'] * 1000:.1f}ms, "
+          f"p99 {results['run_p99_seconds'] * 1000:.1f}ms")
+    print("Stage latency:")
+    for stage, values in sorted(results['stages'].items()):
+        print(f"  {stage}: p50 {values['p50_seconds'] * 1000:.1f}ms, "
+              f"p99 {values['p99_seconds'] * 1000:.1f}ms, "
+              f"max {values['max_seconds'] * 1000:.1f}ms ({values['count']} calls)")
+    print("Counters:")
+    for name, value in sorted(results['counters'].items()):
+        print(f"  {name}: {value}")
+    if results['rupload']:
+        print(f"Rupload stand-in: {results['rupload']['bytes_received'] / (1024 * 1024):.1f}MB received, "
+              f"{results['rupload']['disconnects']} dropped connection(s)")
+    if results['peak_memory_bytes'] is not None:
+        print(f"Peak memory: {results['peak_memory_bytes'] / (1024 * 1024):.1f}MB")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.listing_memory:
+        results = run_listing_benchmark(args)
+        print_listing_results(results)
+    else:
+        results = run_benchmark(args)
+        print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,97 @@
+"""
+Pooled keep-alive HTTP transport for the Google Drive API
+Shares one thread-safe connection pool between listing and download threads
+"""
+import threading
+import httplib2
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import AuthorizedSession
+from metrics import metrics
+
+
+class DriveTransport:
+    def __init__(self, credentials, pool_size=10, connect_timeout=10, read_timeout=120):
+        """
+        Initialize the Drive transport
+        
+        The object implements the small part of the httplib2.Http interface
+        used by googleapiclient, so it can be passed to build(http=...).
+        Requests go through a requests/urllib3 connection pool, which keeps
+        connections alive and is safe to share between threads.
+        
+        Args:
+            credentials: google-auth credentials (service account or OAuth)
+            pool_size: Maximum number of pooled connections per host
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds to wait for response data
+        """
+        self.credentials = credentials
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = AuthorizedSession(credentials)
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            pool_block=True
+        ))
+        self._refresh_lock = threading.Lock()
+    
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5,
+                connection_type=None):
+        """
+        Perform a request (httplib2.Http.request signature)
+        
+        Returns:
+            Tuple of (httplib2.Response, content bytes)
+        """
+        # Refresh once under a lock instead of letting every thread
+        # race to mint a new token when it expires
+        if not self.credentials.valid:
+            with self._refresh_lock:
+                if not self.credentials.valid:
+                    self.credentials.refresh(self.session._auth_request)
+        
+        metrics.incr('drive_api_calls')
+        response = self.session.request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=redirections > 0
+        )
+        content = response.content
+        
+        info = {key.lower(): value for key, value in response.headers.items()}
+        info['status'] = str(response.status_code)
+        # requests already decoded the body, so describe what we return
+        if info.pop('content-encoding', None):
+            info['content-length'] = str(len(content))
+        return httplib2.Response(info), content
+    
+    def connection_stats(self):
+        """
+        Get connection reuse statistics for the pool
+        
+        Returns:
+            dict with requests, connections and reuse_rate (0-1)
+        """
+        requests_made = 0
+        connections = 0
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_made += pool.num_requests
+                connections += pool.num_connections
+        reuse_rate = 1 - connections / requests_made if requests_made else 0.0
+        return {
+            'requests': requests_made,
+            'connections': connections,
+            'reuse_rate': reuse_rate
+        }
+    
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
@@ -0,0 +1,329 @@
+"""
+Push-driven Drive ingestion for daemon mode
+Registers a Drive changes.watch channel, receives its notifications on a
+small local HTTP server and keeps the folder listing current from the
+change feed, so new videos are seen within seconds without relisting.
+With google_drive.compact_listing the listing stays a VideoManifest and each
+batch of changes is merged into a new one.
+"""
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google_drive import LIST_FIELDS
+from manifest import VideoManifest
+from resilience import retry_call
+from metrics import metrics
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+CHANGE_FIELDS = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({LIST_FIELDS}, parents, trashed))"
+
+
+def is_video(file):
+    """Same filter as the folder listing query"""
+    name = file.get('name', '').lower()
+    return 'video/' in file.get('mimeType', '') or any(ext in name for ext in VIDEO_EXTENSIONS)
+
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        accepted = self.server.watcher.notify(
+            self.headers.get('X-Goog-Channel-ID'),
+            self.headers.get('X-Goog-Channel-Token'),
+            self.headers.get('X-Goog-Resource-State')
+        )
+        self.send_response(200 if accepted else 403)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class DriveWatcher:
+    def __init__(self, drive, address=None, host='0.0.0.0', port=8085, channel_ttl_hours=24,
+                 renew_before_minutes=30, fallback_poll_minutes=30, debounce_seconds=2):
+        """
+        Initialize the Drive watcher
+        
+        Args:
+            drive: Authenticated GoogleDriveDownloader
+            address: Public HTTPS URL that forwards to the receiver (Drive
+                     only delivers to HTTPS); without it the watcher polls
+                     the change feed every fallback_poll_minutes
+            host: Interface the notification receiver listens on
+            port: Port the notification receiver listens on
+            channel_ttl_hours: Requested channel lifetime (Drive caps it)
+            renew_before_minutes: Replace the channel this long before it expires
+            fallback_poll_minutes: Read the change feed anyway when no
+                                   notification arrived for this long
+            debounce_seconds: Wait this long after a notification so a
+                              burst of changes is read in one request
+        """
+        self.drive = drive
+        self.address = address
+        self.host = host
+        self.port = port
+        self.channel_ttl = channel_ttl_hours * 3600
+        self.renew_before = renew_before_minutes * 60
+        self.fallback_poll = fallback_poll_minutes * 60
+        self.debounce = debounce_seconds
+        self.folder_ids = {folder['id'] for folder in drive.folders}
+        
+        self._videos = {}
+        self._ordered = None
+        # Compact listing: the manifest, and changes not merged into it yet
+        # (file ID to Drive file dict, or None when removed)
+        self._manifest = None
+        self._pending = {}
+        self._page_token = None
+        self._channels = []
+        self._channel_token = secrets.token_urlsafe(24)
+        self._retry_at = 0.0
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._notified = threading.Event()
+        self._new_videos = threading.Event()
+        self._stopped = threading.Event()
+    
+    def start(self):
+        """List the folders once, then follow the change feed in the background"""
+        service = self.drive.service
+        self._page_token = retry_call(
+            service.changes().getStartPageToken().execute, description="Drive change feed token"
+        )['startPageToken']
+        listing = self.drive.list_videos()
+        if isinstance(listing, VideoManifest):
+            self._manifest = listing
+        else:
+            for video in listing:
+                self._videos[video['id']] = video
+        
+        if self.address:
+            self._server = ThreadingHTTPServer((self.host, self.port), _NotificationHandler)
+            self._server.daemon_threads = True
+            self._server.watcher = self
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            self._register()
+        else:
+            print(f"No watch address configured, polling Drive changes every {self.fallback_poll / 60:.0f} min")
+        
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+    
+    def videos(self):
+        """
+        Current folder listing, oldest first (like list_videos)
+        
+        Returns:
+            List of Drive file dicts, or a VideoManifest with compact_listing
+        """
+        with self._lock:
+            if self._manifest is not None:
+                return self._manifest
+            if self._ordered is None:
+                self._ordered = sorted(self._videos.values(), key=lambda video: video.get('createdTime', ''))
+            return self._ordered
+    
+    def wait_for_changes(self, timeout):
+        """
+        Sleep until new videos arrive or the timeout passes
+        
+        Returns:
+            True if new videos were added to the listing
+        """
+        changed = self._new_videos.wait(timeout)
+        self._new_videos.clear()
+        return changed
+    
+    def notify(self, channel_id, token, state):
+        """
+        Handle one notification (called by the receiver)
+        
+        Returns:
+            True if it came from one of our channels
+        """
+        with self._lock:
+            known = any(channel['id'] == channel_id for channel in self._channels)
+        if not known or token != self._channel_token:
+            return False
+        # 'sync' only confirms that the channel was created
+        if state != 'sync':
+            metrics.incr('drive_notifications')
+            self._notified.set()
+        return True
+    
+    def _register(self):
+        """Open a new channel on the change feed"""
+        body = {
+            'id': str(uuid.uuid4()),
+            'type': 'web_hook',
+            'address': self.address,
+            'token': self._channel_token,
+            'expiration': int((time.time() + self.channel_ttl) * 1000)
+        }
+        try:
+            channel = retry_call(
+                self.drive.service.changes().watch(pageToken=self._page_token, body=body).execute,
+                description="Drive watch"
+            )
+        except Exception as e:
+            print(f"✗ Could not register Drive watch channel, polling instead: {e}")
+            return False
+        expiration = int(channel.get('expiration') or body['expiration']) / 1000
+        # Renew renew_before ahead of expiry, but never in the first half of
+        # the channel's life in case Drive granted a short lifetime
+        renew_at = max(expiration - self.renew_before, (time.time() + expiration) / 2)
+        with self._lock:
+            self._channels.append({
+                'id': channel['id'], 'resourceId': channel['resourceId'],
+                'expiration': expiration, 'renew_at': renew_at
+            })
+        print(f"✓ Watching Drive changes (channel expires {time.strftime('%Y-%m-%d %H:%M', time.gmtime(expiration))} UTC)")
+        return True
+    
+    def _stop_channel(self, channel):
+        try:
+            self.drive.service.channels().stop(body={'id': channel['id'], 'resourceId': channel['resourceId']}).execute()
+        except Exception as e:
+            print(f"Note: Could not stop Drive watch channel: {e}")
+        with self._lock:
+            self._channels = [c for c in self._channels if c['id'] != channel['id']]
+    
+    def _renew(self):
+        """Replace the channel before it expires; the old one keeps working until the new one is up"""
+        with self._lock:
+            old = list(self._channels)
+        if not self._register():
+            with self._lock:
+                self._channels = [c for c in self._channels if c['expiration'] > time.time()]
+            return False
+        for channel in old:
+            self._stop_channel(channel)
+        return True
+    
+    def _next_renewal(self):
+        """Time the channel should be replaced (or registered again after a failure)"""
+        if not self.address:
+            return None
+        with self._lock:
+            if self._channels:
+                due = max(channel['renew_at'] for channel in self._channels)
+            else:
+                due = time.time()
+        return max(due, self._retry_at)
+    
+    def _run(self):
+        poll_at = time.time() + self.fallback_poll
+        while not self._stopped.is_set():
+            renew_at = self._next_renewal()
+            wake_at = poll_at if renew_at is None else min(poll_at, renew_at)
+            notified = self._notified.wait(max(0.0, wake_at - time.time()))
+            if self._stopped.is_set():
+                break
+            if notified:
+                # Let a burst of changes settle into one feed read
+                self._stopped.wait(self.debounce)
+                self._notified.clear()
+            
+            now = time.time()
+            if renew_at is not None and now >= renew_at and not self._renew():
+                self._retry_at = now + min(self.fallback_poll, 300)
+            if notified or now >= poll_at:
+                if not notified and self.address:
+                    print("No Drive notifications lately, checking the change feed")
+                self._pull_changes()
+                poll_at = time.time() + self.fallback_poll
+    
+    def _pull_changes(self):
+        """Apply the change feed since the last page token to the listing"""
+        service = self.drive.service
+        token = self._page_token
+        added = 0
+        try:
+            while token:
+                results = retry_call(
+                    service.changes().list(
+                        pageToken=token,
+                        pageSize=1000,
+                        spaces='drive',
+                        includeRemoved=True,
+                        fields=CHANGE_FIELDS
+                    ).execute,
+                    description="Drive changes"
+                )
+                for change in results.get('changes', []):
+                    added += self._apply(change)
+                if 'newStartPageToken' in results:
+                    self._page_token = results['newStartPageToken']
+                token = results.get('nextPageToken')
+        except Exception as e:
+            print(f"✗ Error reading Drive changes: {e}")
+        self._merge_pending()
+        
+        if added:
+            print(f"✓ {added} new video(s) in Google Drive")
+            metrics.incr('drive_new_videos', added)
+            self._new_videos.set()
+    
+    def _apply(self, change):
+        """Update the listing from one change; returns 1 if a new video was added"""
+        file = change.get('file') or {}
+        folder_id = next((parent for parent in file.get('parents', []) if parent in self.folder_ids), None)
+        if change.get('removed') or file.get('trashed') or not folder_id or not is_video(file):
+            video = None
+        else:
+            video = {key: value for key, value in file.items() if key not in ('parents', 'trashed')}
+            video['folder_id'] = folder_id
+        file_id = change.get('fileId')
+        with self._lock:
+            if self._manifest is not None:
+                if file_id in self._pending:
+                    known = self._pending[file_id] is not None
+                else:
+                    known = self._manifest.index_of(file_id) is not None
+                if video or known:
+                    self._pending[file_id] = video
+                return 1 if video and not known else 0
+            self._ordered = None
+            if not video:
+                self._videos.pop(file_id, None)
+                return 0
+            new = video['id'] not in self._videos
+            self._videos[video['id']] = video
+            return 1 if new else 0
+    
+    def _merge_pending(self):
+        """Replace the manifest with one that includes the pending changes"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        added = [video for video in pending.values() if video]
+        removed = [file_id for file_id, video in pending.items() if not video]
+        manifest = self._manifest.updated(added, removed)
+        with self._lock:
+            self._manifest = manifest
+    
+    def stop(self):
+        """Stop the channel, the receiver and the background thread"""
+        self._stopped.set()
+        self._notified.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            self._stop_channel(channel)
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
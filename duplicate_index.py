@@ -0,0 +1,271 @@
+"""
+Content-level duplicate detection index
+Matches videos by Drive md5 checksum and by a perceptual frame fingerprint,
+so re-uploads of the same clip under a new file ID or name are not posted twice
+"""
+from datetime import datetime
+from metrics import metrics
+
+
+# Each 64-bit frame hash is split into bands, and the multikey index looks up
+# videos sharing at least one band. Two fingerprints are only guaranteed to
+# share a band when they differ in fewer bits overall than they have bands,
+# i.e. at most 3 bits per frame on average; matches up to max_distance are
+# found when any band survives intact, which is likely but not guaranteed
+BAND_BITS = 16
+BANDS_PER_HASH = 64 // BAND_BITS
+
+# Marker document recording that the upload history has been indexed
+BACKFILL_MARKER = '__backfill__'
+
+
+def compute_fingerprint(video_path, samples=5, hash_size=8):
+    """
+    Compute a compact perceptual fingerprint for a video
+    
+    Samples evenly spaced frames and computes a difference hash (dHash)
+    for each one.
+    
+    Args:
+        video_path: Path to the local video file
+        samples: Number of frames to sample
+        hash_size: Hash grid size (8 gives 64-bit hashes)
+    
+    Returns:
+        List of hex frame hashes or None if the video could not be read
+    """
+    try:
+        from moviepy.editor import VideoFileClip
+        from PIL import Image
+        
+        clip = VideoFileClip(video_path, audio=False)
+        try:
+            duration = clip.duration or 0
+            hashes = []
+            for i in range(samples):
+                # Skip the very first/last frames, which are often black
+                t = duration * (i + 1) / (samples + 1)
+                frame = clip.get_frame(t)
+                image = Image.fromarray(frame).convert('L').resize(
+                    (hash_size + 1, hash_size), Image.LANCZOS
+                )
+                pixels = list(image.getdata())
+                value = 0
+                for row in range(hash_size):
+                    offset = row * (hash_size + 1)
+                    for col in range(hash_size):
+                        value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+                hashes.append(f"{value:016x}")
+            return hashes
+        finally:
+            clip.close()
+    except Exception as e:
+        print(f"Note: Could not fingerprint video: {e}")
+        return None
+
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two hex frame hashes"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def fingerprint_bands(fingerprint):
+    """Bucket keys for a fingerprint (frame index, band index, band value)"""
+    keys = []
+    mask = (1 << BAND_BITS) - 1
+    for frame, frame_hash in enumerate(fingerprint):
+        value = int(frame_hash, 16)
+        for band in range(BANDS_PER_HASH):
+            keys.append(f"{frame}:{band}:{(value >> (band * BAND_BITS)) & mask:04x}")
+    return keys
+
+
+class DuplicateIndex:
+    def __init__(self, database, collection_name='video_fingerprints', max_distance=8):
+        """
+        Initialize duplicate index
+        
+        Args:
+            database: pymongo Database to store the index in
+            collection_name: Collection name for fingerprints
+            max_distance: Maximum average Hamming distance per frame
+                          for two videos to be considered the same
+        """
+        self.collection = database[collection_name]
+        self.max_distance = max_distance
+        
+        self.collection.create_index("file_id", unique=True)
+        self.collection.create_index("md5")
+        self.collection.create_index("bands")
+    
+    def find_by_md5(self, md5):
+        """
+        Look up an indexed video with the same Drive md5 checksum
+        
+        Returns:
+            Matching index document or None
+        """
+        if not md5:
+            return None
+        try:
+            return self.collection.find_one({'md5': md5})
+        except Exception as e:
+            print(f"Error looking up md5: {e}")
+            return None
+    
+    def find_similar(self, fingerprint):
+        """
+        Look up an indexed video with a near-identical fingerprint
+        
+        Only documents sharing at least one band bucket are compared,
+        so the lookup does not scan the whole collection (see BAND_BITS
+        for which matches that guarantees).
+        
+        Returns:
+            Closest matching index document or None
+        """
+        if not fingerprint:
+            return None
+        try:
+            candidates = self.collection.find(
+                {'bands': {'$in': fingerprint_bands(fingerprint)}},
+                {'file_id': 1, 'file_name': 1, 'fingerprint': 1, 'duplicate_of': 1}
+            )
+            best, best_distance = None, None
+            for doc in candidates:
+                other = doc.get('fingerprint') or []
+                if len(other) != len(fingerprint):
+                    continue
+                distance = sum(hamming_distance(a, b) for a, b in zip(fingerprint, other)) / len(other)
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best, best_distance = doc, distance
+            return best
+        except Exception as e:
+            print(f"Error looking up fingerprint: {e}")
+            return None
+    
+    def check_metadata(self, video):
+        """
+        Check a Drive file listing entry before it is downloaded
+        
+        Args:
+            video: Drive file dict (uses 'id' and 'md5Checksum')
+        
+        Returns:
+            Reason string if the video is a duplicate, None otherwise
+        """
+        match = self.find_by_md5(video.get('md5Checksum'))
+        if match and match['file_id'] != video['id']:
+            self.register(video['id'], video['name'], md5=video.get('md5Checksum'),
+                          duplicate_of=match.get('duplicate_of') or match['file_id'])
+            return f"duplicate of {match.get('file_name', match['file_id'])} (md5)"
+        return None
+    
+    def check_fingerprint(self, video, fingerprint):
+        """
+        Check a downloaded video's fingerprint before it is uploaded
+        
+        Returns:
+            Reason string if the video is a duplicate, None otherwise
+        """
+        match = self.find_similar(fingerprint)
+        if match and match['file_id'] != video['id']:
+            self.register(video['id'], video['name'], md5=video.get('md5Checksum'),
+                          fingerprint=fingerprint,
+                          duplicate_of=match.get('duplicate_of') or match['file_id'])
+            return f"duplicate of {match.get('file_name', match['file_id'])} (fingerprint)"
+        return None
+    
+    def check_download(self, video, video_path, samples=5):
+        """
+        Fingerprint a downloaded video and check it against the index
+        
+        Args:
+            video: Drive file dict
+            video_path: Path to the downloaded video
+            samples: Number of frames to sample
+        
+        Returns:
+            Tuple of (fingerprint, reason); reason is None unless the
+            video is a duplicate
+        """
+        with metrics.span('probe'):
+            fingerprint = compute_fingerprint(video_path, samples=samples)
+        return fingerprint, self.check_fingerprint(video, fingerprint)
+    
+    def backfill(self, get_uploaded_ids, list_videos):
+        """
+        Index the md5 checksums of videos uploaded before the index existed, once
+        
+        The upload history only holds file IDs, so checksums are taken from
+        the folder listing; uploaded videos no longer in the folder cannot
+        be backfilled. The upload history and the listing are only requested
+        if the backfill has not run yet.
+        
+        Args:
+            get_uploaded_ids: Callable returning the file IDs of already
+                              uploaded videos (all accounts)
+            list_videos: Callable returning the folder listing
+        """
+        try:
+            if self.collection.find_one({'file_id': BACKFILL_MARKER}):
+                return
+            uploaded_ids = set(get_uploaded_ids())
+            indexed = 0
+            if uploaded_ids:
+                listed = 0
+                for video in list_videos():
+                    listed += 1
+                    if video['id'] in uploaded_ids and video.get('md5Checksum'):
+                        # Keep a fingerprint registered since then
+                        self.collection.update_one(
+                            {'file_id': video['id']},
+                            {'$set': {'md5': video['md5Checksum']},
+                             '$setOnInsert': {'file_name': video['name'], 'indexed_at': datetime.utcnow()}},
+                            upsert=True
+                        )
+                        indexed += 1
+                if not listed:
+                    # A failed listing comes back empty; leave the marker to
+                    # a run that can list the folder
+                    print("Note: Duplicate index backfill postponed, the folder listing was empty")
+                    return
+            self.collection.update_one(
+                {'file_id': BACKFILL_MARKER},
+                {'$setOnInsert': {'indexed_at': datetime.utcnow(), 'videos': indexed}},
+                upsert=True
+            )
+            if indexed:
+                print(f"✓ Backfilled duplicate index from {indexed} uploaded video(s)")
+        except Exception as e:
+            # Retried on the next run, since the marker was not written
+            print(f"Note: Could not backfill duplicate index: {e}")
+    
+    def register(self, file_id, file_name, md5=None, fingerprint=None, duplicate_of=None):
+        """
+        Add or update a video in the index
+        
+        Args:
+            file_id: Google Drive file ID
+            file_name: Name of the video file
+            md5: Drive md5 checksum
+            fingerprint: Frame hashes from compute_fingerprint
+            duplicate_of: File ID of the original if this is a known duplicate
+        """
+        try:
+            document = {
+                'file_id': file_id,
+                'file_name': file_name,
+                'indexed_at': datetime.utcnow()
+            }
+            if md5:
+                document['md5'] = md5
+            if fingerprint:
+                document['fingerprint'] = fingerprint
+                document['bands'] = fingerprint_bands(fingerprint)
+            if duplicate_of:
+                document['duplicate_of'] = duplicate_of
+            
+            self.collection.update_one({'file_id': file_id}, {'$set': document}, upsert=True)
+        except Exception as e:
+            print(f"Error registering video in duplicate index: {e}")
@@ -0,0 +1,623 @@
+"""
+In-process fakes for offline benchmarking
+Stand-ins for the Google Drive API, the instagrapi Client, Instagram's
+rupload endpoint and the Gemini / OpenAI clients, with configurable
+latency, bandwidth and failure injection
+"""
+import email.parser
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+import httplib2
+import requests
+from googleapiclient.discovery import build
+from google_drive import GoogleDriveDownloader
+from instagram_uploader import InstagramUploader
+from instagrapi.exceptions import ClientError
+from ai_caption import AICaptionGenerator
+from metrics import metrics
+
+
+class FaultProfile:
+    def __init__(self, latency=0.0, bandwidth=None, failure_rate=0.0, seed=None, sleep=time.sleep):
+        """
+        Latency, bandwidth and failure settings for one fake service
+        
+        Args:
+            latency: Mean seconds added to every call (uniformly jittered +/-50%)
+            bandwidth: Bytes per second for payloads, None for unlimited
+            failure_rate: Probability (0-1) that a call fails
+            seed: Optional random seed for reproducible runs
+            sleep: Callable used to wait (seconds), e.g. a virtual clock's
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.sleep = sleep
+        self._lock = threading.Lock()
+    
+    def delay(self, size=0):
+        """Sleep for one call's latency plus the transfer time of size bytes"""
+        with self._lock:
+            seconds = self.latency * self._random.uniform(0.5, 1.5) if self.latency else 0.0
+        if size and self.bandwidth:
+            seconds += size / self.bandwidth
+        if seconds > 0:
+            self.sleep(seconds)
+    
+    def should_fail(self):
+        """Decide whether the current call fails"""
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+
+class ServiceUnavailable(Exception):
+    """Transient provider error (classified as retryable by name)"""
+
+
+class ClientConnectionError(Exception):
+    """Dropped upload connection (classified as retryable by name)"""
+
+
+class FakeDriveFolder:
+    def __init__(self, file_count=1000, file_size=1024 * 1024, folder_id='benchmark-folder', files=None):
+        """
+        Generated Drive folder contents
+        
+        Args:
+            file_count: Number of videos in the folder
+            file_size: Size of every video in bytes
+            folder_id: Folder ID reported for the files
+            files: Optional recorded listing (Drive file dicts) to serve
+                   instead of generated files
+        """
+        self.folder_id = folder_id
+        self.file_size = file_size
+        self.files = list(files or [])
+        for i in range(0 if files else file_count):
+            self.files.append(self._generate(i))
+        self.by_id = {video['id']: video for video in self.files}
+        # IDs of changed files in order; a change feed page token is an index
+        self.changes = []
+        # Content is a repeated block so large folders cost no memory
+        self._block = hashlib.sha256(folder_id.encode()).digest() * 2048
+    
+    def _generate(self, i):
+        file_id = f"file{i:07d}"
+        return {
+            'id': file_id,
+            'name': f"video_{i:07d}.mp4",
+            'mimeType': 'video/mp4',
+            'size': str(self.file_size),
+            'md5Checksum': hashlib.md5(file_id.encode()).hexdigest(),
+            'createdTime': (datetime(2024, 1, 1) + timedelta(minutes=i)).isoformat() + 'Z',
+            'videoMediaMetadata': {'width': 1080, 'height': 1920, 'durationMillis': '30000'}
+        }
+    
+    def add_video(self):
+        """Add a generated video, recorded in the change feed"""
+        video = self._generate(len(self.files))
+        self.files.append(video)
+        self.by_id[video['id']] = video
+        self.changes.append(video['id'])
+        return video
+    
+    def remove_video(self, file_id):
+        """Delete a video, recorded in the change feed"""
+        video = self.by_id.pop(file_id)
+        self.files.remove(video)
+        self.changes.append(file_id)
+    
+    def content(self, start, end):
+        """Bytes start..end (inclusive) of any file"""
+        length = end - start + 1
+        offset = start % len(self._block)
+        repeats = (offset + length) // len(self._block) + 1
+        return (self._block * repeats)[offset:offset + length]
+
+
+class FakeDriveHttp:
+    def __init__(self, folder, profile=None):
+        """
+        Fake Drive API transport
+        
+        Implements the httplib2.Http.request interface, like DriveTransport,
+        so the real googleapiclient service, batch requests and
+        MediaIoBaseDownload all run against it.
+        
+        Args:
+            folder: FakeDriveFolder served by the fake API
+            profile: FaultProfile for every request
+        """
+        self.folder = folder
+        self.profile = profile or FaultProfile()
+        self.requests = 0
+        self.channels = {}
+        # File ID to statuses its next metadata requests fail with
+        self.item_failures = {}
+        self._lock = threading.Lock()
+    
+    def fail_item(self, file_id, *statuses):
+        """
+        Make the next metadata requests for one file fail, e.g. inside a batch
+        
+        Args:
+            file_id: Drive file ID
+            statuses: HTTP statuses returned by the next requests, in order
+        """
+        with self._lock:
+            self.item_failures.setdefault(file_id, []).extend(statuses)
+    
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5,
+                connection_type=None):
+        """
+        Perform a request (httplib2.Http.request signature)
+        
+        Returns:
+            Tuple of (httplib2.Response, content bytes)
+        """
+        with self._lock:
+            self.requests += 1
+        metrics.incr('drive_api_calls')
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        
+        if self.profile.should_fail():
+            self.profile.delay()
+            return self._json(503, {'error': {'code': 503, 'message': 'Backend Error'}})
+        
+        parts = urlsplit(uri)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path.startswith('/batch/'):
+            self.profile.delay()
+            return self._batch(body, headers)
+        if parts.path.startswith(('/drive/v3/changes', '/drive/v3/channels')):
+            self.profile.delay()
+            return self._changes(method, parts.path, query, json.loads(body) if body else {})
+        return self._call(method, parts.path, query, headers)
+    
+    def _changes(self, method, path, query, body):
+        """Change feed, watch channels and channel stop"""
+        changes = self.folder.changes
+        if path == '/drive/v3/changes/startPageToken':
+            return self._json(200, {'startPageToken': str(len(changes))})
+        if path == '/drive/v3/changes' and method == 'GET':
+            start = int(query['pageToken'])
+            end = min(len(changes), start + int(query.get('pageSize', 100)))
+            page = {'changes': [
+                {'fileId': file_id, 'removed': False,
+                 'file': dict(self.folder.by_id[file_id], parents=[self.folder.folder_id], trashed=False)}
+                if file_id in self.folder.by_id else {'fileId': file_id, 'removed': True}
+                for file_id in changes[start:end]
+            ]}
+            if end < len(changes):
+                page['nextPageToken'] = str(end)
+            else:
+                page['newStartPageToken'] = str(end)
+            return self._json(200, page)
+        if path == '/drive/v3/changes/watch':
+            channel = dict(body, resourceId=f"resource-{body['id']}", expiration=str(body['expiration']))
+            with self._lock:
+                self.channels[body['id']] = channel
+            return self._json(200, dict(channel, kind='api#channel'))
+        if path == '/drive/v3/channels/stop':
+            with self._lock:
+                self.channels.pop(body.get('id'), None)
+            return httplib2.Response({'status': '204'}), b''
+        return self._json(400, {'error': {'code': 400, 'message': f"Unsupported call {method} {path}"}})
+    
+    def add_video(self, notify=True):
+        """
+        Add a video to the folder and notify every open watch channel
+        
+        Args:
+            notify: POST a change notification to the channels' addresses,
+                    like Drive does
+        
+        Returns:
+            The new Drive file dict
+        """
+        video = self.folder.add_video()
+        if notify:
+            with self._lock:
+                channels = list(self.channels.values())
+            for number, channel in enumerate(channels, start=1):
+                requests.post(channel['address'], timeout=5, headers={
+                    'X-Goog-Channel-ID': channel['id'],
+                    'X-Goog-Channel-Token': channel.get('token', ''),
+                    'X-Goog-Channel-Expiration': channel['expiration'],
+                    'X-Goog-Resource-ID': channel['resourceId'],
+                    'X-Goog-Resource-State': 'change',
+                    'X-Goog-Message-Number': str(number)
+                })
+        return video
+    
+    def _call(self, method, path, query, headers):
+        prefix = '/drive/v3/files'
+        if path == prefix and method == 'GET':
+            self.profile.delay()
+            return self._list(query)
+        if path.startswith(prefix + '/') and method == 'GET':
+            file_id = path[len(prefix) + 1:]
+            with self._lock:
+                failures = self.item_failures.get(file_id)
+                status = failures.pop(0) if failures else None
+            if status:
+                return self._json(status, {'error': {'code': status, 'message': 'Injected failure'}})
+            video = self.folder.by_id.get(file_id)
+            if video is None:
+                self.profile.delay()
+                return self._json(404, {'error': {'code': 404, 'message': 'File not found'}})
+            if query.get('alt') == 'media':
+                return self._media(video, headers)
+            self.profile.delay()
+            return self._json(200, dict(video, trashed=False))
+        return self._json(400, {'error': {'code': 400, 'message': f"Unsupported call {method} {path}"}})
+    
+    def _list(self, query):
+        page_size = int(query.get('pageSize', 100))
+        start = int(query.get('pageToken') or 0)
+        page = {'files': self.folder.files[start:start + page_size]}
+        if start + page_size < len(self.folder.files):
+            page['nextPageToken'] = str(start + page_size)
+        return self._json(200, page)
+    
+    def _media(self, video, headers):
+        total = int(video['size'])
+        start, end = 0, total - 1
+        status = 200
+        if 'range' in headers:
+            first, last = headers['range'].split('=', 1)[1].split('-')
+            start, end = int(first), min(int(last), total - 1)
+            status = 206
+        content = self.folder.content(start, end)
+        self.profile.delay(len(content))
+        info = {'status': str(status), 'content-type': video['mimeType'], 'content-length': str(len(content))}
+        if status == 206:
+            info['content-range'] = f"bytes {start}-{end}/{total}"
+        return httplib2.Response(info), content
+    
+    def _batch(self, body, headers):
+        """Answer a multipart/mixed batch by running each inner call"""
+        message = email.parser.Parser().parsestr(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        boundary = 'fake_batch_boundary'
+        chunks = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0].strip()
+            method, target, _ = request_line.split(' ', 2)
+            parts = urlsplit(target)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            response, content = self._call(method, parts.path, query, {})
+            chunks.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: {part['Content-ID']}\r\n\r\n"
+                f"HTTP/1.1 {response.status} OK\r\n"
+                f"Content-Type: application/json\r\n\r\n"
+                f"{content.decode()}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        info = {'status': '200', 'content-type': f"multipart/mixed; boundary={boundary}"}
+        return httplib2.Response(info), ''.join(chunks).encode()
+    
+    def _json(self, status, payload):
+        content = json.dumps(payload).encode()
+        return httplib2.Response({'status': str(status), 'content-type': 'application/json'}), content
+    
+    def connection_stats(self):
+        """Connection statistics in the DriveTransport format (one kept-alive connection)"""
+        return {
+            'requests': self.requests,
+            'connections': 1 if self.requests else 0,
+            'reuse_rate': 1 - 1 / self.requests if self.requests else 0.0
+        }
+    
+    def close(self):
+        """Nothing to close"""
+
+
+class FakeDriveDownloader(GoogleDriveDownloader):
+    def __init__(self, *args, http=None, **kwargs):
+        """
+        GoogleDriveDownloader on a FakeDriveHttp transport
+        
+        Args:
+            http: FakeDriveHttp to serve the Drive API
+            Other arguments are passed to GoogleDriveDownloader
+        """
+        self.fake_http = http
+        super().__init__(*args, **kwargs)
+    
+    def _authenticate(self):
+        """Build the real Drive service on the fake transport"""
+        self.transport = self.fake_http
+        self.service = build('drive', 'v3', http=self.fake_http, static_discovery=True, cache_discovery=False)
+
+
+class FakeInstagramClient:
+    def __init__(self, profile=None):
+        """
+        Fake instagrapi Client covering the upload calls
+        
+        Args:
+            profile: FaultProfile; bandwidth applies to the uploaded file size
+        """
+        self.profile = profile or FaultProfile()
+        self._pks = itertools.count(3000000000000000000)
+        self._lock = threading.Lock()
+        self.user_id = '1000'
+        self.medias = []
+        # Session for the segmented transport, and the FakeRuploadServer it
+        # sends to (set by FakeInstagramUploader)
+        self.private = requests.Session()
+        self.rupload = None
+    
+    def _publish(self, caption):
+        with self._lock:
+            pk = next(self._pks)
+            media = SimpleNamespace(pk=str(pk), code=f"C{pk}", caption_text=caption,
+                                    taken_at=datetime.now(timezone.utc), like_count=0, comment_count=0, play_count=0)
+            self.medias.insert(0, media)
+        return media
+    
+    def _upload(self, path, caption):
+        metrics.incr('instagram_api_calls')
+        size = os.path.getsize(path)
+        if self.profile.should_fail():
+            # Fail part-way through the transfer, like a dropped connection
+            self.profile.delay(size // 2)
+            raise ClientConnectionError("Connection aborted during upload")
+        self.profile.delay(size)
+        return self._publish(caption)
+    
+    def clip_upload(self, path, caption='', **kwargs):
+        return self._upload(path, caption)
+    
+    def video_upload(self, path, caption='', **kwargs):
+        return self._upload(path, caption)
+    
+    def _configure(self, upload_id, caption, product_type):
+        """Publish an upload sent to the rupload stand-in (configure response format)"""
+        metrics.incr('instagram_api_calls')
+        self.profile.delay()
+        if self.rupload and not self.rupload.is_complete(upload_id):
+            raise ClientError(f"Upload {upload_id} is not complete")
+        media = self._publish(caption)
+        return {
+            'status': 'ok',
+            'media': {
+                'pk': media.pk, 'id': f"{media.pk}_{self.user_id}", 'code': media.code,
+                'taken_at': int(media.taken_at.timestamp()), 'media_type': 2, 'product_type': product_type,
+                'user': {'pk': self.user_id, 'username': 'fake'}, 'caption': {'text': caption}
+            }
+        }
+    
+    def clip_configure(self, upload_id, thumbnail, width, height, duration, caption, *args, **kwargs):
+        return self._configure(upload_id, caption, 'clips')
+    
+    def video_configure(self, upload_id, width, height, duration, thumbnail, caption, *args, **kwargs):
+        return self._configure(upload_id, caption, 'feed')
+    
+    def expose(self):
+        return True
+    
+    def user_medias_paginated_v1(self, user_id, amount=33, end_cursor=''):
+        """A page of the account's posts, newest first"""
+        metrics.incr('instagram_api_calls')
+        self.profile.delay()
+        start = int(end_cursor or 0)
+        with self._lock:
+            page = self.medias[start:start + amount]
+            more = start + amount < len(self.medias)
+        return page, str(start + amount) if more else ''
+    
+    def logout(self):
+        return True
+
+
+class _RuploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _reply(self, status, payload):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def do_GET(self):
+        fake = self.server.fake
+        metrics.incr('instagram_api_calls')
+        fake.profile.delay()
+        with fake.lock:
+            offset = fake.received.get(self.path.rsplit('/', 1)[-1], 0)
+        self._reply(200, {'offset': offset, 'xsharing_nonces': {}})
+    
+    def do_POST(self):
+        fake = self.server.fake
+        metrics.incr('instagram_api_calls')
+        name = self.path.rsplit('/', 1)[-1]
+        offset = int(self.headers['Offset'])
+        length = int(self.headers['Content-Length'])
+        with fake.lock:
+            held = fake.received.get(name, 0)
+        if offset > held:
+            self.rfile.read(length)
+            self._reply(400, {'message': f"Offset {offset} is past the received {held} bytes", 'status': 'fail'})
+            return
+        
+        with fake.lock:
+            fake.posts += 1
+            dropped = fake.posts in fake.dropped_posts
+        if dropped or fake.profile.should_fail():
+            # Keep half of the segment and drop the connection unanswered
+            data = self.rfile.read(length // 2)
+            fake.profile.delay(len(data))
+            with fake.lock:
+                fake.received[name] = offset + len(data)
+                fake.bytes_received += len(data)
+                fake.disconnects += 1
+            self.close_connection = True
+            return
+        
+        data = self.rfile.read(length)
+        fake.profile.delay(len(data))
+        params = json.loads(self.headers.get('X-Instagram-Rupload-Params') or '{}')
+        with fake.lock:
+            fake.received[name] = offset + len(data)
+            fake.bytes_received += len(data)
+            fake.lengths[name] = int(self.headers['X-Entity-Length'])
+            fake.entities[params.get('upload_id')] = name
+        self._reply(200, {'offset': offset + len(data), 'upload_id': params.get('upload_id'), 'status': 'ok'})
+
+
+class FakeRuploadServer:
+    def __init__(self, profile=None):
+        """
+        Local HTTP stand-in for Instagram's segmented rupload endpoint
+        
+        Serves GET (acknowledged offset) and POST (bytes at the Offset
+        header) on 127.0.0.1 from a background thread. With the profile's
+        failure_rate a POST keeps half of its segment and drops the
+        connection without answering, like an upload cut off mid-transfer.
+        
+        Args:
+            profile: FaultProfile for every request; bandwidth applies to
+                     the received bytes
+        """
+        self.profile = profile or FaultProfile()
+        self.received = {}
+        self.lengths = {}
+        self.entities = {}
+        self.bytes_received = 0
+        self.disconnects = 0
+        self.posts = 0
+        self.dropped_posts = set()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _RuploadHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def drop_posts(self, *numbers):
+        """Cut off these POSTs mid-segment (counted from 1 over the server's life)"""
+        with self.lock:
+            self.dropped_posts.update(numbers)
+    
+    def is_complete(self, upload_id):
+        """Check whether every byte of an upload has been received"""
+        with self.lock:
+            name = self.entities.get(upload_id)
+            return name is not None and self.received.get(name) == self.lengths.get(name)
+    
+    def close(self):
+        """Stop the server"""
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _analyze_fake_video(path, thumbnail=None):
+    """Fake videos are not decodable; report a portrait 30 second clip"""
+    return thumbnail or f"{path}.jpg", 1080, 1920, 30.0
+
+
+class FakeInstagramUploader(InstagramUploader):
+    def __init__(self, *args, client=None, rupload=None, **kwargs):
+        """
+        InstagramUploader that skips login and uploads through a fake client
+        
+        Args:
+            client: FakeInstagramClient (shared between accounts if wanted)
+            rupload: Optional FakeRuploadServer; uploads then go through the
+                     real segmented transport to it instead of the fake
+                     clip_upload/video_upload
+            Other arguments are passed to InstagramUploader
+        """
+        self.fake_client = client or FakeInstagramClient()
+        self.fake_rupload = rupload
+        super().__init__(*args, **kwargs)
+    
+    def _login(self):
+        self.client = self.fake_client
+    
+    def _create_transport(self, options):
+        if not self.fake_rupload:
+            return None
+        self.client.rupload = self.fake_rupload
+        transport = super()._create_transport(dict(options, resumable=True))
+        transport.base_url = self.fake_rupload.url
+        transport.analyze = _analyze_fake_video
+        # Resume and configure pauses are skipped against the stand-in
+        transport.configure_timeout = 0
+        transport.sleep = lambda seconds: None
+        return transport
+
+
+class FakeLLM:
+    def __init__(self, profile=None):
+        """
+        Fake Gemini model and OpenAI client
+        
+        Args:
+            profile: FaultProfile for every generation
+        """
+        self.profile = profile or FaultProfile()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+    
+    def _text(self, prompt):
+        self.profile.delay()
+        if self.profile.should_fail():
+            raise ServiceUnavailable("The model is overloaded")
+        name = prompt.split('"')[1] if '"' in prompt else 'video'
+        return f"TITLE: {name[:40]}\nCAPTION: Watch {name} till the end! #reels #viral"
+    
+    def generate_content(self, prompt):
+        """Gemini GenerativeModel.generate_content"""
+        return SimpleNamespace(text=self._text(prompt))
+    
+    def _chat_create(self, messages=None, **kwargs):
+        """OpenAI chat.completions.create"""
+        content = self._text(messages[-1]['content'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeCaptionGenerator(AICaptionGenerator):
+    def __init__(self, *args, gemini=None, openai=None, **kwargs):
+        """
+        AICaptionGenerator backed by fake providers
+        
+        Args:
+            gemini: FakeLLM used as the Gemini model (None disables it)
+            openai: FakeLLM used as the OpenAI client (None disables it)
+            Other arguments are passed to AICaptionGenerator (API keys are ignored)
+        """
+        kwargs.update(gemini_key=None, openai_key=None)
+        super().__init__(*args, **kwargs)
+        if gemini:
+            self.gemini_model = gemini
+            self.gemini_available = True
+        if openai:
+            self.openai_client = openai
+            self.openai_available = True
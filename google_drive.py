@@ -3,29 +3,167 @@ Google Drive video downloader module
 """
 import os
 import io
-from google.oauth2.credentials import Credentials
+import itertools
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
+from drive_transport import DriveTransport
+from scratch_space import ScratchSpace
+from manifest import VideoManifest
+from token_cache import create_token_cache
+import resilience
+from metrics import metrics
+from resilience import retry_call, classify_error, FATAL, RETRYABLE
 import json
-import pickle
+
+
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+
+# Metadata requested for each listed file, enough to pick candidates
+# without downloading them
+LIST_FIELDS = "id, name, mimeType, size, md5Checksum, createdTime, videoMediaMetadata(width, height, durationMillis)"
+
+# Drive accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+
+def weighted_interleave(streams, weights, counts=None):
+    """
+    Merge per-folder candidate streams by weight
+    
+    Each pick goes to the folder whose next pick would finish earliest in
+    weighted fair queueing terms, (picks so far + 1) / weight, so a
+    folder with weight 2 gets two picks for every one of a weight 1 folder,
+    spread evenly. Seeding counts with recent uploads keeps the shares fair
+    across runs that only pick one video each.
+    
+    Args:
+        streams: dict of folder ID to an iterable of videos
+        weights: dict of folder ID to a positive weight
+        counts: Optional dict of folder ID to picks already made
+    
+    Yields:
+        Videos in merged order
+    """
+    iterators = {key: iter(stream) for key, stream in streams.items()}
+    picks = {key: (counts or {}).get(key, 0) for key in iterators}
+    while iterators:
+        key = min(iterators, key=lambda k: (picks[k] + 1) / weights.get(k, 1))
+        try:
+            video = next(iterators[key])
+        except StopIteration:
+            del iterators[key]
+            continue
+        picks[key] += 1
+        yield video
+
+
+def check_eligibility(video, rules):
+    """
+    Check a listed video against configurable eligibility rules
+    
+    Rules whose metadata is missing (e.g. Drive has not finished processing
+    the video yet) are not applied.
+    
+    Args:
+        video: Drive file dict from list_videos
+        rules: dict with optional min_duration_seconds, max_duration_seconds,
+               max_size_mb and orientation ('portrait', 'landscape', 'square')
+    
+    Returns:
+        Reason string if the video is ineligible, None otherwise
+    """
+    if not rules:
+        return None
+    
+    metadata = video.get('videoMediaMetadata') or {}
+    
+    duration_ms = metadata.get('durationMillis')
+    if duration_ms is not None:
+        duration = int(duration_ms) / 1000
+        min_duration = rules.get('min_duration_seconds')
+        max_duration = rules.get('max_duration_seconds')
+        if min_duration is not None and duration < min_duration:
+            return f"too short ({duration:.1f}s < {min_duration}s)"
+        if max_duration is not None and duration > max_duration:
+            return f"too long ({duration:.1f}s > {max_duration}s)"
+    
+    size = video.get('size')
+    max_size_mb = rules.get('max_size_mb')
+    if size is not None and max_size_mb is not None:
+        size_mb = int(size) / (1024 * 1024)
+        if size_mb > max_size_mb:
+            return f"too large ({size_mb:.1f}MB > {max_size_mb}MB)"
+    
+    orientation = rules.get('orientation')
+    width, height = metadata.get('width'), metadata.get('height')
+    if orientation and orientation != 'any' and width and height:
+        if width < height:
+            actual = 'portrait'
+        elif width > height:
+            actual = 'landscape'
+        else:
+            actual = 'square'
+        if actual != orientation:
+            return f"wrong orientation ({actual}, {width}x{height})"
+    
+    return None
 
 
 class GoogleDriveDownloader:
-    def __init__(self, credentials_file, folder_id):
+    def __init__(self, credentials_file, folder_id, transport_options=None, scratch=None, folders=None,
+                 listing_workers=4, token_cache_options=None, database=None, compact_listing=False,
+                 manifest_file=None):
         """
         Initialize Google Drive downloader
         
         Args:
             credentials_file: Path to Google OAuth credentials JSON
             folder_id: Google Drive folder ID containing videos
+            transport_options: Optional dict of DriveTransport settings
+                               (pool_size, connect_timeout, read_timeout)
+            scratch: ScratchSpace for downloaded videos (default settings if not given)
+            folders: Optional list of source folders, each {'id': ..., 'weight': ...}
+                     with a positive (possibly fractional) weight; replaces
+                     folder_id when given
+            listing_workers: Folders listed concurrently
+            token_cache_options: Optional 'token_cache' config section
+            database: pymongo Database for the token cache (default backend
+                      when given; otherwise an encrypted local file)
+            compact_listing: Keep listings in a VideoManifest instead of a
+                             list of dicts (for folders with 100k+ files)
+            manifest_file: Optional path the compact listing is saved to
+                           after every listing
         """
-        self.folder_id = folder_id
+        self.folders = []
+        for folder in folders or [{'id': folder_id}]:
+            weight = folder.get('weight', 1)
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+                raise ValueError(
+                    f"google_drive.folders: weight of folder {folder.get('id')} must be a positive number, "
+                    f"got {weight!r}"
+                )
+            self.folders.append({'id': folder['id'], 'weight': float(weight)})
+        self.folder_id = self.folders[0]['id']
+        self.listing_workers = listing_workers
+        self.compact_listing = compact_listing or bool(manifest_file)
+        self.manifest_file = manifest_file
         self.credentials_file = credentials_file
         self.token_file = 'token.pickle'
+        self.token_cache_options = token_cache_options
+        self.database = database
+        self.transport_options = transport_options or {}
+        self.scratch = scratch or ScratchSpace()
+        self.transport = None
         self.service = None
-        self._authenticate()
+        # ManifestSelection per get_next_videos selection_key
+        self._selections = {}
+        with metrics.span('drive_auth'):
+            self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Drive API using Service Account (CI) or OAuth (local)"""
@@ -33,64 +171,134 @@ class GoogleDriveDownloader:
             # Check if running in CI environment (GitHub Actions)
             is_ci = os.environ.get('CI') == 'true' or os.environ.get('GITHUB_ACTIONS') == 'true'
             
+            token_cache = create_token_cache(self.token_cache_options, self.credentials_file, self.database)
+            
             if is_ci:
                 # Use service account in CI (no browser available)
                 print("CI environment detected, using service account auth...")
                 from google.oauth2 import service_account
                 credentials = service_account.Credentials.from_service_account_file(
                     self.credentials_file,
-                    scopes=['https://www.googleapis.com/auth/drive.readonly']
+                    scopes=DRIVE_SCOPES
+                )
+                # Reuse the last run's access token while it is still valid
+                credentials = token_cache.service_account_credentials(
+                    f"drive:{credentials.service_account_email}", credentials
                 )
-                self.service = build('drive', 'v3', credentials=credentials)
+                self._build_service(credentials)
                 print("✓ Successfully authenticated with Google Drive (Service Account)")
             else:
-                # Use OAuth locally (requires browser)
-                creds = None
-                if os.path.exists(self.token_file):
-                    with open(self.token_file, 'rb') as token:
-                        creds = pickle.load(token)
-                
-                if not creds or not creds.valid:
-                    if creds and creds.expired and creds.refresh_token:
-                        creds.refresh(Request())
-                    else:
-                        flow = InstalledAppFlow.from_client_secrets_file(
-                            self.credentials_file,
-                            scopes=['https://www.googleapis.com/auth/drive.readonly']
-                        )
-                        creds = flow.run_local_server(port=8080)
-                    
-                    with open(self.token_file, 'wb') as token:
-                        pickle.dump(creds, token)
+                # Use OAuth locally (requires browser on first use)
+                def authorize():
+                    flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, scopes=DRIVE_SCOPES)
+                    return flow.run_local_server(port=8080)
                 
-                self.service = build('drive', 'v3', credentials=creds)
+                creds = token_cache.user_credentials(
+                    "drive:oauth", DRIVE_SCOPES, authorize, legacy_pickle=self.token_file
+                )
+                self._build_service(creds)
                 print("✓ Successfully authenticated with Google Drive (OAuth)")
-                
+        
         except Exception as e:
             print(f"✗ Error authenticating with Google Drive: {e}")
             raise
     
+    def _build_service(self, credentials):
+        """Build the Drive service on a pooled transport using the bundled discovery document"""
+        self.transport = DriveTransport(credentials, **self.transport_options)
+        self.service = build(
+            'drive', 'v3',
+            http=self.transport,
+            static_discovery=True,
+            cache_discovery=False
+        )
+    
+    def get_transport_stats(self):
+        """Get connection reuse statistics for the Drive transport"""
+        if not self.transport:
+            return {'requests': 0, 'connections': 0, 'reuse_rate': 0.0}
+        return self.transport.connection_stats()
+    
     def list_videos(self):
         """
-        List all video files in the specified folder
+        List all video files in the source folder(s)
+        
+        Several folders are listed concurrently over the shared transport.
         
         Returns:
-            List of video file objects with id, name, and mimeType
+            List of video file objects with id, name, mimeType, size,
+            md5Checksum, createdTime, videoMediaMetadata and folder_id,
+            oldest first within each folder; with compact_listing, a
+            VideoManifest of the same records, oldest first overall
+        """
+        with metrics.span('drive_list'):
+            if self.compact_listing:
+                videos = VideoManifest()
+                lock = threading.Lock()
+                
+                def on_page(files):
+                    with lock:
+                        videos.extend(files)
+            else:
+                on_page = None
+            
+            if len(self.folders) == 1:
+                listings = [self._list_folder(self.folder_id, on_page)]
+            else:
+                workers = max(1, min(self.listing_workers, len(self.folders)))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    listings = list(pool.map(
+                        lambda folder: self._list_folder(folder['id'], on_page), self.folders
+                    ))
+            
+            if self.compact_listing:
+                videos.finish()
+                if self.manifest_file:
+                    try:
+                        videos.save(self.manifest_file)
+                    except OSError as e:
+                        print(f"Note: Could not save listing manifest: {e}")
+            else:
+                videos = [video for listing in listings for video in listing]
+        
+        print(f"✓ Found {len(videos)} videos in {len(self.folders)} Google Drive folder(s)")
+        return videos
+    
+    def _list_folder(self, folder_id, on_page=None):
+        """
+        List the videos of one folder, tagged with its folder_id
+        
+        Args:
+            folder_id: Drive folder ID
+            on_page: Optional callable receiving each page of files instead
+                     of collecting them (keeps only one page in memory)
         """
         try:
-            query = f"'{self.folder_id}' in parents and (mimeType contains 'video/' or name contains '.mp4' or name contains '.mov' or name contains '.avi')"
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="files(id, name, mimeType, size)",
-                orderBy='createdTime'
-            ).execute()
-            
-            videos = results.get('files', [])
-            print(f"✓ Found {len(videos)} videos in Google Drive folder")
+            query = f"'{folder_id}' in parents and trashed = false and (mimeType contains 'video/' or name contains '.mp4' or name contains '.mov' or name contains '.avi')"
+            videos = []
+            page_token = None
+            while True:
+                request = self.service.files().list(
+                    q=query,
+                    pageSize=1000,
+                    fields=f"nextPageToken, files({LIST_FIELDS})",
+                    orderBy='createdTime',
+                    pageToken=page_token
+                )
+                results = retry_call(request.execute, description="Drive listing")
+                files = results.get('files', [])
+                for video in files:
+                    video['folder_id'] = folder_id
+                if on_page:
+                    on_page(files)
+                else:
+                    videos.extend(files)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
             return videos
         except Exception as e:
-            print(f"✗ Error listing videos: {e}")
+            print(f"✗ Error listing videos in folder {folder_id}: {e}")
             return []
     
     def download_video(self, file_id, file_name, download_path='downloads'):
@@ -101,7 +309,7 @@ class GoogleDriveDownloader:
             file_id: Google Drive file ID
             file_name: Name to save the file as
             download_path: Directory to save the file
-            
+        
         Returns:
             Path to downloaded file or None if failed
         """
@@ -131,7 +339,7 @@ class GoogleDriveDownloader:
             
             print(f"✓ Successfully downloaded: {file_name}")
             return file_path
-            
+        
         except Exception as e:
             print(f"✗ Error downloading video {file_name}: {e}")
             return None
@@ -142,7 +350,7 @@ class GoogleDriveDownloader:
         
         Args:
             file_id: Google Drive file ID
-            
+        
         Returns:
             BytesIO object containing video data or None if failed
         """
@@ -161,68 +369,246 @@ class GoogleDriveDownloader:
             fh.seek(0)  # Reset to beginning
             print(f"✓ Successfully streamed video")
             return fh
-            
+        
         except Exception as e:
             print(f"✗ Error streaming video: {e}")
             return None
     
-    def download_to_temp(self, file_id, file_name):
+    def download_to_temp(self, file_id, file_name, size=None):
         """
-        Download video to temporary file
+        Download video to a temporary file in the scratch space
+        
+        Space for the file is reserved before the download starts; remove
+        the file with self.scratch.remove(path) when done.
         
         Args:
             file_id: Google Drive file ID
             file_name: Original filename
-            
+            size: Expected size in bytes from the listing, used for admission
+        
         Returns:
             Path to temporary file or None if failed
         """
         try:
-            import tempfile
+            temp_path = self.scratch.allocate(file_name, size)
+            if not temp_path:
+                return None
             
-            # Create temp file with same extension
-            ext = os.path.splitext(file_name)[1]
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-            temp_path = temp_file.name
-            temp_file.close()
+            # Download to temp file, restarting it on transient errors
+            print(f"Downloading {file_name} to temp...")
+            try:
+                with metrics.span('download'):
+                    retry_call(self._download_file, file_id, temp_path, description=f"Download of {file_name}")
+            except Exception:
+                self.scratch.remove(temp_path)
+                raise
             
-            # Download to temp file
-            request = self.service.files().get_media(fileId=file_id)
-            with open(temp_path, 'wb') as fh:
-                downloader = MediaIoBaseDownload(fh, request)
-                
-                done = False
-                print(f"Downloading {file_name} to temp...")
-                while not done:
-                    status, done = downloader.next_chunk()
-                    if status:
-                        print(f"  Progress: {int(status.progress() * 100)}%")
-            
-            print(f"✓ Downloaded to temp file")
+            size = os.path.getsize(temp_path)
+            self.scratch.update(temp_path, size)
+            metrics.incr('bytes_downloaded', size)
+            print(f"✓ Downloaded to temp file ({size / (1024 * 1024):.1f}MB)")
             return temp_path
-            
+        
         except Exception as e:
             print(f"✗ Error downloading to temp: {e}")
             return None
     
-    def get_next_videos(self, count=1, exclude_ids=None):
+    def _download_file(self, file_id, path):
+        """Download a file's content to a local path"""
+        request = self.service.files().get_media(fileId=file_id)
+        with open(path, 'wb') as fh:
+            downloader = MediaIoBaseDownload(fh, request)
+            
+            # Report progress in quarters rather than on every chunk
+            done = False
+            reported = 0
+            while not done:
+                status, done = downloader.next_chunk()
+                if status and not done and int(status.progress() * 4) > reported:
+                    reported = int(status.progress() * 4)
+                    print(f"  Progress: {reported * 25}%")
+    
+    def get_files_metadata(self, file_ids, fields=None, batch_size=MAX_BATCH_SIZE, max_attempts=3):
+        """
+        Fetch metadata for many files using batched files().get calls
+        
+        Up to batch_size calls are grouped into one HTTP batch request.
+        Items that fail with a retryable or rate-limit error are retried
+        in later batches with jittered backoff, within the run's retry budget.
+        
+        Args:
+            file_ids: Iterable of Google Drive file IDs
+            fields: Fields to request (defaults to the listing fields plus trashed)
+            batch_size: Calls per batch request (at most 100)
+            max_attempts: Attempts per file before giving up
+        
+        Returns:
+            dict of file ID to metadata dict, or None if the file no longer
+            exists. Files that kept failing are left out.
+        """
+        fields = fields or f"{LIST_FIELDS}, trashed"
+        batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        results = {}
+        pending = list(dict.fromkeys(file_ids))
+        
+        for attempt in range(max_attempts):
+            if not pending:
+                break
+            if attempt:
+                delay = resilience.DEFAULT_POLICY.delay(attempt, RETRYABLE)
+                if not resilience.run_budget.spend(delay):
+                    print("Batch metadata: retry budget exhausted")
+                    break
+                time.sleep(delay)
+            
+            failed = []
+            
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = response
+                elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                    results[request_id] = None
+                elif classify_error(exception)[0] != FATAL:
+                    failed.append(request_id)
+                else:
+                    print(f"✗ Error fetching metadata for {request_id}: {exception}")
+            
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for file_id in chunk:
+                    batch.add(
+                        self.service.files().get(fileId=file_id, fields=fields),
+                        request_id=file_id
+                    )
+                try:
+                    batch.execute()
+                except Exception as e:
+                    print(f"Batch metadata request failed: {e}")
+                    failed.extend(file_id for file_id in chunk if file_id not in results)
+            
+            pending = list(dict.fromkeys(failed))
+        
+        if pending:
+            print(f"✗ Could not fetch metadata for {len(pending)} file(s)")
+        
+        return results
+    
+    def refresh_metadata(self, videos, on_skip=None):
+        """
+        Bring listed videos up to date before they are picked
+        
+        A reused listing (kept by a DriveWatcher, or shared between
+        accounts) can be stale: files may have been deleted or trashed
+        since, and videoMediaMetadata only appears once Drive has processed
+        a new video. All videos are fetched in one batch request.
+        
+        Args:
+            videos: Drive file dicts from a listing
+            on_skip: Optional callable (video, reason) invoked for every
+                     video that is gone, so it is not looked up again
+        
+        Returns:
+            The videos that still exist, with current metadata; videos
+            whose lookup failed are kept as listed
+        """
+        current = self.get_files_metadata([video['id'] for video in videos])
+        refreshed = []
+        for video in videos:
+            if video['id'] not in current:
+                refreshed.append(video)
+                continue
+            metadata = current[video['id']]
+            if metadata is None or metadata.get('trashed'):
+                reason = "no longer in Google Drive"
+                print(f"Skipping {video['name']}: {reason}")
+                if on_skip:
+                    on_skip(video, reason)
+                continue
+            metadata = {key: value for key, value in metadata.items() if key != 'trashed'}
+            refreshed.append(dict(video, **metadata))
+        return refreshed
+    
+    def get_next_videos(self, count=1, exclude_ids=None, reject=None, rules=None, on_skip=None, videos=None,
+                        folder_counts=None, refresh=False, selection_key=None):
         """
         Get the next videos to upload
         
         Args:
             count: Number of videos to get
-            exclude_ids: List of file IDs to exclude (already uploaded)
-            
+            exclude_ids: List of file IDs to exclude (already uploaded or skipped)
+            reject: Optional callable taking a video and returning a reason
+                    string if it must not be selected (e.g. a duplicate)
+            rules: Optional eligibility rules, see check_eligibility
+            on_skip: Optional callable (video, reason) invoked for every
+                     rejected, ineligible or deleted video so it can be
+                     recorded
+            videos: Optional listing from list_videos (list or
+                    VideoManifest) to reuse instead of listing the folder again
+            folder_counts: Optional dict of folder ID to recent uploads, so
+                           folder weights hold across runs
+            refresh: Fetch current metadata for candidates before checking
+                     them (for a reused listing, see refresh_metadata)
+            selection_key: Owner of the exclusions (e.g. the account), so a
+                           VideoManifest selection is kept per owner
+        
         Returns:
             List of video file objects
         """
-        if exclude_ids is None:
-            exclude_ids = []
+        exclude_ids = set(exclude_ids or [])
+        
+        if videos is None:
+            videos = self.list_videos()
+        
+        selection = None
+        if isinstance(videos, VideoManifest):
+            # Jump over excluded records instead of scanning them. The
+            # selection is built once per listing and owner; later calls
+            # only mark what was uploaded or skipped since
+            selection = self._selections.get(selection_key)
+            if selection is None or selection.manifest is not videos:
+                selection = videos.selection(exclude_ids)
+                self._selections[selection_key] = selection
+            else:
+                selection.exclude(exclude_ids)
+            if len(self.folders) > 1:
+                streams = {folder['id']: selection.available(folder['id']) for folder in self.folders}
+            else:
+                candidates = selection.available()
+        else:
+            candidates = (video for video in videos if video['id'] not in exclude_ids)
+            if len(self.folders) > 1:
+                streams = {folder['id']: [] for folder in self.folders}
+                for video in candidates:
+                    streams.setdefault(video.get('folder_id'), []).append(video)
+        if len(self.folders) > 1:
+            weights = {folder['id']: folder['weight'] for folder in self.folders}
+            candidates = weighted_interleave(streams, weights, folder_counts)
         
-        videos = self.list_videos()
+        def skipped(video, reason):
+            if on_skip:
+                on_skip(video, reason)
+            if selection is not None:
+                selection.exclude([video['id']])
         
-        # Filter out already uploaded videos
-        available_videos = [v for v in videos if v['id'] not in exclude_ids]
+        # Check rejections lazily so only as many candidates as needed
+        # are looked up
+        candidates = iter(candidates)
+        available_videos = []
+        while len(available_videos) < count:
+            batch = list(itertools.islice(candidates, count - len(available_videos)))
+            if not batch:
+                break
+            if refresh:
+                batch = self.refresh_metadata(batch, on_skip=skipped)
+            for video in batch:
+                reason = check_eligibility(video, rules)
+                if not reason and reject:
+                    reason = reject(video)
+                if reason:
+                    print(f"Skipping {video['name']}: {reason}")
+                    skipped(video, reason)
+                    continue
+                available_videos.append(video)
         
-        # Return the requested number of videos
-        return available_videos[:count]
+        return available_videos
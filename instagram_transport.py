@@ -0,0 +1,277 @@
+"""
+Segmented, resumable upload transport for Instagram videos
+Sends the file to the rupload endpoint in fixed-size segments and tracks the
+acknowledged offset, so an interrupted transfer resumes where it stopped
+instead of starting over
+"""
+import json
+import os
+import random
+import time
+from pathlib import Path
+from uuid import uuid4
+from instagrapi import config as instagrapi_config
+from instagrapi.extractors import extract_media_v1
+from instagrapi.mixins.clip import analyze_video
+from resilience import classify_error, RETRYABLE
+from metrics import metrics
+
+
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+class UploadInterrupted(Exception):
+    """
+    The transfer stopped before the whole file was acknowledged
+    
+    Raised once the transfer's own resumes are used up, so it is not a
+    retryable error: retrying would only repeat them.
+    """
+
+
+class UploadNotConfigured(Exception):
+    """Instagram did not finish processing the upload within the configure attempts (not retryable)"""
+
+
+class VideoUpload:
+    def __init__(self, path, upload_id, entity_name, thumbnail, width, height, duration, generated_thumbnail=False,
+                 clip=True):
+        """
+        State of one video upload
+        
+        Kept across retries, so they resume the same transfer and configure
+        the same upload_id.
+        
+        Args:
+            path: Path to the video file
+            upload_id: Instagram upload_id used to configure the post
+            entity_name: Name of the upload on the rupload endpoint
+            thumbnail: Path to the thumbnail image
+            width: Video width in pixels
+            height: Video height in pixels
+            duration: Video duration in seconds
+            generated_thumbnail: Whether the thumbnail was generated (and
+                                 should be deleted afterwards)
+            clip: Whether the upload is for a reel (True) or a feed video
+        """
+        self.path = Path(path)
+        self.upload_id = upload_id
+        self.entity_name = entity_name
+        self.thumbnail = Path(thumbnail)
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.generated_thumbnail = generated_thumbnail
+        self.clip = clip
+        self.total = os.path.getsize(path)
+        self.offset = 0
+        self.complete = False
+        self.waterfall_id = str(uuid4())
+    
+    def cleanup(self):
+        """Delete the generated thumbnail"""
+        if self.generated_thumbnail:
+            try:
+                self.thumbnail.unlink()
+            except OSError:
+                pass
+
+
+class InstagramUploadTransport:
+    def __init__(self, client, segment_size=DEFAULT_SEGMENT_SIZE, max_resumes=5, base_url=None,
+                 timeout=(10, 120), configure_timeout=10, configure_attempts=50, analyze=analyze_video,
+                 sleep=time.sleep):
+        """
+        Initialize the upload transport
+        
+        Args:
+            client: Logged-in instagrapi Client; its private session sends
+                    the segments and it configures the finished upload
+            segment_size: Bytes per request (0 sends the rest of the file
+                          in one request, still resumable)
+            max_resumes: Interruptions tolerated per transfer attempt
+            base_url: rupload endpoint root (default: Instagram's API domain)
+            timeout: (connect, read) timeout per request in seconds
+            configure_timeout: Seconds between configure attempts
+            configure_attempts: Configure attempts while Instagram transcodes
+            analyze: Callable(path, thumbnail) returning (thumbnail, width,
+                     height, duration)
+            sleep: Callable used to wait (seconds)
+        """
+        self.client = client
+        self.segment_size = segment_size
+        self.max_resumes = max_resumes
+        self.base_url = (base_url or f"https://{instagrapi_config.API_DOMAIN}").rstrip('/')
+        self.timeout = timeout
+        self.configure_timeout = configure_timeout
+        self.configure_attempts = configure_attempts
+        self.analyze = analyze
+        self.sleep = sleep
+        self._last_upload_id = 0
+    
+    def start(self, path, thumbnail=None, clip=True):
+        """
+        Prepare an upload (analyzes the video, nothing is sent yet)
+        
+        Args:
+            path: Path to the video file
+            thumbnail: Optional thumbnail (generated if not given)
+            clip: Upload for a reel (upload_reel) or a feed video (upload_post)
+        
+        Returns:
+            VideoUpload
+        """
+        thumbnail_path, width, height, duration = self.analyze(Path(path), thumbnail)
+        upload_id, entity_name = self._new_ids()
+        return VideoUpload(path, upload_id, entity_name, thumbnail_path, width, height, duration,
+                           generated_thumbnail=thumbnail is None, clip=clip)
+    
+    def reupload(self, upload, clip):
+        """
+        Prepare another upload of the same video for the other post type
+        
+        Instagram receives is_clips_video with the segments, not with the
+        configure call, so a reel upload cannot be configured as a feed
+        video and the file has to be sent again. The analysis (thumbnail,
+        dimensions, duration) is reused; the thumbnail stays owned by the
+        original upload.
+        
+        Returns:
+            VideoUpload
+        """
+        upload_id, entity_name = self._new_ids()
+        return VideoUpload(upload.path, upload_id, entity_name, upload.thumbnail, upload.width, upload.height,
+                           upload.duration, clip=clip)
+    
+    def _new_ids(self):
+        """Fresh upload_id (never repeated within the same millisecond) and rupload entity name"""
+        self._last_upload_id = max(int(time.time() * 1000), self._last_upload_id + 1)
+        upload_id = str(self._last_upload_id)
+        return upload_id, f"{upload_id}_0_{random.randint(1000000000, 9999999999)}"
+    
+    def _url(self, upload):
+        return f"{self.base_url}/rupload_igvideo/{upload.entity_name}"
+    
+    def _headers(self, upload):
+        rupload_params = {
+            'retry_context': '{"num_reupload":0,"num_step_auto_retry":0,"num_step_manual_retry":0}',
+            'media_type': '2',
+            'xsharing_user_ids': json.dumps([str(self.client.user_id)]),
+            'upload_id': upload.upload_id,
+            'upload_media_duration_ms': str(int(upload.duration * 1000)),
+            'upload_media_width': str(upload.width),
+            'upload_media_height': str(upload.height)
+        }
+        # Feed videos are sent without the flag, like instagrapi does
+        if upload.clip:
+            rupload_params['is_clips_video'] = '1'
+        return {
+            'Accept-Encoding': 'gzip',
+            'X-Instagram-Rupload-Params': json.dumps(rupload_params),
+            'X_FB_VIDEO_WATERFALL_ID': upload.waterfall_id,
+            'X-Entity-Type': 'video/mp4'
+        }
+    
+    def _query_offset(self, upload):
+        """Offset the server has acknowledged for this upload"""
+        response = self.client.private.get(self._url(upload), headers=self._headers(upload), timeout=self.timeout)
+        response.raise_for_status()
+        try:
+            return int(response.json().get('offset', 0))
+        except ValueError:
+            return 0
+    
+    def _send_segment(self, upload, data):
+        """Send the bytes starting at upload.offset and advance it on acknowledgement"""
+        headers = dict(
+            self._headers(upload),
+            **{
+                'Offset': str(upload.offset),
+                'X-Entity-Name': upload.entity_name,
+                'X-Entity-Length': str(upload.total),
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': str(len(data))
+            }
+        )
+        response = self.client.private.post(self._url(upload), data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        upload.offset += len(data)
+    
+    def transfer(self, upload):
+        """
+        Send the file, resuming from the acknowledged offset after interruptions
+        
+        Does nothing if the upload is already complete.
+        
+        Raises:
+            UploadInterrupted: The transfer failed more than max_resumes times
+            requests.HTTPError: The endpoint refused the upload
+        """
+        resumes = 0
+        while not upload.complete:
+            try:
+                # The server's offset is authoritative: it may have kept
+                # part of a segment that was never acknowledged
+                upload.offset = self._query_offset(upload)
+                with open(upload.path, 'rb') as fh:
+                    fh.seek(upload.offset)
+                    while upload.offset < upload.total:
+                        data = fh.read(self.segment_size or upload.total - upload.offset)
+                        self._send_segment(upload, data)
+                upload.complete = True
+            except Exception as e:
+                kind, _ = classify_error(e)
+                if kind != RETRYABLE:
+                    raise
+                resumes += 1
+                metrics.incr('upload_resumes')
+                progress = upload.offset / upload.total if upload.total else 0.0
+                if resumes > self.max_resumes:
+                    raise UploadInterrupted(f"Upload interrupted at {progress:.0%} after {resumes - 1} resume(s): {e}")
+                print(f"Upload interrupted at {progress:.0%}, resuming: {e}")
+                self.sleep(min(2 ** (resumes - 1), 30))
+    
+    def _configure(self, upload, configure):
+        for attempt in range(self.configure_attempts):
+            self.sleep(self.configure_timeout)
+            try:
+                configured = configure()
+            except Exception as e:
+                if "Transcode not finished yet" in str(e):
+                    continue
+                raise
+            if configured:
+                media = extract_media_v1(configured.get('media'))
+                self.client.expose()
+                return media
+        raise UploadNotConfigured(
+            f"Upload {upload.upload_id} was not ready after {self.configure_attempts} configure attempts"
+        )
+    
+    def upload_reel(self, upload, caption=""):
+        """
+        Finish the transfer and publish the upload as a reel
+        
+        Returns:
+            instagrapi Media of the new post
+        """
+        if not upload.clip:
+            raise ValueError("A feed video upload cannot be published as a reel")
+        self.transfer(upload)
+        return self._configure(upload, lambda: self.client.clip_configure(
+            upload.upload_id, upload.thumbnail, upload.width, upload.height, upload.duration, caption
+        ))
+    
+    def upload_post(self, upload, caption=""):
+        """
+        Finish the transfer and publish the upload as a feed video
+        
+        Returns:
+            instagrapi Media of the new post
+        """
+        if upload.clip:
+            raise ValueError("A reel upload cannot be published as a feed video")
+        self.transfer(upload)
+        return self._configure(upload, lambda: self.client.video_configure(
+            upload.upload_id, upload.width, upload.height, upload.duration, upload.thumbnail, caption
+        ))
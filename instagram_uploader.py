@@ -2,15 +2,24 @@
 Instagram uploader module
 """
 import os
-import time
 import base64
+import functools
+from datetime import datetime, timedelta, timezone
 from instagrapi import Client
-from instagrapi.exceptions import LoginRequired, ClientError
+from instagrapi.exceptions import LoginRequired, ChallengeRequired, ClientError
 import json
+from resilience import retry_call, classify_error, RetryPolicy, RATE_LIMITED
+from metrics import metrics
+from instagram_transport import InstagramUploadTransport, UploadInterrupted, UploadNotConfigured
+
+
+# Uploads are large; retry only a couple of times and honor server waits
+UPLOAD_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=10, max_delay=120)
 
 
 class InstagramUploader:
-    def __init__(self, username, password, session_file='ig_session.json'):
+    def __init__(self, username, password, session_file='ig_session.json', session_env='IG_SESSION_B64',
+                 proxy=None, upload_options=None):
         """
         Initialize Instagram uploader
         
@@ -18,12 +27,25 @@ class InstagramUploader:
             username: Instagram username
             password: Instagram password
             session_file: Path to save/load session
+            session_env: Environment variable holding a base64 encoded session
+            proxy: Optional proxy URL for this account's requests
+            upload_options: Optional dict of upload transport settings
+                            (resumable, segment_size_mb, max_resumes)
         """
         self.username = username
         self.password = password
         self.session_file = session_file
+        self.session_env = session_env
         self.client = Client()
         
+        if proxy:
+            self.client.set_proxy(proxy)
+        
+        # Count every private API request made through this client
+        self.client.private.hooks['response'].append(
+            lambda response, *args, **kwargs: metrics.incr('instagram_api_calls')
+        )
+        
         # Configure client settings to mimic real app behavior
         self.client.delay_range = [3, 7]  # Increased delays
         self.client.request_timeout = 15
@@ -31,7 +53,20 @@ class InstagramUploader:
         # Set realistic user agent and device info
         self.client.set_user_agent("Instagram 315.0.0.35.119 Android (31/12; 420dpi; 1080x2265; OnePlus; ONEPLUS A6010; OnePlus6T; qcom; en_US; 563447805)")
         
-        self._login()
+        with metrics.span('instagram_auth'):
+            self._login()
+        
+        self.transport = self._create_transport(upload_options or {})
+    
+    def _create_transport(self, options):
+        """Segmented, resumable upload transport, opt-in (None uploads through instagrapi directly)"""
+        if not options.get('resumable', False):
+            return None
+        return InstagramUploadTransport(
+            self.client,
+            segment_size=int(options.get('segment_size_mb', 4) * 1024 * 1024),
+            max_resumes=options.get('max_resumes', 5)
+        )
     
     def _login(self):
         """Login to Instagram with session persistence"""
@@ -40,7 +75,7 @@ class InstagramUploader:
             is_ci = os.environ.get('CI') == 'true' or os.environ.get('GITHUB_ACTIONS') == 'true'
             
             # Try to load session from environment variable (base64 encoded)
-            session_b64 = os.environ.get('IG_SESSION_B64')
+            session_b64 = os.environ.get(self.session_env) if self.session_env else None
             
             if session_b64:
                 print("Loading Instagram session from environment...")
@@ -105,7 +140,7 @@ class InstagramUploader:
             # Save session
             self.client.dump_settings(self.session_file)
             print("✓ Session saved")
-            
+        
         except Exception as e:
             print(f"✗ Error logging in to Instagram: {e}")
             print("\nPossible issues:")
@@ -116,6 +151,67 @@ class InstagramUploader:
             print("\nFor GitHub Actions, run generate_session.py locally first!")
             raise
     
+    def _find_published(self, caption, since):
+        """
+        Look for a post published by an earlier attempt
+        
+        A timeout can hit after Instagram has already published the media,
+        so the account's newest posts are checked before anything is
+        published again.
+        
+        Args:
+            caption: Caption of the post
+            since: UTC datetime the first attempt started
+        
+        Returns:
+            instagrapi Media or None
+        """
+        try:
+            medias, _ = self.client.user_medias_paginated_v1(self.client.user_id, amount=10)
+        except Exception as e:
+            print(f"Note: Could not check recent posts for an earlier attempt: {e}")
+            return None
+        # Allow for clock skew between this machine and Instagram
+        since = since - timedelta(minutes=2)
+        for media in medias:
+            taken_at = media.taken_at
+            if taken_at.tzinfo is None:
+                taken_at = taken_at.replace(tzinfo=timezone.utc)
+            if taken_at >= since and (media.caption_text or '').strip() == caption.strip():
+                return media
+        return None
+    
+    def _publish(self, publish, caption, started, description, check_first=False):
+        """
+        Run a publishing call with retries, never publishing twice
+        
+        Publishing is not idempotent, so before every retry (and before the
+        first attempt with check_first) the account is checked for a post
+        from an earlier attempt, which is returned instead.
+        
+        Args:
+            publish: Callable taking caption= and returning the new Media
+            caption: Caption of the post
+            started: UTC datetime the upload started
+            description: Label for log messages
+            check_first: Check for an earlier post before the first attempt
+        
+        Returns:
+            instagrapi Media
+        """
+        check = [check_first]
+        
+        def attempt():
+            if check[0]:
+                media = self._find_published(caption, started)
+                if media:
+                    print(f"✓ An earlier attempt was already published (Post ID: {media.pk})")
+                    return media
+            check[0] = True
+            return publish(caption=caption)
+        
+        return retry_call(attempt, policy=UPLOAD_RETRY_POLICY, description=description)
+    
     def upload_video(self, video_path, caption=""):
         """
         Upload a video to Instagram
@@ -123,48 +219,76 @@ class InstagramUploader:
         Args:
             video_path: Path to video file
             caption: Caption for the post
-            
+        
         Returns:
-            True if successful, False otherwise
+            Media PK of the new post (str), or None if the upload failed
         """
+        upload = None
+        post_upload = None
         try:
             if not os.path.exists(video_path):
                 print(f"✗ Video file not found: {video_path}")
-                return False
+                return None
             
             print(f"Uploading video to Instagram: {os.path.basename(video_path)}")
             
+            # Retries resume the transfer instead of sending the file again
+            if self.transport:
+                upload = self.transport.start(video_path, clip=True)
+                upload_reel = functools.partial(self.transport.upload_reel, upload)
+            else:
+                upload_reel = functools.partial(self.client.clip_upload, video_path)
+                upload_post = functools.partial(self.client.video_upload, video_path)
+            started = datetime.now(timezone.utc)
+            
             # Try uploading as reel first
             try:
-                media = self.client.clip_upload(
-                    video_path,
-                    caption=caption
-                )
+                if upload:
+                    # Sending the file is safe to repeat; publishing is not
+                    retry_call(self.transport.transfer, upload, policy=UPLOAD_RETRY_POLICY,
+                               description="Video transfer")
+                media = self._publish(upload_reel, caption, started, "Reel upload")
                 
                 if media:
                     print(f"✓ Successfully uploaded video as Reel! Post ID: {media.pk}")
-                    return True
+                    return str(media.pk)
             except Exception as e:
+                kind, _ = classify_error(e)
+                if kind == RATE_LIMITED or isinstance(e, (LoginRequired, ChallengeRequired)):
+                    # Action blocks and auth problems fail the post upload too
+                    print(f"✗ Reel upload failed ({kind}): {e}")
+                    return None
+                if isinstance(e, (UploadInterrupted, UploadNotConfigured)):
+                    # The transfer's own resumes or configure attempts are
+                    # used up; a post upload would only repeat them
+                    print(f"✗ Reel upload failed: {e}")
+                    return None
                 print(f"Reel upload failed, trying as video post: {e}")
-                # Try regular video post
-                media = self.client.video_upload(
-                    video_path,
-                    caption=caption
-                )
+                if self.transport:
+                    # Feed videos are uploaded without the clip flag, so the
+                    # reel's segments cannot be reused (see reupload)
+                    post_upload = self.transport.reupload(upload, clip=False)
+                    upload_post = functools.partial(self.transport.upload_post, post_upload)
+                # Try regular video post, unless the reel went through after all
+                media = self._publish(upload_post, caption, started, "Video post upload", check_first=True)
                 
                 if media:
                     print(f"✓ Successfully uploaded as video post! Post ID: {media.pk}")
-                    return True
+                    return str(media.pk)
             
             print("✗ Upload failed - no media object returned")
-            return False
-                
+            return None
+        
         except ClientError as e:
             print(f"✗ Instagram API error: {e}")
-            return False
+            return None
         except Exception as e:
             print(f"✗ Error uploading video: {e}")
-            return False
+            return None
+        finally:
+            for started_upload in (upload, post_upload):
+                if started_upload:
+                    started_upload.cleanup()
     
     def upload_video_post(self, video_path, caption=""):
         """
@@ -173,7 +297,7 @@ class InstagramUploader:
         Args:
             video_path: Path to video file
             caption: Caption for the post
-            
+        
         Returns:
             True if successful, False otherwise
         """
@@ -195,7 +319,7 @@ class InstagramUploader:
             else:
                 print("✗ Upload failed")
                 return False
-                
+        
         except Exception as e:
             print(f"✗ Error uploading video post: {e}")
             return False
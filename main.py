@@ -1,15 +1,24 @@
 """
 Main automation script
 """
-import os
 import json
-import time
 import sys
-from datetime import datetime
+import time
+import argparse
+from datetime import datetime, timedelta
 from google_drive import GoogleDriveDownloader
 from instagram_uploader import InstagramUploader
 from mongo_tracker import MongoVideoTracker
 from ai_caption import AICaptionGenerator
+from duplicate_index import DuplicateIndex
+from scheduler import UploadScheduler
+from multi_account import create_workers, run_accounts
+from resilience import set_run_budget
+from pipeline import UploadPipeline
+from scratch_space import ScratchSpace
+from post_verification import PostVerifier
+from drive_watch import DriveWatcher
+from metrics import metrics
 
 
 def load_config(config_file='config.json'):
@@ -26,29 +35,193 @@ def load_config(config_file='config.json'):
         sys.exit(1)
 
 
-def main():
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Instagram video automation")
+    parser.add_argument('--config', default='config.json', help="Path to config file")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running and sleep until each upload slot instead of exiting")
+    parser.add_argument('--verify-posts', action='store_true',
+                        help="Check that recent posts are live and store their insights, then exit")
+    parser.add_argument('--simulate', type=int, metavar='DAYS',
+                        help="Dry run: simulate DAYS days on a virtual clock against fake services")
+    parser.add_argument('--listing', help="Recorded folder listing (JSON or manifest) to simulate against")
+    parser.add_argument('--simulate-files', type=int, default=1000,
+                        help="Number of fake videos to simulate when no listing is given")
+    parser.add_argument('--cron-minutes', type=int, default=180,
+                        help="Interval between simulated one-shot runs")
+    return parser.parse_args(argv)
+
+
+def create_scheduler(posting_config, clock=None, sleep=time.sleep):
+    """Create the upload scheduler from the posting config"""
+    return UploadScheduler(
+        videos_per_day=posting_config.get('videos_per_day', 4),
+        upload_times=posting_config.get('upload_times'),
+        min_interval_minutes=posting_config.get('min_interval_minutes', 30),
+        burst=posting_config.get('burst', 1),
+        jitter_minutes=posting_config.get('jitter_minutes', 5),
+        max_wait_minutes=posting_config.get('max_wait_minutes'),
+        clock=clock,
+        sleep=sleep
+    )
+
+
+def write_run_report(metrics_config, drive=None):
+    """Write the JSON run report and Prometheus textfile for this run"""
+    extra = {}
+    if drive:
+        extra['drive_transport'] = drive.get_transport_stats()
+    try:
+        json_path = metrics_config.get('json_path', 'run_report.json')
+        if json_path:
+            metrics.write_json(json_path, extra=extra)
+        prometheus_path = metrics_config.get('prometheus_path')
+        if prometheus_path:
+            metrics.write_prometheus(prometheus_path)
+    except Exception as e:
+        print(f"Note: Could not write run report: {e}")
+
+
+def verify_posts(config, tracker, workers=None):
+    """Verify recent posts of every account without uploading anything"""
+    verification_config = config.get('verification', {})
+    ig_config = config.get('instagram', {})
+    
+    if workers:
+        accounts = [(worker.username, worker.login, worker.tracker) for worker in workers]
+    else:
+        accounts = [(ig_config.get('username'), lambda: InstagramUploader(
+            username=ig_config.get('username'),
+            password=ig_config.get('password')
+        ), tracker)]
+    
+    for username, login, account_tracker in accounts:
+        print(f"Verifying posts of @{username}...")
+        uploader = None
+        try:
+            uploader = login()
+            verifier = PostVerifier(
+                uploader,
+                account_tracker,
+                page_size=verification_config.get('page_size', 33),
+                page_interval_seconds=verification_config.get('page_interval_seconds', 5),
+                max_pages=verification_config.get('max_pages', 10)
+            )
+            verifier.verify(
+                limit=verification_config.get('limit', 200),
+                refresh_hours=verification_config.get('refresh_hours', 24)
+            )
+        except Exception as e:
+            print(f"✗ Verification failed for @{username}: {e}")
+        finally:
+            if uploader:
+                uploader.logout()
+
+
+def upload_cycle(config, tracker, drive, ig, ai_generator, duplicate_index, scheduler, daemon=False,
+                 videos=None):
+    """
+    Upload the video(s) due in the current slot
+    
+    Args:
+        videos: Optional folder listing to pick from (e.g. kept current by
+                a DriveWatcher) instead of listing the folder
+    
+    Returns:
+        Tuple of (videos uploaded, videos attempted)
+    """
+    posting_config = config.get('posting', {})
+    max_videos_per_day = posting_config.get('videos_per_day', 4)
+    
+    # One video per slot; in catch-up mode also make up for slots missed
+    # by failed or skipped runs earlier today
+    count = 1
+    if posting_config.get('catch_up', True):
+        uploaded_today = tracker.get_daily_count()
+        missed = scheduler.due_count(uploaded_today)
+        count = max(1, min(missed, tracker.get_remaining_today(max_videos_per_day)))
+        if count > 1:
+            print(f"Catch-up: {count} slot(s) missed today")
+    
+    # Get videos to upload (skipped videos are never reconsidered)
+    excluded_ids = tracker.get_excluded_ids()
+    
+    videos_to_upload = drive.get_next_videos(
+        count=count,
+        exclude_ids=excluded_ids,
+        reject=duplicate_index.check_metadata if duplicate_index else None,
+        rules=config.get('selection'),
+        on_skip=lambda video, reason: tracker.mark_skipped(video['id'], video['name'], reason),
+        videos=videos,
+        folder_counts=tracker.get_folder_counts(),
+        # A listing kept across cycles may be stale
+        refresh=videos is not None
+    )
+    
+    if not videos_to_upload:
+        print("✗ No new videos found in Google Drive folder")
+        return 0, 0
+    
+    print(f"\nFound {len(videos_to_upload)} video(s) to upload\n")
+    
+    pipeline = UploadPipeline(
+        drive, ig, tracker, ai_generator, scheduler,
+        duplicate_index=duplicate_index,
+        duplicates_config=config.get('duplicates', {}),
+        prefetch=posting_config.get('prefetch', 1)
+    )
+    # Catch-up uploads wait for the rate limiter in-process
+    return pipeline.run(videos_to_upload, wait=daemon or count > 1)
+
+
+def main(argv=None):
     """Main automation workflow"""
+    args = parse_args(argv)
+    
     print("=" * 60)
     print("Instagram Video Automation with AI")
     print("=" * 60)
     print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     
     # Load configuration
-    config = load_config()
+    config = load_config(args.config)
     
     ig_config = config.get('instagram', {})
     drive_config = config.get('google_drive', {})
     mongo_config = config.get('mongodb', {})
     ai_config = config.get('ai', {})
     posting_config = config.get('posting', {})
+    duplicates_config = config.get('duplicates', {})
+    metrics_config = config.get('metrics', {})
+    scratch_config = config.get('scratch', {})
+    retry_budget_seconds = config.get('retry', {}).get('budget_seconds', 600)
     
     max_videos_per_day = posting_config.get('videos_per_day', 4)
     
+    if args.simulate:
+        from simulation import run_simulation, load_listing, print_report
+        report = run_simulation(
+            config,
+            days=args.simulate,
+            cron_minutes=args.cron_minutes,
+            daemon=args.daemon,
+            listing=load_listing(args.listing) if args.listing else None,
+            file_count=args.simulate_files
+        )
+        print_report(report)
+        return
+    
+    # All retries in a run share one time budget
+    set_run_budget(retry_budget_seconds)
+    
     # Initialize components
     print("Initializing components...\n")
     
     tracker = None
     ig = None
+    drive = None
+    metrics.reset()
     
     try:
         # Initialize MongoDB tracker
@@ -58,17 +231,53 @@ def main():
             collection_name=mongo_config.get('collection', 'uploaded_videos')
         )
         
-        # Check if we can upload more videos today
-        if not tracker.can_upload_more(max_videos_per_day):
-            print(f"✓ Daily limit reached ({max_videos_per_day} videos)")
-            print("No more uploads for today!")
-            stats = tracker.get_upload_stats()
-            print(f"Total uploads: {stats['total_uploads']}")
-            tracker.close()
+        # Pace uploads across runs using recent upload history
+        scheduler = create_scheduler(posting_config)
+        scheduler.seed(tracker.get_upload_times(since=datetime.utcnow() - timedelta(days=1)))
+        
+        # Multi-account mode: one worker per configured account
+        workers = None
+        if config.get('accounts'):
+            workers = create_workers(
+                config['accounts'], mongo_config, posting_config, tracker.client, create_scheduler
+            )
+            print(f"Multi-account mode: {len(workers)} account(s)\n")
+        
+        if args.verify_posts:
+            verify_posts(config, tracker, workers)
             return
         
-        remaining = tracker.get_remaining_today(max_videos_per_day)
-        print(f"Videos to upload today: {remaining}\n")
+        # Exit before connecting to anything else when no slot is due
+        if workers and not args.daemon:
+            if not any(worker.is_due() for worker in workers):
+                print("No account has an upload slot due")
+                return
+        elif not args.daemon:
+            if not tracker.can_upload_more(max_videos_per_day):
+                print(f"✓ Daily limit reached ({max_videos_per_day} videos)")
+                print("No more uploads for today!")
+                stats = tracker.get_upload_stats()
+                print(f"Total uploads: {stats['total_uploads']}")
+                return
+            
+            uploaded_today = tracker.get_daily_count()
+            if not scheduler.wait_for_slot(uploaded_today):
+                next_slot = scheduler.next_slot(uploaded_today)
+                print(f"No upload slot due, next slot at {next_slot.strftime('%Y-%m-%d %H:%M')} UTC")
+                return
+        
+        if not workers:
+            remaining = tracker.get_remaining_today(max_videos_per_day)
+            print(f"Videos to upload today: {remaining}\n")
+        
+        # Initialize content-level duplicate index
+        duplicate_index = None
+        if duplicates_config.get('enabled', True):
+            duplicate_index = DuplicateIndex(
+                tracker.db,
+                collection_name=duplicates_config.get('collection', 'video_fingerprints'),
+                max_distance=duplicates_config.get('max_distance', 8)
+            )
         
         # Initialize AI caption generator
         ai_generator = AICaptionGenerator(
@@ -77,108 +286,146 @@ def main():
             default_caption=ai_config.get('default_caption', 'Check out this video!')
         )
         
+        # Scratch space for downloads, cleared of files left by crashed runs
+        scratch = ScratchSpace(
+            directory=scratch_config.get('directory'),
+            budget_mb=scratch_config.get('budget_mb'),
+            prefer_tmpfs=scratch_config.get('prefer_tmpfs', True),
+            min_free_mb=scratch_config.get('min_free_mb', 200),
+            wait_seconds=scratch_config.get('wait_seconds', 300)
+        )
+        scratch.sweep_orphans(max_age_hours=scratch_config.get('orphan_max_age_hours', 6))
+        
         # Initialize Google Drive downloader
         drive = GoogleDriveDownloader(
             credentials_file=drive_config.get('credentials_file', 'credentials.json'),
-            folder_id=drive_config.get('folder_id')
-        )
-        
-        # Initialize Instagram uploader
-        ig = InstagramUploader(
-            username=ig_config.get('username'),
-            password=ig_config.get('password')
+            folder_id=drive_config.get('folder_id'),
+            transport_options=drive_config.get('transport'),
+            scratch=scratch,
+            folders=drive_config.get('folders'),
+            listing_workers=drive_config.get('listing_workers', 4),
+            token_cache_options=drive_config.get('token_cache'),
+            database=tracker.db,
+            compact_listing=drive_config.get('compact_listing', False),
+            manifest_file=drive_config.get('manifest_file')
         )
         
-        # Get videos to upload
-        uploaded_ids = tracker.get_uploaded_ids()
-        
-        # Only get 1 video at a time for every-3-hours schedule
-        videos_to_upload = drive.get_next_videos(
-            count=1,
-            exclude_ids=uploaded_ids
-        )
+        # Index checksums of videos uploaded before duplicate detection existed
+        if duplicate_index:
+            trackers = [worker.tracker for worker in workers] if workers else [tracker]
+            duplicate_index.backfill(
+                lambda: [file_id for account_tracker in trackers for file_id in account_tracker.get_uploaded_ids()],
+                drive.list_videos
+            )
         
-        if not videos_to_upload:
-            print("✗ No new videos found in Google Drive folder")
-            tracker.close()
-            return
+        # Initialize Instagram uploader (accounts log in on their first upload)
+        if not workers:
+            ig = InstagramUploader(
+                username=ig_config.get('username'),
+                password=ig_config.get('password'),
+                upload_options=ig_config.get('upload')
+            )
         
-        print(f"\nFound {len(videos_to_upload)} video(s) to upload\n")
+        # In daemon mode, follow the folder through Drive change notifications
+        watcher = None
+        watch_config = drive_config.get('watch', {})
+        if args.daemon and watch_config.get('enabled'):
+            watcher = DriveWatcher(
+                drive,
+                address=watch_config.get('address'),
+                host=watch_config.get('host', '0.0.0.0'),
+                port=watch_config.get('port', 8085),
+                channel_ttl_hours=watch_config.get('channel_ttl_hours', 24),
+                renew_before_minutes=watch_config.get('renew_before_minutes', 30),
+                fallback_poll_minutes=watch_config.get('fallback_poll_minutes', 30)
+            ).start()
         
-        # Process each video
-        success_count = 0
-        for i, video in enumerate(videos_to_upload, 1):
-            print(f"\n{'=' * 60}")
-            print(f"Processing video {i}/{len(videos_to_upload)}: {video['name']}")
-            print(f"{'=' * 60}\n")
-            
-            # Generate AI caption and title
-            print("Generating AI caption...")
-            ai_content = ai_generator.generate_caption_from_filename(video['name'])
-            print(f"Title: {ai_content['title']}")
-            print(f"Caption: {ai_content['caption'][:100]}...\n")
-            
-            # Download to temporary file (needed for Instagram API)
-            temp_path = drive.download_to_temp(
-                file_id=video['id'],
-                file_name=video['name']
+        def run_cycle(daemon=False):
+            videos = watcher.videos() if watcher else None
+            if workers:
+                return run_accounts(
+                    config, workers, drive, ai_generator, duplicate_index, tracker,
+                    max_workers=posting_config.get('max_workers', 3),
+                    daemon=daemon,
+                    listing=videos
+                )
+            return upload_cycle(
+                config, tracker, drive, ig, ai_generator, duplicate_index, scheduler, daemon=daemon,
+                videos=videos
             )
-            
-            if not temp_path:
-                print(f"✗ Failed to download: {video['name']}")
-                continue
-            
-            # Upload to Instagram
-            time.sleep(5)  # Brief delay before upload
-            
-            success = ig.upload_video(temp_path, ai_content['caption'])
-            
-            # Clean up temp file
+        
+        success_count, attempted = 0, 0
+        if args.daemon:
+            print("Running in daemon mode (Ctrl+C to stop)")
             try:
-                os.remove(temp_path)
-                print(f"✓ Cleaned up temp file")
-            except Exception as e:
-                print(f"Note: Could not delete temp file: {e}")
-            
-            if success:
-                # Mark as uploaded in MongoDB
-                tracker.mark_uploaded(
-                    file_id=video['id'],
-                    file_name=video['name'],
-                    caption=ai_content['caption'],
-                    title=ai_content['title']
-                )
-                success_count += 1
-                
-                # Wait between uploads to avoid rate limiting
-                if i < len(videos_to_upload):
-                    wait_time = 300  # 5 minutes
-                    print(f"\nWaiting {wait_time} seconds before next upload...")
-                    time.sleep(wait_time)
-            else:
-                print(f"✗ Failed to upload: {video['name']}")
+                while True:
+                    set_run_budget(retry_budget_seconds)
+                    if workers:
+                        # Sleep until the earliest account has a slot and an
+                        # upload token, then serve only the accounts that are
+                        # due so no pool thread blocks on a slot hours away
+                        scheduler.sleep(min(worker.seconds_until_ready() for worker in workers))
+                        uploaded, tried = run_cycle()
+                    else:
+                        scheduler.wait_for_slot(tracker.get_daily_count(), daemon=True)
+                        uploaded, tried = run_cycle(daemon=True)
+                    success_count += uploaded
+                    attempted += tried
+                    write_run_report(metrics_config, drive)
+                    metrics.reset()
+                    if not tried:
+                        # Nothing new in the folder yet, check again later
+                        # (or as soon as Drive reports new videos)
+                        if watcher:
+                            watcher.wait_for_changes(60 * posting_config.get('idle_poll_minutes', 30))
+                        else:
+                            scheduler.sleep(60 * posting_config.get('idle_poll_minutes', 30))
+            except KeyboardInterrupt:
+                print("\nStopping daemon...")
+            finally:
+                if watcher:
+                    watcher.stop()
+        else:
+            success_count, attempted = run_cycle()
         
         # Logout
         if ig:
             ig.logout()
+        for worker in workers or []:
+            worker.logout()
         
         # Summary
-        stats = tracker.get_upload_stats()
         print("\n" + "=" * 60)
         print("UPLOAD SUMMARY")
         print("=" * 60)
-        print(f"Successfully uploaded: {success_count}/{len(videos_to_upload)} videos")
-        print(f"Daily total: {stats['today_uploads']}/{max_videos_per_day}")
-        print(f"All-time total: {stats['total_uploads']}")
+        print(f"Successfully uploaded: {success_count}/{attempted} videos")
+        if workers:
+            for worker in workers:
+                stats = worker.tracker.get_upload_stats()
+                print(f"@{worker.username}: {stats['today_uploads']}/{worker.videos_per_day} today, "
+                      f"{stats['total_uploads']} all-time")
+        else:
+            stats = tracker.get_upload_stats()
+            print(f"Daily total: {stats['today_uploads']}/{max_videos_per_day}")
+            print(f"All-time total: {stats['total_uploads']}")
+        transport_stats = drive.get_transport_stats()
+        print(f"Drive requests: {transport_stats['requests']} over "
+              f"{transport_stats['connections']} connection(s) "
+              f"({transport_stats['reuse_rate']:.0%} reused)")
+        print("Time by stage:")
+        metrics.print_summary()
         print(f"Completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"\n✗ Fatal error: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
     finally:
+        write_run_report(metrics_config, drive)
+        if drive:
+            drive.scratch.cleanup()
         if tracker:
             tracker.close()
 
@@ -0,0 +1,480 @@
+"""
+Compact folder manifest for very large Drive folders
+Stores the listing as columnar arrays sorted by createdTime instead of one
+dict per file and saves it to a small binary file that reloads without
+parsing JSON. A selection over it is built in one O(n) pass, then answers
+"next video not uploaded yet" and takes new exclusions in O(log n) each
+"""
+import bisect
+import itertools
+import json
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+
+
+MAGIC = b'IGMF'
+VERSION = 1
+
+# Missing numeric metadata (e.g. Drive has not processed the video yet)
+MISSING = -1
+NO_MD5 = bytes(16)
+
+
+def _parse_time(value):
+    """Drive RFC 3339 timestamp to epoch milliseconds"""
+    if not value:
+        return MISSING
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def _format_time(millis):
+    moment = datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{millis % 1000:03d}Z"
+
+
+def _int(value):
+    return MISSING if value is None else int(value)
+
+
+class _StringColumn:
+    def __init__(self):
+        """Strings packed into one buffer with end offsets (no object per string)"""
+        self.data = bytearray()
+        self.ends = array('I')
+    
+    def append(self, value):
+        self.data += value.encode()
+        self.ends.append(len(self.data))
+    
+    def raw(self, i):
+        start = self.ends[i - 1] if i else 0
+        return bytes(self.data[start:self.ends[i]])
+    
+    def get(self, i):
+        return self.raw(i).decode()
+    
+    def all_raw(self):
+        """Every string as bytes, in record order"""
+        data = bytes(self.data)
+        return [data[start:end] for start, end in zip(itertools.chain((0,), self.ends), self.ends)]
+    
+    def reordered(self, order):
+        column = _StringColumn()
+        for i in order:
+            column.data += self.raw(i)
+            column.ends.append(len(column.data))
+        return column
+
+
+class _InternedColumn:
+    def __init__(self):
+        """Low-cardinality strings (mimeType, folder ID) stored as table indexes"""
+        self.values = []
+        self.codes = array('H')
+        self._index = {}
+    
+    def code(self, value):
+        if value not in self._index:
+            self._index[value] = len(self.values)
+            self.values.append(value)
+        return self._index[value]
+    
+    def append(self, value):
+        self.codes.append(self.code(value))
+    
+    def get(self, i):
+        return self.values[self.codes[i]]
+
+
+# Numeric columns and their array typecodes
+NUMERIC_COLUMNS = (('size', 'q'), ('created', 'q'), ('duration', 'q'), ('width', 'i'), ('height', 'i'))
+
+
+class VideoManifest:
+    def __init__(self):
+        """
+        Empty manifest
+        
+        Fill it with extend() and call finish() before querying, or build
+        it with from_videos() / load().
+        """
+        self.ids = _StringColumn()
+        self.names = _StringColumn()
+        self.md5 = bytearray()
+        self.mime_types = _InternedColumn()
+        self.folders = _InternedColumn()
+        for name, typecode in NUMERIC_COLUMNS:
+            setattr(self, name, array(typecode))
+        # Record indexes sorted by file ID, for index_of
+        self.id_order = array('I')
+    
+    @classmethod
+    def from_videos(cls, videos):
+        """
+        Build a manifest from Drive file dicts (as returned by list_videos)
+        
+        Returns:
+            VideoManifest
+        """
+        manifest = cls()
+        manifest.extend(videos)
+        return manifest.finish()
+    
+    def extend(self, videos):
+        """Append Drive file dicts (any order; finish() sorts them)"""
+        for video in videos:
+            metadata = video.get('videoMediaMetadata') or {}
+            self.ids.append(video['id'])
+            self.names.append(video.get('name', ''))
+            md5 = video.get('md5Checksum')
+            self.md5 += bytes.fromhex(md5) if md5 else NO_MD5
+            self.mime_types.append(video.get('mimeType', ''))
+            self.folders.append(video.get('folder_id') or '')
+            self.size.append(_int(video.get('size')))
+            self.created.append(_parse_time(video.get('createdTime')))
+            self.duration.append(_int(metadata.get('durationMillis')))
+            self.width.append(_int(metadata.get('width')))
+            self.height.append(_int(metadata.get('height')))
+    
+    def _take(self, source, order):
+        """Replace the records with source's records at the given indexes"""
+        self.ids = source.ids.reordered(order)
+        self.names = source.names.reordered(order)
+        md5 = bytearray()
+        for i in order:
+            md5 += source.md5[i * 16:(i + 1) * 16]
+        self.md5 = md5
+        for name in ('mime_types', 'folders'):
+            column, interned = getattr(source, name), _InternedColumn()
+            interned.values = list(column.values)
+            interned._index = dict(column._index)
+            interned.codes = array('H', (column.codes[i] for i in order))
+            setattr(self, name, interned)
+        for name, typecode in NUMERIC_COLUMNS:
+            column = getattr(source, name)
+            setattr(self, name, array(typecode, (column[i] for i in order)))
+    
+    def finish(self):
+        """Sort the records by createdTime (oldest first) and index their IDs"""
+        count = len(self)
+        created = self.created
+        if any(created[i] > created[i + 1] for i in range(count - 1)):
+            self._take(self, sorted(range(count), key=created.__getitem__))
+        self.id_order = array('I', sorted(range(count), key=self.ids.raw))
+        return self
+    
+    def updated(self, videos, removed_ids=()):
+        """
+        Copy of this manifest with changes applied (this one is left as is)
+        
+        Args:
+            videos: Drive file dicts to add, replacing records with the same ID
+            removed_ids: File IDs to drop
+        
+        Returns:
+            VideoManifest
+        """
+        videos = list(videos)
+        replaced = itertools.chain(removed_ids, (video['id'] for video in videos))
+        dropped = {i for i in map(self.index_of, replaced) if i is not None}
+        manifest = VideoManifest()
+        manifest._take(self, [i for i in range(len(self)) if i not in dropped])
+        manifest.extend(videos)
+        return manifest.finish()
+    
+    def __len__(self):
+        return len(self.ids.ends)
+    
+    def __getitem__(self, i):
+        """Record i as a Drive file dict, like the ones list_videos returns"""
+        if i < 0:
+            i += len(self)
+        video = {'id': self.ids.get(i), 'name': self.names.get(i), 'mimeType': self.mime_types.get(i)}
+        if self.size[i] != MISSING:
+            video['size'] = str(self.size[i])
+        md5 = bytes(self.md5[i * 16:(i + 1) * 16])
+        if md5 != NO_MD5:
+            video['md5Checksum'] = md5.hex()
+        if self.created[i] != MISSING:
+            video['createdTime'] = _format_time(self.created[i])
+        metadata = {}
+        if self.width[i] != MISSING:
+            metadata['width'] = self.width[i]
+        if self.height[i] != MISSING:
+            metadata['height'] = self.height[i]
+        if self.duration[i] != MISSING:
+            metadata['durationMillis'] = str(self.duration[i])
+        if metadata:
+            video['videoMediaMetadata'] = metadata
+        folder_id = self.folders.get(i)
+        if folder_id:
+            video['folder_id'] = folder_id
+        return video
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def index_of(self, file_id):
+        """
+        Record index of a file ID (binary search, O(log n))
+        
+        Returns:
+            Index, or None if the file is not in the manifest
+        """
+        target = file_id.encode()
+        low, high = 0, len(self.id_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids.raw(self.id_order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.id_order) and self.ids.raw(self.id_order[low]) == target:
+            return self.id_order[low]
+        return None
+    
+    def selection(self, exclude_ids=None):
+        """
+        Upload state over this manifest (one pass over the records)
+        
+        Keep the selection and pass it new exclusions with exclude() rather
+        than building a new one for every query.
+        
+        Args:
+            exclude_ids: File IDs already uploaded or skipped
+        
+        Returns:
+            ManifestSelection
+        """
+        exclude_ids = exclude_ids or ()
+        # A few IDs are looked up one by one; many are matched in one pass
+        if len(exclude_ids) * max(1, len(self).bit_length()) < len(self):
+            excluded = [i for i in map(self.index_of, exclude_ids) if i is not None]
+        else:
+            wanted = {file_id.encode() for file_id in exclude_ids}
+            excluded = [i for i, file_id in enumerate(self.ids.all_raw()) if file_id in wanted]
+        selection = ManifestSelection(self, excluded)
+        selection.excluded_ids.update(exclude_ids)
+        return selection
+    
+    def save(self, path):
+        """Write the manifest to a binary file"""
+        tables = json.dumps({'mime_types': self.mime_types.values, 'folders': self.folders.values}).encode()
+        sections = [tables, bytes(self.ids.data), bytes(self.names.data), bytes(self.md5)]
+        arrays = [self.ids.ends, self.names.ends, self.mime_types.codes, self.folders.codes, self.id_order]
+        arrays += [getattr(self, name) for name, _ in NUMERIC_COLUMNS]
+        for column in arrays:
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            sections.append(column.tobytes())
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<4sHI', MAGIC, VERSION, len(self)))
+            for section in sections:
+                f.write(struct.pack('<Q', len(section)))
+                f.write(section)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Read a manifest written by save()
+        
+        Raises:
+            ValueError: The file is not a manifest of this version
+        """
+        with open(path, 'rb') as f:
+            magic, version, count = struct.unpack('<4sHI', f.read(10))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} video manifest")
+            
+            def section():
+                (length,) = struct.unpack('<Q', f.read(8))
+                return f.read(length)
+            
+            def column(typecode):
+                values = array(typecode)
+                values.frombytes(section())
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                return values
+            
+            manifest = cls()
+            tables = json.loads(section())
+            manifest.ids.data = bytearray(section())
+            manifest.names.data = bytearray(section())
+            manifest.md5 = bytearray(section())
+            manifest.ids.ends = column('I')
+            manifest.names.ends = column('I')
+            manifest.mime_types.codes = column('H')
+            manifest.folders.codes = column('H')
+            manifest.id_order = column('I')
+            for name, typecode in NUMERIC_COLUMNS:
+                setattr(manifest, name, column(typecode))
+        for interned, key in ((manifest.mime_types, 'mime_types'), (manifest.folders, 'folders')):
+            interned.values = tables[key]
+            interned._index = {value: i for i, value in enumerate(interned.values)}
+        if len(manifest) != count:
+            raise ValueError(f"{path} is truncated")
+        return manifest
+    
+    @staticmethod
+    def is_manifest(path):
+        """Check whether a file starts with the manifest signature"""
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+
+# Excluded flag to availability (0 -> 1, 1 -> 0)
+_AVAILABLE = bytes([1, 0]) + bytes(254)
+
+
+class _AvailableTree:
+    def __init__(self, excluded):
+        """
+        Fenwick tree of available counts over a run of records
+        
+        Args:
+            excluded: bytearray with 1 for each record that is not available
+        """
+        self.count = len(excluded)
+        # Node i covers records (i - lowbit(i), i], so it is a difference
+        # of two prefix sums of the 1/0 availability
+        prefix = list(itertools.accumulate(excluded.translate(_AVAILABLE), initial=0))
+        self.tree = array('i', [prefix[i] - prefix[i - (i & -i)] for i in range(self.count + 1)])
+        self.step = 1 << self.count.bit_length() if self.count else 0
+    
+    def prefix(self, i):
+        """Available records among the first i"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+    
+    def mark(self, i):
+        """Record i (available until now) is no longer available"""
+        i += 1
+        while i <= self.count:
+            self.tree[i] -= 1
+            i += i & -i
+    
+    def next_available(self, start=0):
+        """First available record at or after start, or None"""
+        # Find the smallest position whose prefix count exceeds the count before start
+        target = self.prefix(start) + 1
+        position = 0
+        step = self.step
+        while step:
+            following = position + step
+            if following <= self.count and self.tree[following] < target:
+                position = following
+                target -= self.tree[following]
+            step >>= 1
+        return position if position < self.count else None
+
+
+class ManifestSelection:
+    def __init__(self, manifest, excluded=()):
+        """
+        Which manifest records are still available
+        
+        A bitmap of excluded records plus Fenwick trees of available
+        counts, one over all records and one per folder (built on first
+        use), so the next available record after any position, overall or
+        in one folder, is found in O(log n) however many older records were
+        already uploaded.
+        
+        Args:
+            manifest: VideoManifest
+            excluded: Record indexes that are not available
+        """
+        self.manifest = manifest
+        self.count = len(manifest)
+        # File IDs passed to exclude(), including ones not in the manifest
+        self.excluded_ids = set()
+        self.excluded = bytearray(self.count)
+        for i in excluded:
+            self.excluded[i] = 1
+        self._tree = _AvailableTree(self.excluded)
+        # Folder code to (record indexes of the folder, their tree)
+        self._folders = {}
+    
+    def __len__(self):
+        return self._tree.prefix(self.count)
+    
+    def mark(self, i):
+        """Mark record i as no longer available (e.g. uploaded)"""
+        if self.excluded[i]:
+            return
+        self.excluded[i] = 1
+        self._tree.mark(i)
+        folder = self._folders.get(self.manifest.folders.codes[i])
+        if folder:
+            positions, tree = folder
+            tree.mark(bisect.bisect_left(positions, i))
+    
+    def exclude(self, file_ids):
+        """
+        Mark files as no longer available by ID (O(log n) each)
+        
+        IDs excluded before and IDs not in the manifest are ignored, so
+        the full exclusion list can be passed on every query.
+        
+        Args:
+            file_ids: File IDs uploaded or skipped
+        """
+        for file_id in file_ids:
+            if file_id in self.excluded_ids:
+                continue
+            self.excluded_ids.add(file_id)
+            i = self.manifest.index_of(file_id)
+            if i is not None:
+                self.mark(i)
+    
+    def next_available(self, start=0):
+        """
+        First available record at or after start (O(log n))
+        
+        Returns:
+            Record index, or None if there is none
+        """
+        return self._tree.next_available(start)
+    
+    def _folder(self, code):
+        """Record indexes of one folder and their tree (one pass on first use)"""
+        if code not in self._folders:
+            positions = array('I', (i for i, folder in enumerate(self.manifest.folders.codes) if folder == code))
+            excluded = bytearray(self.excluded[i] for i in positions)
+            self._folders[code] = (positions, _AvailableTree(excluded))
+        return self._folders[code]
+    
+    def available(self, folder_id=None):
+        """
+        Available records oldest first, as Drive file dicts
+        
+        Args:
+            folder_id: Only records from this folder
+        
+        Yields:
+            Drive file dicts
+        """
+        if folder_id is None:
+            i = self.next_available(0)
+            while i is not None:
+                yield self.manifest[i]
+                i = self.next_available(i + 1)
+            return
+        code = self.manifest.folders._index.get(folder_id)
+        if code is None:
+            return
+        positions, tree = self._folder(code)
+        local = tree.next_available(0)
+        while local is not None:
+            yield self.manifest[positions[local]]
+            local = tree.next_available(local + 1)
@@ -0,0 +1,153 @@
+"""
+Lightweight run instrumentation
+Context-manager spans and counters, exported as a JSON run report and a
+Prometheus textfile
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+class RunMetrics:
+    def __init__(self):
+        """Initialize an empty set of stage timings and counters"""
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Drop everything recorded so far and start a new run"""
+        with self._lock:
+            self.started_at = datetime.utcnow()
+            self.stages = {}
+            self.counters = {}
+    
+    @contextmanager
+    def span(self, stage):
+        """
+        Time a block of code as one occurrence of a stage
+        
+        Args:
+            stage: Stage name, e.g. 'download'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+    
+    def observe(self, stage, seconds):
+        """Record one duration for a stage"""
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+    
+    def incr(self, name, value=1):
+        """Add to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def summary(self):
+        """
+        Summarize the run
+        
+        Returns:
+            dict with per-stage count/total/p50/p99/max seconds and counters
+        """
+        with self._lock:
+            stages = {name: list(values) for name, values in self.stages.items()}
+            counters = dict(self.counters)
+        return {
+            'started_at': self.started_at.isoformat() + 'Z',
+            'finished_at': datetime.utcnow().isoformat() + 'Z',
+            'stages': {
+                name: {
+                    'count': len(values),
+                    'total_seconds': sum(values),
+                    'p50_seconds': percentile(values, 0.50),
+                    'p99_seconds': percentile(values, 0.99),
+                    'max_seconds': max(values)
+                }
+                for name, values in stages.items()
+            },
+            'counters': counters
+        }
+    
+    def write_json(self, path, extra=None):
+        """
+        Write the run report as JSON
+        
+        Args:
+            path: Output file
+            extra: Optional dict merged into the report
+        """
+        report = self.summary()
+        if extra:
+            report.update(extra)
+        _write_atomic(path, json.dumps(report, indent=2, default=str))
+    
+    def write_prometheus(self, path, prefix='ig_automation'):
+        """
+        Write the run as a Prometheus textfile (node_exporter textfile collector)
+        
+        Args:
+            path: Output .prom file
+            prefix: Metric name prefix
+        """
+        report = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each stage during the last run",
+            f"# TYPE {prefix}_stage_seconds gauge"
+        ]
+        for stage, values in sorted(report['stages'].items()):
+            for key in ('total', 'p50', 'p99', 'max'):
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",stat="{key}"}} {values[key + "_seconds"]:.6f}')
+        lines.append(f"# HELP {prefix}_stage_count Occurrences of each stage during the last run")
+        lines.append(f"# TYPE {prefix}_stage_count gauge")
+        for stage, values in sorted(report['stages'].items()):
+            lines.append(f'{prefix}_stage_count{{stage="{stage}"}} {values["count"]}')
+        for name, value in sorted(report['counters'].items()):
+            metric = f"{prefix}_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+        lines.append(f"{prefix}_last_run_timestamp_seconds {time.time():.0f}")
+        _write_atomic(path, "\n".join(lines) + "\n")
+    
+    def print_summary(self):
+        """Print stage timings, slowest first"""
+        report = self.summary()
+        stages = sorted(report['stages'].items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+        for stage, values in stages:
+            print(f"  {stage}: {values['total_seconds']:.1f}s over {values['count']} call(s) "
+                  f"(p50 {values['p50_seconds']:.2f}s, max {values['max_seconds']:.2f}s)")
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _write_atomic(path, content):
+    """Write via a temp file so collectors never read a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+# Metrics for the current run, shared by every module
+metrics = RunMetrics()
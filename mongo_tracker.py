@@ -1,13 +1,31 @@
 """
 MongoDB video tracker - replaces JSON file tracking
 """
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
 import sys
+from resilience import retry_call
+from metrics import metrics
+from rollups import UploadRollups
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands sent by the tracker"""
+    
+    def started(self, event):
+        metrics.incr('mongo_commands')
+    
+    def succeeded(self, event):
+        pass
+    
+    def failed(self, event):
+        pass
 
 
 class MongoVideoTracker:
-    def __init__(self, connection_string, database_name='ig_automation', collection_name='uploaded_videos'):
+    def __init__(self, connection_string, database_name='ig_automation', collection_name='uploaded_videos',
+                 skipped_collection_name='skipped_videos', client=None, clock=None):
         """
         Initialize MongoDB video tracker
         
@@ -15,15 +33,29 @@ class MongoVideoTracker:
             connection_string: MongoDB connection string
             database_name: Database name
             collection_name: Collection name for uploaded videos
+            skipped_collection_name: Collection name for videos that will never be uploaded
+            client: Optional existing MongoClient to share (it is not closed by close())
+            clock: Callable returning the current UTC datetime
         """
+        self.clock = clock or datetime.utcnow
         try:
-            self.client = MongoClient(connection_string)
+            self.owns_client = client is None
+            self.client = client or MongoClient(connection_string, event_listeners=[CommandCounter()])
             self.db = self.client[database_name]
             self.collection = self.db[collection_name]
+            self.skipped = self.db[skipped_collection_name]
             
             # Create indexes for better performance
             self.collection.create_index("file_id", unique=True)
             self.collection.create_index("uploaded_at")
+            # get_daily_count runs several times per run
+            self.collection.create_index("upload_date")
+            self.collection.create_index("media_pk", sparse=True)
+            self.skipped.create_index("file_id", unique=True)
+            
+            # Counters for stats, built from the history on first use
+            self.rollups = UploadRollups(self.db, scope=collection_name, clock=self.clock)
+            self.rollups.backfill(self.collection)
             
             print("✓ Successfully connected to MongoDB")
         except Exception as e:
@@ -39,7 +71,47 @@ class MongoVideoTracker:
             print(f"Error fetching uploaded IDs: {e}")
             return []
     
-    def mark_uploaded(self, file_id, file_name, caption="", title=""):
+    def get_skipped_ids(self):
+        """Get list of all video IDs skipped as ineligible or duplicate"""
+        try:
+            videos = self.skipped.find({}, {"file_id": 1, "_id": 0})
+            return [v['file_id'] for v in videos]
+        except Exception as e:
+            print(f"Error fetching skipped IDs: {e}")
+            return []
+    
+    def get_excluded_ids(self):
+        """Get list of all video IDs that must not be selected again"""
+        return self.get_uploaded_ids() + self.get_skipped_ids()
+    
+    def mark_skipped(self, file_id, file_name, reason=""):
+        """
+        Record a video that will not be uploaded, so it is never
+        downloaded or retried again
+        
+        Args:
+            file_id: Google Drive file ID
+            file_name: Name of the video file
+            reason: Why the video was skipped
+        """
+        try:
+            with metrics.span('tracker_write'):
+                self.skipped.update_one(
+                    {'file_id': file_id},
+                    {'$set': {
+                        'file_id': file_id,
+                        'file_name': file_name,
+                        'reason': reason,
+                        'skipped_at': self.clock()
+                    }},
+                    upsert=True
+                )
+            self.rollups.record_skip()
+        except Exception as e:
+            print(f"Error marking as skipped: {e}")
+    
+    def mark_uploaded(self, file_id, file_name, caption="", title="", size=None, provider=None, media_pk=None,
+                      folder_id=None):
         """
         Mark a video as uploaded in MongoDB
         
@@ -48,27 +120,120 @@ class MongoVideoTracker:
             file_name: Name of the video file
             caption: Generated caption used
             title: Generated title
+            size: Uploaded file size in bytes (for the rollups)
+            provider: Caption provider used (for the rollups)
+            media_pk: Instagram media PK of the new post
+            folder_id: Drive folder the video came from
+        
+        Returns:
+            True if the upload is recorded, False otherwise
         """
         try:
+            now = self.clock()
             document = {
                 'file_id': file_id,
                 'file_name': file_name,
                 'caption': caption,
                 'title': title,
-                'uploaded_at': datetime.utcnow(),
-                'upload_date': datetime.utcnow().strftime('%Y-%m-%d')
+                'uploaded_at': now,
+                'upload_date': now.strftime('%Y-%m-%d')
             }
+            if media_pk:
+                document['media_pk'] = str(media_pk)
+            if folder_id:
+                document['folder_id'] = folder_id
             
-            self.collection.insert_one(document)
-            print(f"✓ Marked as uploaded in MongoDB: {file_name}")
-            
+            try:
+                with metrics.span('tracker_write'):
+                    retry_call(self.collection.insert_one, document, description="Marking as uploaded")
+                print(f"✓ Marked as uploaded in MongoDB: {file_name}")
+            except DuplicateKeyError:
+                # A retried insert that had already gone through (or a video
+                # posted again); either way this post is not counted yet
+                print(f"✓ Already marked as uploaded in MongoDB: {file_name}")
+            self.rollups.record_upload(size=size, provider=provider, moment=now, folder_id=folder_id)
+            return True
+        
+        except Exception as e:
+            print(f"✗ Error marking as uploaded (video may be posted again): {e}")
+            return False
+    
+    def get_upload_times(self, since):
+        """
+        Get upload times since a given moment
+        
+        Args:
+            since: UTC datetime
+        
+        Returns:
+            List of UTC datetimes, oldest first
+        """
+        try:
+            videos = self.collection.find(
+                {'uploaded_at': {'$gte': since}},
+                {'uploaded_at': 1, '_id': 0}
+            ).sort('uploaded_at', 1)
+            return [v['uploaded_at'] for v in videos]
         except Exception as e:
-            print(f"Error marking as uploaded: {e}")
+            print(f"Error fetching upload times: {e}")
+            return []
+    
+    def get_posts_to_verify(self, limit=200, refresh_hours=24):
+        """
+        Get uploads whose post status has not been checked recently
+        
+        Args:
+            limit: Maximum number of uploads to return
+            refresh_hours: Re-check posts verified longer ago than this
+        
+        Returns:
+            List of dicts with file_id, media_pk and uploaded_at, newest first
+        """
+        try:
+            stale = self.clock() - timedelta(hours=refresh_hours)
+            videos = self.collection.find(
+                {
+                    'media_pk': {'$exists': True},
+                    '$or': [{'verified_at': {'$exists': False}}, {'verified_at': {'$lt': stale}}]
+                },
+                {'file_id': 1, 'media_pk': 1, 'uploaded_at': 1, '_id': 0}
+            ).sort('uploaded_at', -1).limit(limit)
+            return list(videos)
+        except Exception as e:
+            print(f"Error fetching posts to verify: {e}")
+            return []
+    
+    def record_verifications(self, results):
+        """
+        Store post status and insights for many uploads in one bulk write
+        
+        Args:
+            results: dict of media PK to a dict of fields to set (status,
+                     like_count, comment_count, play_count, ...)
+        
+        Returns:
+            Number of uploads updated
+        """
+        if not results:
+            return 0
+        try:
+            now = self.clock()
+            operations = [
+                UpdateOne({'media_pk': str(media_pk)}, {'$set': dict(fields, verified_at=now)})
+                for media_pk, fields in results.items()
+            ]
+            with metrics.span('tracker_write'):
+                result = retry_call(self.collection.bulk_write, operations, ordered=False,
+                                    description="Recording verifications")
+            return result.modified_count
+        except Exception as e:
+            print(f"Error recording verifications: {e}")
+            return 0
     
     def get_daily_count(self):
         """Get number of uploads today"""
         try:
-            today = datetime.utcnow().strftime('%Y-%m-%d')
+            today = self.clock().strftime('%Y-%m-%d')
             count = self.collection.count_documents({'upload_date': today})
             return count
         except Exception as e:
@@ -81,7 +246,7 @@ class MongoVideoTracker:
         
         Args:
             max_daily: Maximum uploads per day
-            
+        
         Returns:
             True if more uploads allowed, False otherwise
         """
@@ -91,22 +256,35 @@ class MongoVideoTracker:
         """Get number of remaining uploads for today"""
         return max(0, max_daily - self.get_daily_count())
     
+    def record_failure(self):
+        """Count a failed upload attempt in the rollups"""
+        self.rollups.record_failure()
+    
+    def get_folder_counts(self, days=7):
+        """Uploads per source folder over the last days (from the rollups)"""
+        return self.rollups.get_folder_counts(days)
+    
     def get_upload_stats(self):
-        """Get upload statistics"""
-        try:
-            total = self.collection.count_documents({})
-            today = self.get_daily_count()
-            
-            return {
-                'total_uploads': total,
-                'today_uploads': today
-            }
-        except Exception as e:
-            print(f"Error getting stats: {e}")
-            return {'total_uploads': 0, 'today_uploads': 0}
+        """
+        Get upload statistics from the rollup documents
+        
+        Returns:
+            dict with total_uploads, today_uploads, week_uploads, failures
+            (all-time) and captions (all-time count per provider)
+        """
+        all_time = self.rollups.get_all_time()
+        return {
+            'total_uploads': all_time['uploads'],
+            'today_uploads': self.rollups.get_day()['uploads'],
+            'week_uploads': self.rollups.get_week()['uploads'],
+            'failures': all_time['failures'],
+            'captions': all_time['captions']
+        }
     
     def close(self):
         """Close MongoDB connection"""
+        if not self.owns_client:
+            return
         try:
             self.client.close()
             print("✓ MongoDB connection closed")
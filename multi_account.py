@@ -0,0 +1,295 @@
+"""
+Multi-account fan-out
+Uploads to several Instagram accounts concurrently, downloading each
+video from Google Drive only once for all accounts that post it
+"""
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from instagram_uploader import InstagramUploader
+from mongo_tracker import MongoVideoTracker
+from pipeline import upload_and_record
+
+
+class AccountWorker:
+    def __init__(self, account_config, tracker, scheduler, videos_per_day):
+        """
+        Initialize account worker
+        
+        Args:
+            account_config: Account entry from the 'accounts' config list
+            tracker: MongoVideoTracker for this account's uploads
+            scheduler: UploadScheduler for this account's slots
+            videos_per_day: Daily upload quota for this account
+        """
+        self.username = account_config['username']
+        self.account_config = account_config
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.videos_per_day = videos_per_day
+        self.uploader = None
+    
+    def login(self):
+        """Log in on first use and return the account's uploader"""
+        if self.uploader is None:
+            self.uploader = InstagramUploader(
+                username=self.username,
+                password=self.account_config.get('password'),
+                session_file=self.account_config.get('session_file', f"ig_session_{self.username}.json"),
+                session_env=self.account_config.get('session_env'),
+                proxy=self.account_config.get('proxy'),
+                upload_options=self.account_config.get('upload')
+            )
+        return self.uploader
+    
+    def is_due(self, daemon=False):
+        """Check whether this account has quota left and a slot (nearly) due"""
+        uploaded_today = self.tracker.get_daily_count()
+        if uploaded_today >= self.videos_per_day:
+            return False
+        return self.scheduler.is_due(uploaded_today, daemon=daemon)
+    
+    def seconds_until_slot(self):
+        """Seconds until this account's next slot"""
+        return self.scheduler.seconds_until_slot(self.tracker.get_daily_count())
+    
+    def seconds_until_ready(self):
+        """Seconds until this account has a slot due and an upload token"""
+        return max(self.seconds_until_slot(), self.scheduler.bucket.wait_time())
+    
+    def logout(self):
+        """Log out if logged in"""
+        if self.uploader:
+            self.uploader.logout()
+            self.uploader = None
+
+
+class SharedDownloads:
+    def __init__(self, drive, duplicate_index=None, duplicates_config=None, on_skip=None):
+        """
+        Reference-counted temp files shared between accounts
+        
+        The first account to ask for a video downloads it; the others wait
+        for that download and reuse the same file. The file is removed once
+        every account that registered for it has released it.
+        
+        Args:
+            drive: GoogleDriveDownloader
+            duplicate_index: Optional DuplicateIndex for fingerprint checks
+            duplicates_config: 'duplicates' config section
+            on_skip: Callable (video, reason) for videos rejected after download
+        """
+        self.drive = drive
+        self.duplicate_index = duplicate_index
+        self.duplicates_config = duplicates_config or {}
+        self.on_skip = on_skip
+        self._lock = threading.Lock()
+        self._entries = {}
+    
+    def register(self, video):
+        """Announce one more account that will post this video"""
+        with self._lock:
+            entry = self._entries.setdefault(video['id'], {
+                'lock': threading.Lock(),
+                'refs': 0,
+                'done': False,
+                'path': None,
+                'fingerprint': None
+            })
+            entry['refs'] += 1
+    
+    def acquire(self, video):
+        """
+        Get the local path of a registered video, downloading it once
+        
+        Returns:
+            Path to the temp file or None if it could not be used
+        """
+        entry = self._entries[video['id']]
+        with entry['lock']:
+            if not entry['done']:
+                entry['done'] = True
+                path = self.drive.download_to_temp(
+                    file_id=video['id'], file_name=video['name'], size=video.get('size')
+                )
+                if path and self.duplicate_index and self.duplicates_config.get('fingerprint', True):
+                    fingerprint, reason = self.duplicate_index.check_download(
+                        video, path, samples=self.duplicates_config.get('samples', 5)
+                    )
+                    entry['fingerprint'] = fingerprint
+                    if reason:
+                        print(f"Skipping {video['name']}: {reason}")
+                        if self.on_skip:
+                            self.on_skip(video, reason)
+                        self.drive.scratch.remove(path)
+                        path = None
+                entry['path'] = path
+            return entry['path']
+    
+    def fingerprint(self, video):
+        """Fingerprint computed when the video was downloaded, if any"""
+        return self._entries[video['id']]['fingerprint']
+    
+    def release(self, video):
+        """Release one account's reference, removing the file after the last one"""
+        with self._lock:
+            entry = self._entries[video['id']]
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return
+            del self._entries[video['id']]
+        if entry['path'] and self.drive.scratch.remove(entry['path']):
+            print(f"✓ Cleaned up temp file for {video['name']}")
+
+
+def create_workers(accounts_config, mongo_config, posting_config, mongo_client, create_scheduler):
+    """
+    Create one worker per configured account
+    
+    Each account gets its own uploads collection (default
+    'uploaded_videos_<username>') on the shared MongoDB client, its own
+    scheduler and its own videos_per_day quota.
+    
+    Returns:
+        List of AccountWorker
+    """
+    workers = []
+    base_collection = mongo_config.get('collection', 'uploaded_videos')
+    for account_config in accounts_config:
+        username = account_config['username']
+        tracker = MongoVideoTracker(
+            connection_string=None,
+            database_name=mongo_config.get('database', 'ig_automation'),
+            collection_name=account_config.get('collection', f"{base_collection}_{username}"),
+            client=mongo_client
+        )
+        account_posting = dict(posting_config)
+        for key in ('videos_per_day', 'upload_times', 'min_interval_minutes', 'burst', 'jitter_minutes'):
+            if key in account_config:
+                account_posting[key] = account_config[key]
+        scheduler = create_scheduler(account_posting)
+        scheduler.seed(tracker.get_upload_times(since=scheduler.clock() - timedelta(days=1)))
+        workers.append(AccountWorker(
+            account_config,
+            tracker,
+            scheduler,
+            videos_per_day=account_posting.get('videos_per_day', 4)
+        ))
+    return workers
+
+
+def run_accounts(config, workers, drive, ai_generator, duplicate_index, skip_tracker, max_workers=3,
+                 daemon=False, listing=None):
+    """
+    Upload the next video for every account with a slot due
+    
+    The folder is listed once, each unique video is captioned and
+    downloaded once, and uploads run on a bounded thread pool.
+    
+    Args:
+        config: Full config dict
+        workers: List of AccountWorker
+        drive: GoogleDriveDownloader
+        ai_generator: AICaptionGenerator
+        duplicate_index: Optional DuplicateIndex
+        skip_tracker: MongoVideoTracker used to record skipped videos
+        max_workers: Maximum concurrent account uploads
+        daemon: Whether to wait for slots and tokens in-process
+        listing: Optional folder listing to use instead of listing the folder
+    
+    Returns:
+        Tuple of (videos uploaded, uploads attempted)
+    """
+    due_workers = [w for w in workers if w.is_due(daemon=daemon)]
+    if not due_workers:
+        print("No account has an upload slot due")
+        return 0, 0
+    
+    # Do not list or caption for accounts the rate limiter will refuse
+    ready_workers = []
+    for worker in due_workers:
+        if worker.scheduler.can_acquire(daemon=daemon):
+            ready_workers.append(worker)
+        else:
+            print(f"[@{worker.username}] Rate limit: no upload allowed in this run")
+    if not ready_workers:
+        return 0, 0
+    due_workers = ready_workers
+    
+    # A listing kept across cycles may be stale; a fresh one is not
+    refresh = listing is not None
+    if listing is None:
+        listing = drive.list_videos()
+    skipped_ids = skip_tracker.get_skipped_ids()
+    
+    def on_skip(video, reason):
+        skip_tracker.mark_skipped(video['id'], video['name'], reason)
+    
+    # Pick the next video for each account and share downloads between them
+    downloads = SharedDownloads(
+        drive,
+        duplicate_index=duplicate_index,
+        duplicates_config=config.get('duplicates', {}),
+        on_skip=on_skip
+    )
+    assignments = []
+    captions = {}
+    for worker in due_workers:
+        videos = drive.get_next_videos(
+            count=1,
+            exclude_ids=worker.tracker.get_uploaded_ids() + skipped_ids,
+            reject=duplicate_index.check_metadata if duplicate_index else None,
+            rules=config.get('selection'),
+            on_skip=on_skip,
+            videos=listing,
+            folder_counts=worker.tracker.get_folder_counts(),
+            refresh=refresh,
+            selection_key=worker.username
+        )
+        if not videos:
+            print(f"✗ No new videos for @{worker.username}")
+            continue
+        video = videos[0]
+        downloads.register(video)
+        assignments.append((worker, video))
+        if video['id'] not in captions:
+            print(f"Generating AI caption for {video['name']}...")
+            captions[video['id']] = ai_generator.generate_caption_from_filename(video['name'])
+    
+    unique_videos = len(captions)
+    print(f"\n{len(assignments)} upload(s) across {len(due_workers)} account(s), "
+          f"{unique_videos} unique video(s) to download\n")
+    
+    # True if uploaded, False if it failed, None if it was not attempted
+    def upload(worker, video):
+        try:
+            if not worker.scheduler.wait_for_slot(worker.tracker.get_daily_count(), daemon=daemon):
+                return None
+            # Do not download for an upload the rate limiter will refuse
+            if not worker.scheduler.can_acquire(daemon=daemon):
+                print(f"[@{worker.username}] Rate limit: no upload allowed in this run")
+                return None
+            temp_path = downloads.acquire(video)
+            if not temp_path:
+                return False
+            uploader = worker.login()
+            if not worker.scheduler.acquire(daemon=daemon):
+                return None
+            
+            print(f"[@{worker.username}] Uploading {video['name']}")
+            return upload_and_record(
+                uploader, worker.tracker, video, temp_path, captions[video['id']],
+                duplicate_index=duplicate_index, fingerprint=downloads.fingerprint(video),
+                prefix=f"[@{worker.username}] "
+            )
+        except Exception as e:
+            print(f"✗ [@{worker.username}] Error: {e}")
+            return False
+        finally:
+            downloads.release(video)
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        results = list(pool.map(lambda assignment: upload(*assignment), assignments))
+    
+    # Accounts the slot or rate limiter turned away did not attempt an upload
+    return results.count(True), len(results) - results.count(None)
@@ -0,0 +1,201 @@
+"""
+Pipelined download and upload
+Prepares the next video (caption, download, duplicate check) in the
+background while the current one is uploading
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+
+def upload_and_record(uploader, tracker, video, temp_path, ai_content, duplicate_index=None, fingerprint=None,
+                      prefix=""):
+    """
+    Upload a downloaded video and record it as uploaded
+    
+    Used by the single-account pipeline and the multi-account fan-out.
+    
+    Args:
+        uploader: InstagramUploader
+        tracker: MongoVideoTracker of the account
+        video: Drive file dict
+        temp_path: Local copy of the video
+        ai_content: Generated caption and title
+        duplicate_index: Optional DuplicateIndex the upload is registered in
+        fingerprint: Fingerprint computed when the video was downloaded
+        prefix: Prefix for log messages (e.g. the account)
+    
+    Returns:
+        True if the video was posted and recorded
+    """
+    size = os.path.getsize(temp_path)
+    with metrics.span('upload'):
+        media_pk = uploader.upload_video(temp_path, ai_content['caption'])
+    if not media_pk:
+        print(f"✗ {prefix}Failed to upload: {video['name']}")
+        tracker.record_failure()
+        return False
+    metrics.incr('bytes_uploaded', size)
+    
+    # Mark as uploaded in MongoDB
+    recorded = tracker.mark_uploaded(
+        file_id=video['id'],
+        file_name=video['name'],
+        caption=ai_content['caption'],
+        title=ai_content['title'],
+        size=size,
+        provider=ai_content.get('provider'),
+        media_pk=media_pk,
+        folder_id=video.get('folder_id')
+    )
+    if duplicate_index:
+        duplicate_index.register(
+            file_id=video['id'],
+            file_name=video['name'],
+            md5=video.get('md5Checksum'),
+            fingerprint=fingerprint
+        )
+    if not recorded:
+        # Posted but not recorded: the next run would post it again
+        print(f"✗ {prefix}POSTED BUT NOT RECORDED: {video['name']} (file {video['id']}, media {media_pk}); "
+              f"add it to the uploads collection to avoid a duplicate post")
+        metrics.incr('unrecorded_uploads')
+        return False
+    return True
+
+
+class UploadPipeline:
+    def __init__(self, drive, uploader, tracker, ai_generator, scheduler, duplicate_index=None,
+                 duplicates_config=None, prefetch=1):
+        """
+        Initialize upload pipeline
+        
+        Args:
+            drive: GoogleDriveDownloader
+            uploader: InstagramUploader
+            tracker: MongoVideoTracker
+            ai_generator: AICaptionGenerator
+            scheduler: UploadScheduler used to pace uploads
+            duplicate_index: Optional DuplicateIndex for fingerprint checks
+            duplicates_config: 'duplicates' config section
+            prefetch: Number of videos prepared ahead of the current upload
+        """
+        self.drive = drive
+        self.uploader = uploader
+        self.tracker = tracker
+        self.ai_generator = ai_generator
+        self.scheduler = scheduler
+        self.duplicate_index = duplicate_index
+        self.duplicates_config = duplicates_config or {}
+        self.prefetch = max(0, prefetch)
+    
+    def _prepare(self, video):
+        """
+        Caption, download and duplicate-check one video
+        
+        Returns:
+            dict with ai_content, temp_path and fingerprint, or None if the
+            video cannot be uploaded
+        """
+        print(f"Preparing {video['name']}...")
+        ai_content = self.ai_generator.generate_caption_from_filename(video['name'])
+        print(f"Title: {ai_content['title']}")
+        print(f"Caption: {ai_content['caption'][:100]}...\n")
+        
+        # Download to temporary file (needed for Instagram API)
+        temp_path = self.drive.download_to_temp(
+            file_id=video['id'],
+            file_name=video['name'],
+            size=video.get('size')
+        )
+        if not temp_path:
+            print(f"✗ Failed to download: {video['name']}")
+            return None
+        
+        # Reject re-encoded or renamed copies of already posted videos
+        fingerprint = None
+        if self.duplicate_index and self.duplicates_config.get('fingerprint', True):
+            fingerprint, reason = self.duplicate_index.check_download(
+                video,
+                temp_path,
+                samples=self.duplicates_config.get('samples', 5)
+            )
+            if reason:
+                print(f"Skipping {video['name']}: {reason}")
+                self.tracker.mark_skipped(video['id'], video['name'], reason)
+                self._remove(temp_path)
+                return None
+        
+        return {'ai_content': ai_content, 'temp_path': temp_path, 'fingerprint': fingerprint}
+    
+    def _remove(self, temp_path):
+        if self.drive.scratch.remove(temp_path):
+            print(f"✓ Cleaned up temp file")
+    
+    def _upload(self, video, prepared):
+        """Upload a prepared video and record it"""
+        try:
+            return upload_and_record(
+                self.uploader, self.tracker, video, prepared['temp_path'], prepared['ai_content'],
+                duplicate_index=self.duplicate_index, fingerprint=prepared['fingerprint']
+            )
+        finally:
+            self._remove(prepared['temp_path'])
+    
+    def run(self, videos, wait=False):
+        """
+        Upload videos in order, preparing the next ones in the background
+        
+        Args:
+            videos: List of Drive file dicts
+            wait: Whether to wait in-process for the rate limiter between
+                  uploads (otherwise stop when no token is close)
+        
+        Returns:
+            Tuple of (videos uploaded, videos attempted)
+        """
+        success_count = 0
+        attempted = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            futures = []
+            processed = 0
+            
+            for i, video in enumerate(videos):
+                # Only prepare videos the rate limiter will let through in
+                # this run, keeping the next ones downloading while this
+                # one waits and uploads
+                while (len(futures) < min(len(videos), i + 1 + self.prefetch)
+                       and self.scheduler.can_acquire(len(futures) - i + 1, daemon=wait)):
+                    futures.append(pool.submit(self._prepare, videos[len(futures)]))
+                if len(futures) <= i:
+                    print("Rate limit: no further upload allowed in this run")
+                    break
+                
+                print(f"\n{'=' * 60}")
+                print(f"Processing video {i + 1}/{len(videos)}: {video['name']}")
+                print(f"{'=' * 60}\n")
+                
+                # Wait for the rate limiter before uploading
+                if not self.scheduler.acquire(daemon=wait):
+                    break
+                
+                prepared = futures[i].result()
+                processed = i + 1
+                
+                if not prepared:
+                    self.scheduler.release()
+                    continue
+                
+                attempted += 1
+                if self._upload(video, prepared):
+                    success_count += 1
+            
+            # Discard anything prepared after an early stop
+            for future in futures[processed:]:
+                if future.cancel():
+                    continue
+                leftover = future.result()
+                if leftover:
+                    self._remove(leftover['temp_path'])
+        
+        return success_count, attempted
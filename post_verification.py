@@ -0,0 +1,121 @@
+"""
+Batched post verification and insights collection
+Checks that uploaded posts are live and records their engagement, reading
+the account's own feed a page at a time instead of one lookup per post
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from resilience import retry_call, RetryPolicy
+
+
+# Verification is not urgent; back off generously and give up early
+VERIFY_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=30, max_delay=300)
+
+# Engagement fields copied from each Media object
+INSIGHT_FIELDS = ('like_count', 'comment_count', 'play_count', 'view_count')
+
+# Our upload time is recorded after Instagram's taken_at; only call a post
+# missing when the feed was read well past the time it was uploaded
+MISSING_MARGIN = timedelta(hours=1)
+
+
+def _utc(moment):
+    """Naive UTC datetime, as stored by the tracker"""
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class PostVerifier:
+    def __init__(self, uploader, tracker, page_size=33, page_interval_seconds=5, max_pages=10,
+                 sleep=time.sleep):
+        """
+        Initialize post verifier
+        
+        Args:
+            uploader: Logged-in InstagramUploader for the account
+            tracker: MongoVideoTracker holding the account's uploads
+            page_size: Posts fetched per feed request
+            page_interval_seconds: Pause between feed requests (rate limit)
+            max_pages: Maximum feed requests per run
+            sleep: Callable used to wait (seconds)
+        """
+        self.uploader = uploader
+        self.tracker = tracker
+        self.page_size = page_size
+        self.page_interval_seconds = page_interval_seconds
+        self.max_pages = max_pages
+        self.sleep = sleep
+    
+    def verify(self, limit=200, refresh_hours=24):
+        """
+        Verify recent uploads and store their status and insights
+        
+        Posts found in the feed are marked 'live' with their engagement
+        counts. Posts older than the last page that was read but not found
+        in it are marked 'missing'. Posts the scan did not reach are left
+        for the next run.
+        
+        Args:
+            limit: Maximum uploads to verify in this run
+            refresh_hours: Re-check posts verified longer ago than this
+        
+        Returns:
+            dict with checked, live and missing counts
+        """
+        pending = {doc['media_pk']: doc for doc in self.tracker.get_posts_to_verify(limit, refresh_hours)}
+        summary = {'checked': 0, 'live': 0, 'missing': 0}
+        if not pending:
+            print("No posts to verify")
+            return summary
+        
+        oldest_upload = min(doc['uploaded_at'] for doc in pending.values())
+        client = self.uploader.client
+        user_id = client.user_id
+        
+        results = {}
+        cursor = ''
+        # Every post made after this time has been read from the feed
+        complete_since = None
+        for page in range(self.max_pages):
+            if page:
+                self.sleep(self.page_interval_seconds)
+            medias, cursor = retry_call(
+                client.user_medias_paginated_v1, user_id, self.page_size, cursor,
+                policy=VERIFY_RETRY_POLICY, description="Feed page"
+            )
+            for media in medias:
+                media_pk = str(media.pk)
+                if media_pk in pending:
+                    results[media_pk] = {'status': 'live'}
+                    for field in INSIGHT_FIELDS:
+                        value = getattr(media, field, None)
+                        if value is not None:
+                            results[media_pk][field] = value
+            
+            if cursor is None:
+                # instagrapi returns no cursor when the request failed
+                print("✗ Could not read the feed, verification stopped early")
+                break
+            if not cursor:
+                # Reached the end of the feed
+                complete_since = datetime.min
+                break
+            # Pinned posts come first, so the last post on a page is the
+            # oldest; an empty page (which can still carry a cursor) moves
+            # nothing forward
+            if medias and medias[-1].taken_at:
+                complete_since = _utc(medias[-1].taken_at) + MISSING_MARGIN
+            if len(results) == len(pending) or (complete_since and complete_since < oldest_upload):
+                break
+        
+        for media_pk, doc in pending.items():
+            if media_pk not in results and complete_since and doc['uploaded_at'] >= complete_since:
+                results[media_pk] = {'status': 'missing'}
+        
+        self.tracker.record_verifications(results)
+        summary['checked'] = len(results)
+        summary['live'] = sum(1 for fields in results.values() if fields['status'] == 'live')
+        summary['missing'] = summary['checked'] - summary['live']
+        print(f"✓ Verified {summary['checked']} post(s): {summary['live']} live, {summary['missing']} missing")
+        return summary
@@ -0,0 +1,275 @@
+"""
+Shared retry, backoff and error classification
+Sorts errors from Drive, Instagram, MongoDB and the AI providers into
+retryable, rate-limited and fatal, and retries with jittered backoff
+"""
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from metrics import metrics
+
+
+RETRYABLE = 'retryable'
+RATE_LIMITED = 'rate_limited'
+FATAL = 'fatal'
+
+# Instagram's feedback_required is an action block; retrying within the
+# same run only makes it worse, so it is treated as a very long wait
+FEEDBACK_REQUIRED_BACKOFF = 6 * 60 * 60
+
+RETRYABLE_STATUSES = (408, 500, 502, 503, 504)
+RATE_LIMIT_STATUSES = (429,)
+
+# Exception class names from optional libraries, matched anywhere in the
+# exception's class hierarchy so none of them has to be imported here
+RATE_LIMITED_NAMES = {
+    'PleaseWaitFewMinutes', 'RateLimitError', 'ClientThrottledError',
+    'ResourceExhausted', 'TooManyRequests'
+}
+RETRYABLE_NAMES = {
+    'ClientConnectionError', 'ClientRequestTimeout', 'ClientIncompleteReadError',
+    'AutoReconnect', 'NetworkTimeout', 'ConnectionFailure', 'ServerSelectionTimeoutError',
+    'APIConnectionError', 'APITimeoutError', 'InternalServerError',
+    'ServiceUnavailable', 'DeadlineExceeded', 'GatewayTimeout',
+    'IncompleteRead', 'RemoteDisconnected', 'ChunkedEncodingError'
+}
+FATAL_NAMES = {
+    'ChallengeRequired', 'LoginRequired', 'BadPassword', 'TwoFactorRequired',
+    'AuthenticationError', 'PermissionDeniedError', 'DuplicateKeyError'
+}
+
+
+def _class_names(exception):
+    return {cls.__name__ for cls in type(exception).__mro__}
+
+
+def _status_code(exception):
+    """Best-effort HTTP status code of an exception"""
+    resp = getattr(exception, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None):
+        return int(resp.status)
+    response = getattr(exception, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return int(response.status_code)
+    for attribute in ('status_code', 'code'):
+        value = getattr(exception, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _headers(exception):
+    resp = getattr(exception, 'resp', None)
+    if resp is not None and hasattr(resp, 'get'):
+        return resp
+    response = getattr(exception, 'response', None)
+    if response is not None and getattr(response, 'headers', None) is not None:
+        return response.headers
+    return {}
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value
+    
+    Returns:
+        Seconds to wait or None if the value is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exception):
+    """
+    Classify an exception
+    
+    Args:
+        exception: Any exception raised by a Drive, Instagram, MongoDB or AI call
+    
+    Returns:
+        Tuple of (kind, retry_after); kind is RETRYABLE, RATE_LIMITED or
+        FATAL, retry_after is the server-requested wait in seconds or None
+    """
+    names = _class_names(exception)
+    message = str(exception)
+    headers = _headers(exception)
+    retry_after = parse_retry_after(headers.get('retry-after') or headers.get('Retry-After'))
+    
+    if 'FeedbackRequired' in names or 'feedback_required' in message:
+        return RATE_LIMITED, FEEDBACK_REQUIRED_BACKOFF
+    if names & FATAL_NAMES:
+        return FATAL, None
+    if names & RATE_LIMITED_NAMES:
+        return RATE_LIMITED, retry_after
+    
+    status = _status_code(exception)
+    if status is not None:
+        if status in RATE_LIMIT_STATUSES:
+            return RATE_LIMITED, retry_after
+        # Drive reports per-user rate limits as 403s
+        if status == 403 and ('rateLimitExceeded' in message or 'userRateLimitExceeded' in message):
+            return RATE_LIMITED, retry_after
+        if status in RETRYABLE_STATUSES:
+            return RETRYABLE, retry_after
+        if 400 <= status < 500:
+            return FATAL, None
+    
+    if names & RETRYABLE_NAMES:
+        return RETRYABLE, retry_after
+    if isinstance(exception, (ConnectionError, TimeoutError, socket.timeout)):
+        return RETRYABLE, None
+    # requests' ConnectionError/Timeout derive from IOError
+    if 'RequestException' in names and 'HTTPError' not in names:
+        return RETRYABLE, None
+    
+    return FATAL, None
+
+
+class RetryBudget:
+    def __init__(self, seconds=600):
+        """
+        Total time a run may spend waiting between retries
+        
+        Args:
+            seconds: Budget in seconds shared by every retry in the run
+        """
+        self.seconds = seconds
+        self.spent = 0.0
+        self._lock = threading.Lock()
+    
+    def remaining(self):
+        """Seconds left in the budget"""
+        with self._lock:
+            return max(0.0, self.seconds - self.spent)
+    
+    def spend(self, seconds):
+        """
+        Reserve time from the budget
+        
+        Returns:
+            True if the wait fits in the budget, False otherwise
+        """
+        with self._lock:
+            if self.spent + seconds > self.seconds:
+                return False
+            self.spent += seconds
+            return True
+
+
+# Budget shared by every retry in the current run, see set_run_budget
+run_budget = RetryBudget()
+
+
+def set_run_budget(seconds):
+    """Start a new per-run retry budget"""
+    global run_budget
+    run_budget = RetryBudget(seconds)
+    return run_budget
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=4, base_delay=2, max_delay=60, max_retry_after=900, budget=None):
+        """
+        Initialize retry policy
+        
+        Args:
+            max_attempts: Attempts including the first one
+            base_delay: Delay before the first retry (doubles each time)
+            max_delay: Upper bound for computed backoff delays
+            max_retry_after: Longest server-requested wait to honor; longer
+                             waits give up instead
+            budget: RetryBudget to draw from (defaults to the run budget)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+    
+    def delay(self, attempt, kind, retry_after=None):
+        """
+        Delay before the given retry attempt (1 = first retry)
+        
+        Returns:
+            Seconds to wait, or None if the error should not be retried
+        """
+        if kind == FATAL:
+            return None
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if kind == RATE_LIMITED:
+            backoff = min(self.max_delay, backoff * 2)
+        # Jitter spreads out retries from concurrent workers
+        return random.uniform(backoff / 2, backoff)
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def retry_call(func, *args, policy=None, description=None, sleep=time.sleep, **kwargs):
+    """
+    Call a function, retrying retryable and rate-limited errors
+    
+    Args:
+        func: Callable to run
+        *args: Positional arguments for func
+        policy: RetryPolicy (defaults to DEFAULT_POLICY)
+        description: Short label for log messages
+        sleep: Callable used to wait (seconds)
+        **kwargs: Keyword arguments for func
+    
+    Returns:
+        Whatever func returns
+    
+    Raises:
+        The last exception once it is fatal, out of attempts or out of budget
+    """
+    policy = policy or DEFAULT_POLICY
+    description = description or getattr(func, '__name__', 'call')
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            kind, retry_after = classify_error(e)
+            if attempt >= policy.max_attempts:
+                raise
+            delay = policy.delay(attempt, kind, retry_after)
+            if delay is None:
+                raise
+            budget = policy.budget or run_budget
+            if not budget.spend(delay):
+                print(f"{description}: retry budget exhausted ({kind})")
+                raise
+            metrics.incr('retries')
+            metrics.incr(f'retries_{kind}')
+            print(f"{description} failed ({kind}): {e}")
+            print(f"  Retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.max_attempts})")
+            sleep(delay)
+
+
+def retrying(policy=None, description=None):
+    """Decorator form of retry_call"""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            return retry_call(func, *args, policy=policy, description=description or func.__name__, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
@@ -0,0 +1,214 @@
+"""
+Pre-aggregated upload analytics
+Daily, weekly and all-time counters kept in small $inc-updated documents,
+so stats and dashboards never scan the upload history
+"""
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+CAPTION_PROVIDERS = ('gemini', 'openai', 'default')
+
+
+def day_key(moment):
+    """Rollup period key for a day, e.g. '2024-05-17'"""
+    return moment.strftime('%Y-%m-%d')
+
+
+def week_key(moment):
+    """Rollup period key for an ISO week, e.g. '2024-W20'"""
+    return moment.strftime('%G-W%V')
+
+
+class UploadRollups:
+    def __init__(self, database, scope, collection_name='upload_rollups', clock=None):
+        """
+        Initialize upload rollups
+        
+        Documents are keyed '<scope>:all', '<scope>:day:<YYYY-MM-DD>' and
+        '<scope>:week:<YYYY-Www>' and hold the counters uploads, failures,
+        skipped, bytes_uploaded and captions.<provider>.
+        
+        Args:
+            database: pymongo Database
+            scope: Name the counters belong to (the uploads collection name,
+                   so every account has its own)
+            collection_name: Collection for rollup documents
+            clock: Callable returning the current UTC datetime
+        """
+        self.collection = database[collection_name]
+        self.scope = scope
+        self.clock = clock or datetime.utcnow
+    
+    def _ids(self, moment):
+        return [
+            f"{self.scope}:all",
+            f"{self.scope}:day:{day_key(moment)}",
+            f"{self.scope}:week:{week_key(moment)}"
+        ]
+    
+    def _increment(self, counters, moment=None):
+        """Add counters to the all-time, day and week documents"""
+        moment = moment or self.clock()
+        try:
+            for doc_id in self._ids(moment):
+                self.collection.update_one(
+                    {'_id': doc_id},
+                    {'$inc': counters, '$set': {'updated_at': moment}},
+                    upsert=True
+                )
+        except Exception as e:
+            print(f"Note: Could not update upload rollups: {e}")
+    
+    def record_upload(self, size=None, provider=None, moment=None, folder_id=None):
+        """
+        Count a successful upload
+        
+        Args:
+            size: Uploaded bytes
+            provider: Caption provider used ('gemini', 'openai' or 'default')
+            moment: Upload time (defaults to now)
+            folder_id: Drive folder the video came from
+        """
+        counters = {'uploads': 1}
+        if size:
+            counters['bytes_uploaded'] = int(size)
+        if provider:
+            counters[f'captions.{provider}'] = 1
+        if folder_id:
+            counters[f'folders.{folder_id}'] = 1
+        self._increment(counters, moment)
+    
+    def record_failure(self):
+        """Count a failed upload attempt"""
+        self._increment({'failures': 1})
+    
+    def record_skip(self):
+        """Count a video skipped as ineligible or duplicate"""
+        self._increment({'skipped': 1})
+    
+    def _add_history(self, doc_id, uploads):
+        """Add backfilled uploads to one document and mark it, unless it is marked already"""
+        try:
+            self.collection.update_one(
+                {'_id': doc_id, 'backfilled_at': {'$exists': False}},
+                {'$inc': {'uploads': uploads}, '$set': {'backfilled_at': self.clock()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The document exists and a backfill already counted it
+            pass
+    
+    def backfill(self, uploads_collection):
+        """
+        Build the rollups from existing upload history, once
+        
+        The first attempt stores a cutoff in the all-time document: uploads
+        before it are counted from the history, later ones as they happen.
+        Each document's increment also sets its backfilled_at, and the
+        all-time document is marked last, so a backfill that failed or died
+        part way is finished by the next run without counting a document
+        twice, even when several processes run it at once.
+        
+        Args:
+            uploads_collection: Collection of upload documents (with
+                                'upload_date' and 'uploaded_at')
+        """
+        all_id = f"{self.scope}:all"
+        try:
+            doc = self.collection.find_one_and_update(
+                {'_id': all_id},
+                {'$setOnInsert': {'backfill_cutoff': self.clock()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc.get('backfilled_at'):
+                return
+            days = uploads_collection.aggregate([
+                {'$match': {'uploaded_at': {'$lt': doc.get('backfill_cutoff') or self.clock()}}},
+                {'$group': {'_id': '$upload_date', 'uploads': {'$sum': 1}}}
+            ])
+            total = 0
+            weeks = {}
+            for day in days:
+                if not day['_id']:
+                    continue
+                moment = datetime.strptime(day['_id'], '%Y-%m-%d')
+                total += day['uploads']
+                weeks[week_key(moment)] = weeks.get(week_key(moment), 0) + day['uploads']
+                self._add_history(f"{self.scope}:day:{day['_id']}", day['uploads'])
+            for week, uploads in weeks.items():
+                self._add_history(f"{self.scope}:week:{week}", uploads)
+            self._add_history(all_id, total)
+            if total:
+                print(f"✓ Backfilled upload rollups from {total} upload(s)")
+        except Exception as e:
+            # Finished by the next run, since the all-time document is not marked
+            print(f"Note: Could not backfill upload rollups: {e}")
+    
+    def _counters(self, doc):
+        doc = doc or {}
+        return {
+            'uploads': doc.get('uploads', 0),
+            'failures': doc.get('failures', 0),
+            'skipped': doc.get('skipped', 0),
+            'bytes_uploaded': doc.get('bytes_uploaded', 0),
+            'captions': {provider: doc.get('captions', {}).get(provider, 0) for provider in CAPTION_PROVIDERS}
+        }
+    
+    def _get(self, doc_id):
+        try:
+            return self._counters(self.collection.find_one({'_id': doc_id}))
+        except Exception as e:
+            print(f"Error reading upload rollups: {e}")
+            return self._counters(None)
+    
+    def get_all_time(self):
+        """All-time counters"""
+        return self._get(f"{self.scope}:all")
+    
+    def get_day(self, moment=None):
+        """Counters for the day containing moment (defaults to today)"""
+        return self._get(f"{self.scope}:day:{day_key(moment or self.clock())}")
+    
+    def get_week(self, moment=None):
+        """Counters for the ISO week containing moment (defaults to this week)"""
+        return self._get(f"{self.scope}:week:{week_key(moment or self.clock())}")
+    
+    def get_daily_series(self, days=30):
+        """
+        Counters for each of the last days, oldest first (for dashboards)
+        
+        Returns:
+            List of dicts with 'date' and the counters
+        """
+        today = self.clock()
+        dates = [day_key(today - timedelta(days=offset)) for offset in range(days - 1, -1, -1)]
+        try:
+            docs = {
+                doc['_id']: doc
+                for doc in self.collection.find({'_id': {'$in': [f"{self.scope}:day:{date}" for date in dates]}})
+            }
+        except Exception as e:
+            print(f"Error reading upload rollups: {e}")
+            docs = {}
+        return [dict(self._counters(docs.get(f"{self.scope}:day:{date}")), date=date) for date in dates]
+    
+    def get_folder_counts(self, days=7):
+        """
+        Uploads per source folder over the last days
+        
+        Returns:
+            dict of folder ID to upload count
+        """
+        today = self.clock()
+        ids = [f"{self.scope}:day:{day_key(today - timedelta(days=offset))}" for offset in range(days)]
+        counts = {}
+        try:
+            for doc in self.collection.find({'_id': {'$in': ids}}, {'folders': 1}):
+                for folder_id, uploads in (doc.get('folders') or {}).items():
+                    counts[folder_id] = counts.get(folder_id, 0) + uploads
+        except Exception as e:
+            print(f"Error reading upload rollups: {e}")
+        return counts
@@ -0,0 +1,245 @@
+"""
+Upload scheduler
+Works out posting slots from videos_per_day / upload_times and paces
+uploads with a rate-limit token bucket
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+
+class TokenBucket:
+    def __init__(self, capacity=1, refill_seconds=1800, clock=time.time):
+        """
+        Initialize token bucket
+        
+        Args:
+            capacity: Maximum number of uploads allowed back to back
+            refill_seconds: Seconds to regain one token
+            clock: Callable returning the current time in seconds
+        """
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+    
+    def _refill(self):
+        now = self.clock()
+        if self.refill_seconds > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.refill_seconds)
+        else:
+            self.tokens = float(self.capacity)
+        self.updated = now
+    
+    def seed(self, event_times):
+        """
+        Replay past uploads so pacing carries over between runs
+        
+        Args:
+            event_times: Timestamps (seconds) of recent uploads, any order
+        """
+        now = self.clock()
+        self.tokens = float(self.capacity)
+        self.updated = None
+        for event in sorted(t for t in event_times if t <= now):
+            if self.updated is not None and self.refill_seconds > 0:
+                self.tokens = min(self.capacity, self.tokens + (event - self.updated) / self.refill_seconds)
+            self.tokens = max(0.0, self.tokens - 1)
+            self.updated = event
+        if self.updated is None:
+            self.updated = now
+        self._refill()
+    
+    def wait_time(self, count=1):
+        """Seconds until count tokens can have been taken (0 if they are available now)"""
+        self._refill()
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) * self.refill_seconds
+    
+    def consume(self):
+        """
+        Take a token if one is available
+        
+        Returns:
+            True if a token was taken, False otherwise
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def refund(self):
+        """Give back a token that was not used"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class UploadScheduler:
+    def __init__(self, videos_per_day=4, upload_times=None, min_interval_minutes=30, burst=1,
+                 jitter_minutes=5, max_wait_minutes=None, clock=None, sleep=time.sleep):
+        """
+        Initialize upload scheduler
+        
+        Args:
+            videos_per_day: Daily upload quota
+            upload_times: Optional list of "HH:MM" UTC slot times; when not
+                          given, slots are spread evenly over the day
+            min_interval_minutes: Token bucket refill interval between uploads
+            burst: Token bucket capacity (uploads allowed back to back)
+            jitter_minutes: Random delay added to each slot so posts do not
+                            land at exactly the same minute every day
+            max_wait_minutes: In one-shot mode, how long to wait in-process
+                              for a slot or token that is almost due
+                              (defaults to jitter_minutes)
+            clock: Callable returning the current UTC datetime
+            sleep: Callable used to wait (seconds)
+        """
+        self.videos_per_day = videos_per_day
+        self.upload_times = sorted(upload_times or [])
+        self.jitter_minutes = jitter_minutes
+        self.max_wait_seconds = 60 * (jitter_minutes if max_wait_minutes is None else max_wait_minutes)
+        self.clock = clock or datetime.utcnow
+        self.sleep = sleep
+        self.bucket = TokenBucket(
+            capacity=burst,
+            refill_seconds=min_interval_minutes * 60,
+            clock=lambda: self.clock().timestamp()
+        )
+    
+    def slots_for_day(self, day):
+        """
+        Get the slot times for a given day
+        
+        Jitter is derived from the date, so every run on the same day
+        agrees on where the slots are.
+        
+        Args:
+            day: date or datetime
+        
+        Returns:
+            Sorted list of UTC datetimes
+        """
+        start = datetime(day.year, day.month, day.day)
+        if self.upload_times:
+            offsets = []
+            for value in self.upload_times:
+                hours, minutes = value.split(':')
+                offsets.append(timedelta(hours=int(hours), minutes=int(minutes)))
+        else:
+            count = max(1, self.videos_per_day)
+            offsets = [timedelta(days=1) * i / count for i in range(count)]
+        
+        slots = []
+        for i, offset in enumerate(offsets):
+            rng = random.Random(f"{start.date().isoformat()}-{i}")
+            jitter = timedelta(minutes=rng.uniform(0, self.jitter_minutes))
+            slots.append(start + offset + jitter)
+        return sorted(slots)
+    
+    def due_count(self, uploaded_today, now=None):
+        """
+        Number of slots that have passed today but were not used yet
+        
+        Args:
+            uploaded_today: Uploads already made today
+            now: Optional current time (defaults to the clock)
+        """
+        now = now or self.clock()
+        passed = sum(1 for slot in self.slots_for_day(now) if slot <= now)
+        allowed = min(passed, self.videos_per_day)
+        return max(0, allowed - uploaded_today)
+    
+    def next_slot(self, uploaded_today, now=None):
+        """
+        Get the next slot that is not covered by today's uploads
+        
+        Returns:
+            UTC datetime of the next slot (now if one is already due)
+        """
+        now = now or self.clock()
+        if self.due_count(uploaded_today, now) > 0:
+            return now
+        if uploaded_today < self.videos_per_day:
+            for slot in self.slots_for_day(now):
+                if slot > now:
+                    return slot
+        # Quota used up or no slots left today
+        return self.slots_for_day(now + timedelta(days=1))[0]
+    
+    def seed(self, upload_times):
+        """
+        Seed the rate limiter from recent upload times
+        
+        Args:
+            upload_times: List of UTC datetimes of recent uploads
+        """
+        self.bucket.seed([t.timestamp() for t in upload_times])
+    
+    def seconds_until_slot(self, uploaded_today):
+        """Seconds until the next slot (0 if one is due now)"""
+        now = self.clock()
+        return max(0.0, (self.next_slot(uploaded_today, now) - now).total_seconds())
+    
+    def is_due(self, uploaded_today, daemon=False):
+        """
+        Check whether a slot is due, or close enough to wait for
+        
+        Returns:
+            True if wait_for_slot would not tell the caller to exit
+        """
+        return daemon or self.seconds_until_slot(uploaded_today) <= self.max_wait_seconds
+    
+    def wait_for_slot(self, uploaded_today, daemon=False):
+        """
+        Wait until a slot is due
+        
+        In daemon mode this sleeps until the next slot. In one-shot mode it
+        only waits if a slot is due within max_wait_seconds.
+        
+        Returns:
+            True if a slot is due, False if the caller should exit
+        """
+        wait = self.seconds_until_slot(uploaded_today)
+        if wait <= 0:
+            return True
+        if not daemon and wait > self.max_wait_seconds:
+            return False
+        print(f"Waiting {int(wait)} seconds for next upload slot...")
+        self.sleep(wait)
+        return True
+    
+    def can_acquire(self, count=1, daemon=False):
+        """
+        Whether count more upload tokens can be taken in this run
+        
+        Checked before preparing videos, so nothing is downloaded or
+        captioned for an upload the rate limiter will refuse.
+        
+        Returns:
+            True in daemon mode, otherwise whether the tokens are available
+            within max_wait_seconds
+        """
+        return daemon or self.bucket.wait_time(count) <= self.max_wait_seconds
+    
+    def release(self):
+        """Return a token taken for an upload that did not happen"""
+        self.bucket.refund()
+    
+    def acquire(self, daemon=False):
+        """
+        Take an upload token, waiting for one if allowed
+        
+        Returns:
+            True if the upload may go ahead, False if the caller should stop
+        """
+        wait = self.bucket.wait_time()
+        if wait > 0:
+            if not daemon and wait > self.max_wait_seconds:
+                print(f"Rate limit: next upload allowed in {int(wait)} seconds")
+                return False
+            print(f"Rate limit: waiting {int(wait)} seconds before upload...")
+            self.sleep(wait)
+        return self.bucket.consume()
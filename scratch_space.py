@@ -0,0 +1,211 @@
+"""
+Managed scratch space for downloaded videos
+Keeps temp files in one directory (tmpfs when it is big enough), admits
+downloads against a byte budget before they start, and removes leftovers
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+TMPFS_DIRECTORY = '/dev/shm'
+FILE_PREFIX = 'igauto-'
+
+# Temp files are named igauto-<pid>-<random><ext> so a sweep can tell
+# which process owns them
+FILE_PATTERN = re.compile(rf"^{FILE_PREFIX}(\d+)-")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ScratchSpace:
+    def __init__(self, directory=None, budget_mb=None, prefer_tmpfs=True, min_free_mb=200, wait_seconds=300):
+        """
+        Initialize scratch space
+        
+        Args:
+            directory: Directory for temp files (default: tmpfs if usable,
+                       otherwise the system temp dir, in an ig_automation subfolder)
+            budget_mb: Maximum megabytes of temp files at once (default: free
+                       space minus min_free_mb)
+            prefer_tmpfs: Use /dev/shm when it has room for the whole budget
+            min_free_mb: Free space to always leave on the filesystem
+            wait_seconds: How long a download may wait for space held by
+                          other downloads before it is refused
+        """
+        self.budget = budget_mb * 1024 * 1024 if budget_mb else None
+        self.min_free = min_free_mb * 1024 * 1024
+        self.wait_seconds = wait_seconds
+        self.directory = directory or self._default_directory(prefer_tmpfs)
+        os.makedirs(self.directory, exist_ok=True)
+        self._reserved = {}
+        self._condition = threading.Condition()
+    
+    def _default_directory(self, prefer_tmpfs):
+        if prefer_tmpfs and os.path.isdir(TMPFS_DIRECTORY) and os.access(TMPFS_DIRECTORY, os.W_OK):
+            # tmpfs is RAM; only use it when the budget fits comfortably
+            free = shutil.disk_usage(TMPFS_DIRECTORY).free
+            needed = (self.budget or 512 * 1024 * 1024) + self.min_free
+            if free >= needed:
+                return os.path.join(TMPFS_DIRECTORY, 'ig_automation')
+        return os.path.join(tempfile.gettempdir(), 'ig_automation')
+    
+    def _unwritten(self):
+        """Bytes reserved by in-flight downloads that are not on disk yet"""
+        total = 0
+        for path, size in self._reserved.items():
+            try:
+                total += max(0, size - os.path.getsize(path))
+            except OSError:
+                total += size
+        return total
+    
+    def _fits(self, size):
+        if self.budget is not None and sum(self._reserved.values()) + size > self.budget:
+            return False
+        free = shutil.disk_usage(self.directory).free - self._unwritten()
+        return free - size >= self.min_free
+    
+    def admit(self, size):
+        """
+        Check whether a file of this size could ever be admitted
+        
+        Returns:
+            Reason string if it can never fit, None otherwise
+        """
+        if self.budget is not None and size > self.budget:
+            return f"larger than the scratch budget ({size / (1024 * 1024):.0f}MB)"
+        return None
+    
+    def allocate(self, file_name, size=None):
+        """
+        Reserve space and create an empty temp file
+        
+        Waits up to wait_seconds for space held by other downloads.
+        
+        Args:
+            file_name: Original file name (its extension is kept)
+            size: Expected size in bytes (e.g. the Drive 'size' field)
+        
+        Returns:
+            Path to the temp file, or None if there is not enough space
+        """
+        size = int(size or 0)
+        reason = self.admit(size)
+        if reason:
+            print(f"✗ Not enough scratch space for {file_name}: {reason}")
+            return None
+        
+        deadline = time.monotonic() + self.wait_seconds
+        with self._condition:
+            while not self._fits(size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._reserved:
+                    # Nothing of ours will be freed, waiting cannot help
+                    print(f"✗ Not enough scratch space for {file_name} ({size / (1024 * 1024):.1f}MB)")
+                    return None
+                print(f"Waiting for scratch space for {file_name}...")
+                self._condition.wait(min(remaining, 30))
+            
+            ext = os.path.splitext(file_name)[1]
+            handle, path = tempfile.mkstemp(suffix=ext, prefix=f"{FILE_PREFIX}{os.getpid()}-", dir=self.directory)
+            os.close(handle)
+            self._reserved[path] = size
+            return path
+    
+    def update(self, path, size):
+        """Replace a file's reservation with its actual size"""
+        with self._condition:
+            if path in self._reserved:
+                self._reserved[path] = size
+                self._condition.notify_all()
+    
+    def remove(self, path):
+        """
+        Delete a temp file and release its reservation
+        
+        Returns:
+            True if the file is gone, False if it could not be deleted
+        """
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+            return True
+        except Exception as e:
+            print(f"Note: Could not delete temp file: {e}")
+            return False
+        finally:
+            with self._condition:
+                self._reserved.pop(path, None)
+                self._condition.notify_all()
+    
+    @contextmanager
+    def file(self, file_name, size=None):
+        """
+        Temp file that is removed when the block exits
+        
+        Yields:
+            Path to the temp file, or None if there is not enough space
+        """
+        path = self.allocate(file_name, size)
+        try:
+            yield path
+        finally:
+            if path:
+                self.remove(path)
+    
+    def cleanup(self):
+        """Remove every temp file still held by this process"""
+        for path in list(self._reserved):
+            self.remove(path)
+    
+    def sweep_orphans(self, max_age_hours=6):
+        """
+        Remove temp files left behind by processes that died
+        
+        A file is an orphan when the process that created it is gone, or
+        when it is older than max_age_hours (in case the PID was reused).
+        
+        Returns:
+            Number of files removed
+        """
+        removed = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            match = FILE_PATTERN.match(entry.name)
+            if not match or not entry.is_file() or entry.path in self._reserved:
+                continue
+            pid = int(match.group(1))
+            try:
+                age = now - entry.stat().st_mtime
+                if (pid != os.getpid() and not _pid_alive(pid)) or age > max_age_hours * 3600:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            print(f"✓ Removed {removed} orphaned temp file(s) from {self.directory}")
+        return removed
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
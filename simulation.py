@@ -0,0 +1,266 @@
+"""
+Day simulation (dry run) for capacity planning
+Replays the scheduler, tracker and upload pipeline over N days on a
+virtual clock against fake services, without uploading anything
+"""
+import contextlib
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from google_drive import check_eligibility
+from manifest import VideoManifest
+from duplicate_index import DuplicateIndex
+from mongo_tracker import MongoVideoTracker
+from resilience import set_run_budget
+from metrics import metrics
+from fakes import (FaultProfile, FakeDriveFolder, FakeDriveHttp, FakeDriveDownloader, FakeInstagramClient,
+                   FakeInstagramUploader, FakeLLM, FakeCaptionGenerator)
+
+
+# Assumed service behaviour, overridable through the 'simulation' config section
+DEFAULT_PROFILES = {
+    'drive': {'latency': 0.3, 'bandwidth': 20 * 1024 * 1024},
+    'instagram': {'latency': 5.0, 'bandwidth': 4 * 1024 * 1024},
+    'ai': {'latency': 2.0}
+}
+
+
+class VirtualClock:
+    def __init__(self, start=None):
+        """
+        Simulated UTC clock
+        
+        Args:
+            start: Starting UTC datetime (defaults to now)
+        """
+        self.now = start or datetime.utcnow()
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+    
+    def __call__(self):
+        """Current simulated UTC datetime"""
+        with self._lock:
+            return self.now
+    
+    def sleep(self, seconds):
+        """Advance the clock while idle (waiting for a slot or token)"""
+        with self._lock:
+            self.now += timedelta(seconds=max(0.0, seconds))
+    
+    def work(self, seconds):
+        """Advance the clock for time spent talking to a service"""
+        with self._lock:
+            self.now += timedelta(seconds=max(0.0, seconds))
+            self.busy_seconds += max(0.0, seconds)
+
+
+class SimulatedDriveDownloader(FakeDriveDownloader):
+    def _download_file(self, file_id, path):
+        """Charge the transfer to the virtual clock and write a sparse file of the real size"""
+        video = self.fake_http.folder.by_id[file_id]
+        size = int(video.get('size') or 0)
+        metrics.incr('drive_api_calls')
+        self.fake_http.profile.delay(size)
+        with open(path, 'wb') as fh:
+            fh.truncate(size)
+
+
+def load_listing(path):
+    """
+    Load a recorded folder listing
+    
+    Args:
+        path: JSON file with a list of Drive file dicts as returned by
+              GoogleDriveDownloader.list_videos, or a listing manifest
+              saved by it (google_drive.manifest_file)
+    
+    Returns:
+        List of Drive file dicts, or a VideoManifest
+    """
+    if VideoManifest.is_manifest(path):
+        return VideoManifest.load(path)
+    with open(path, 'r') as f:
+        listing = json.load(f)
+    return listing.get('files', []) if isinstance(listing, dict) else listing
+
+
+def _profile(settings, clock, seed):
+    return FaultProfile(
+        latency=settings.get('latency', 0.0),
+        bandwidth=settings.get('bandwidth'),
+        failure_rate=settings.get('failure_rate', 0.0),
+        seed=seed,
+        sleep=clock.work
+    )
+
+
+def remaining_backlog(listing, tracker, rules):
+    """Number of listed videos that are still eligible and not uploaded or skipped"""
+    excluded = set(tracker.get_excluded_ids())
+    return sum(1 for video in listing if video['id'] not in excluded and not check_eligibility(video, rules))
+
+
+def run_simulation(config, days, cron_minutes=180, daemon=False, listing=None, file_count=1000):
+    """
+    Simulate the automation over a number of days
+    
+    Each cron tick replays what a one-shot main.py run does (quota check,
+    slot wait, upload_cycle); in daemon mode the process sleeps until each
+    slot instead. Drive, Instagram and the AI providers are fakes whose
+    latency and bandwidth advance the virtual clock; MongoDB is mongomock.
+    
+    Args:
+        config: Full config dict
+        days: Number of days to simulate
+        cron_minutes: Interval between one-shot runs
+        daemon: Simulate daemon mode instead of cron runs
+        listing: Optional recorded folder listing (list of Drive file dicts
+                 or VideoManifest)
+        file_count: Number of generated videos when no listing is given
+    
+    Returns:
+        dict with the projected totals
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise RuntimeError("Simulation needs mongomock (pip install -r requirements-dev.txt)")
+    from main import create_scheduler, upload_cycle
+    
+    posting_config = dict(config.get('posting', {}))
+    # Prepare sequentially so every service call is charged to the clock in order
+    posting_config['prefetch'] = 0
+    config = dict(config, posting=posting_config)
+    max_videos_per_day = posting_config.get('videos_per_day', 4)
+    rules = config.get('selection')
+    duplicates_config = dict(config.get('duplicates', {}))
+    # Sparse placeholder files cannot be fingerprinted; md5 checks still apply
+    duplicates_config['fingerprint'] = False
+    config['duplicates'] = duplicates_config
+    profiles = {
+        name: dict(DEFAULT_PROFILES[name], **config.get('simulation', {}).get(name, {}))
+        for name in DEFAULT_PROFILES
+    }
+    
+    clock = VirtualClock()
+    start = clock()
+    end = start + timedelta(days=days)
+    folder = FakeDriveFolder(file_count=file_count, files=listing)
+    client = mongomock.MongoClient()
+    tracker = MongoVideoTracker(None, database_name='simulation', client=client, clock=clock)
+    duplicate_index = None
+    if duplicates_config.get('enabled', True):
+        duplicate_index = DuplicateIndex(tracker.db, max_distance=duplicates_config.get('max_distance', 8))
+    drive = SimulatedDriveDownloader(
+        credentials_file=None,
+        folder_id=folder.folder_id,
+        compact_listing=config.get('google_drive', {}).get('compact_listing', False),
+        http=FakeDriveHttp(folder, _profile(profiles['drive'], clock, seed=1))
+    )
+    ig = FakeInstagramUploader('simulation', None,
+                               client=FakeInstagramClient(_profile(profiles['instagram'], clock, seed=2)))
+    # Only the providers that are configured are called
+    ai_config = config.get('ai', {})
+    llm = FakeLLM(_profile(profiles['ai'], clock, seed=3))
+    ai_generator = FakeCaptionGenerator(
+        gemini=llm if ai_config.get('gemini_api_key') else None,
+        openai=llm if ai_config.get('openai_api_key') else None,
+        default_caption=ai_config.get('default_caption', 'Check out this video!')
+    )
+    
+    runs = 0
+    uploaded = 0
+    daily_uploads = {}
+    exhausted_at = None
+    run_seconds = []
+    metrics.reset()
+    wall_start = time.perf_counter()
+    
+    while clock() < end:
+        tick = clock()
+        attempted = 0
+        # Failed calls are not retried: retry backoff sleeps in real time
+        set_run_budget(0)
+        scheduler = create_scheduler(posting_config, clock=clock, sleep=clock.sleep)
+        scheduler.seed(tracker.get_upload_times(since=clock() - timedelta(days=1)))
+        
+        if daemon:
+            scheduler.wait_for_slot(tracker.get_daily_count(), daemon=True)
+            due = clock() < end
+        else:
+            due = (tracker.can_upload_more(max_videos_per_day)
+                   and scheduler.wait_for_slot(tracker.get_daily_count()))
+        
+        if due:
+            runs += 1
+            busy_before = clock.busy_seconds
+            with contextlib.redirect_stdout(io.StringIO()):
+                success, attempted = upload_cycle(
+                    config, tracker, drive, ig, ai_generator, duplicate_index, scheduler, daemon=daemon
+                )
+            run_seconds.append(clock.busy_seconds - busy_before)
+            uploaded += success
+            day = clock().strftime('%Y-%m-%d')
+            daily_uploads[day] = daily_uploads.get(day, 0) + success
+            if not attempted and exhausted_at is None and not remaining_backlog(folder.files, tracker, rules):
+                exhausted_at = clock()
+        
+        if daemon:
+            if not attempted:
+                clock.sleep(60 * posting_config.get('idle_poll_minutes', 30))
+        else:
+            # Next cron tick
+            clock.sleep(max(0.0, (tick + timedelta(minutes=cron_minutes) - clock()).total_seconds()))
+    
+    summary = metrics.summary()
+    counters = summary['counters']
+    backlog = remaining_backlog(folder.files, tracker, rules)
+    per_day = uploaded / days if days else 0.0
+    return {
+        'days': days,
+        'mode': 'daemon' if daemon else f"cron every {cron_minutes} min",
+        'videos_per_day': max_videos_per_day,
+        'folder_videos': len(folder.files),
+        'runs': runs,
+        'uploads': uploaded,
+        'uploads_per_day': per_day,
+        'daily_uploads': daily_uploads,
+        'drive_api_calls': counters.get('drive_api_calls', 0),
+        'instagram_api_calls': counters.get('instagram_api_calls', 0),
+        'ai_calls': counters.get('captions_gemini', 0) + counters.get('captions_openai', 0),
+        'default_captions': counters.get('captions_default', 0),
+        'bytes_downloaded': counters.get('bytes_downloaded', 0),
+        'bytes_uploaded': counters.get('bytes_uploaded', 0),
+        'busy_seconds': clock.busy_seconds,
+        'max_run_seconds': max(run_seconds) if run_seconds else 0.0,
+        'backlog_remaining': backlog,
+        'backlog_exhausted_at': exhausted_at,
+        'backlog_days_left': backlog / per_day if per_day else None,
+        'simulated_in_seconds': time.perf_counter() - wall_start
+    }
+
+
+def print_report(report):
+    """Print a simulation report"""
+    days = report['days'] or 1
+    print("=" * 60)
+    print("SIMULATION REPORT (no uploads were made)")
+    print("=" * 60)
+    print(f"Simulated {report['days']} day(s) ({report['mode']}) in {report['simulated_in_seconds']:.1f}s")
+    print(f"Runs with a slot due: {report['runs']}")
+    print(f"Uploads: {report['uploads']} ({report['uploads_per_day']:.1f}/day, quota {report['videos_per_day']}/day)")
+    print(f"Drive API calls: {report['drive_api_calls']} ({report['drive_api_calls'] / days:.0f}/day)")
+    print(f"Instagram API calls: {report['instagram_api_calls']} ({report['instagram_api_calls'] / days:.0f}/day)")
+    print(f"AI caption calls: {report['ai_calls']} ({report['default_captions']} default caption(s))")
+    print(f"Downloaded: {report['bytes_downloaded'] / (1024 * 1024):.0f}MB, "
+          f"uploaded: {report['bytes_uploaded'] / (1024 * 1024):.0f}MB")
+    print(f"Projected run time: {report['busy_seconds'] / 60:.0f} min total, "
+          f"longest run {report['max_run_seconds'] / 60:.1f} min")
+    print(f"Backlog: {report['backlog_remaining']} of {report['folder_videos']} video(s) left")
+    if report['backlog_exhausted_at']:
+        print(f"  Exhausted at {report['backlog_exhausted_at'].strftime('%Y-%m-%d %H:%M')} UTC")
+    elif report['backlog_days_left'] is not None:
+        print(f"  Lasts about {report['backlog_days_left']:.0f} more day(s) at this rate")
+    print("=" * 60)
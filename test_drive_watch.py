@@ -0,0 +1,84 @@
+"""
+Tests for the push-driven Drive watcher against the fake Drive API
+Run with: python -m pytest test_drive_watch.py
+"""
+import socket
+import pytest
+import requests
+import resilience
+from drive_watch import DriveWatcher
+from manifest import VideoManifest
+from fakes import FakeDriveFolder, FakeDriveHttp, FakeDriveDownloader
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(params=[False, True], ids=['dicts', 'manifest'])
+def watcher(request):
+    resilience.set_run_budget(600)
+    folder = FakeDriveFolder(file_count=5)
+    drive = FakeDriveDownloader(credentials_file=None, folder_id=folder.folder_id, http=FakeDriveHttp(folder),
+                                compact_listing=request.param)
+    port = _free_port()
+    watcher = DriveWatcher(drive, address=f"http://127.0.0.1:{port}", host='127.0.0.1', port=port,
+                           debounce_seconds=0).start()
+    yield watcher
+    watcher.stop()
+
+
+def test_notification_adds_new_video(watcher):
+    http = watcher.drive.fake_http
+    assert len(http.channels) == 1
+    
+    video = http.add_video()
+    
+    assert watcher.wait_for_changes(5)
+    videos = watcher.videos()
+    assert [v['id'] for v in videos] == [f"file{i:07d}" for i in range(6)]
+    assert videos[-1]['folder_id'] == http.folder.folder_id
+    assert videos[-1]['md5Checksum'] == video['md5Checksum']
+    assert isinstance(videos, VideoManifest) == watcher.drive.compact_listing
+
+
+def test_removed_video_is_dropped(watcher):
+    watcher.drive.fake_http.folder.remove_video('file0000002')
+    
+    watcher._pull_changes()
+    
+    assert [v['id'] for v in watcher.videos()] == ['file0000000', 'file0000001', 'file0000003', 'file0000004']
+    assert not watcher.wait_for_changes(0)
+
+
+def test_notification_with_wrong_token_is_rejected(watcher):
+    channel = next(iter(watcher.drive.fake_http.channels.values()))
+    
+    response = requests.post(watcher.address, timeout=5, headers={
+        'X-Goog-Channel-ID': channel['id'],
+        'X-Goog-Channel-Token': 'wrong-token',
+        'X-Goog-Resource-State': 'change'
+    })
+    
+    assert response.status_code == 403
+
+
+def test_renewal_replaces_channel(watcher):
+    http = watcher.drive.fake_http
+    old = set(http.channels)
+    
+    assert watcher._renew()
+    
+    assert len(http.channels) == 1
+    assert not old & set(http.channels)
+    http.add_video()
+    assert watcher.wait_for_changes(5)
+    assert len(watcher.videos()) == 6
+
+
+def test_stop_closes_channel(watcher):
+    watcher.stop()
+    
+    assert watcher.drive.fake_http.channels == {}
@@ -0,0 +1,174 @@
+"""
+Tests for batched Drive metadata lookups and video selection against the fake Drive API
+Run with: python -m pytest test_google_drive.py
+"""
+import random
+import pytest
+import google_drive
+import resilience
+from manifest import VideoManifest
+from fakes import FakeDriveFolder, FakeDriveHttp, FakeDriveDownloader
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    monkeypatch.setattr(google_drive.time, 'sleep', lambda seconds: None)
+    resilience.set_run_budget(600)
+    folder = FakeDriveFolder(file_count=250)
+    return FakeDriveDownloader(credentials_file=None, folder_id=folder.folder_id, http=FakeDriveHttp(folder))
+
+
+def test_chunks_past_batch_limit(drive):
+    file_ids = [video['id'] for video in drive.fake_http.folder.files]
+    
+    results = drive.get_files_metadata(file_ids)
+    
+    assert set(results) == set(file_ids)
+    assert results[file_ids[123]]['name'] == drive.fake_http.folder.files[123]['name']
+    # 250 files in batches of at most 100
+    assert drive.fake_http.requests == 3
+
+
+def test_missing_file_is_none(drive):
+    results = drive.get_files_metadata(['file0000001', 'deleted-file'])
+    
+    assert results['deleted-file'] is None
+    assert results['file0000001']['id'] == 'file0000001'
+    assert drive.fake_http.requests == 1
+
+
+def test_retries_failed_items_only(drive):
+    drive.fake_http.fail_item('file0000002', 503)
+    drive.fake_http.fail_item('file0000150', 429, 500)
+    file_ids = [video['id'] for video in drive.fake_http.folder.files]
+    
+    results = drive.get_files_metadata(file_ids)
+    
+    assert set(results) == set(file_ids)
+    assert results['file0000150']['id'] == 'file0000150'
+    # 3 batches, then one retry batch per round for the failed items
+    assert drive.fake_http.requests == 5
+
+
+def test_gives_up_after_max_attempts(drive):
+    drive.fake_http.fail_item('file0000003', 503, 503, 503)
+    
+    results = drive.get_files_metadata(['file0000003', 'file0000004'], max_attempts=3)
+    
+    assert 'file0000003' not in results
+    assert results['file0000004']['id'] == 'file0000004'
+
+
+def test_fatal_item_error_is_not_retried(drive):
+    drive.fake_http.fail_item('file0000005', 403)
+    
+    results = drive.get_files_metadata(['file0000005'])
+    
+    assert results == {}
+    assert drive.fake_http.requests == 1
+
+
+def test_refresh_drops_deleted_and_updates_metadata(drive):
+    folder = drive.fake_http.folder
+    listed = [dict(folder.files[0]), dict(folder.files[1]), {'id': 'deleted-file', 'name': 'gone.mp4'}]
+    del listed[0]['videoMediaMetadata']
+    listed[0]['folder_id'] = folder.folder_id
+    
+    skips = []
+    
+    refreshed = drive.refresh_metadata(listed, on_skip=lambda video, reason: skips.append(video['id']))
+    
+    assert [video['id'] for video in refreshed] == ['file0000000', 'file0000001']
+    assert skips == ['deleted-file']
+    assert refreshed[0]['videoMediaMetadata'] == folder.files[0]['videoMediaMetadata']
+    assert refreshed[0]['folder_id'] == folder.folder_id
+    assert 'trashed' not in refreshed[0]
+
+
+def test_next_videos_refreshes_reused_listing(drive):
+    listing = [{'id': 'deleted-file', 'name': 'gone.mp4'}] + [dict(video) for video in drive.fake_http.folder.files[:3]]
+    
+    skips = []
+    
+    videos = drive.get_next_videos(count=2, videos=listing, refresh=True,
+                                   on_skip=lambda video, reason: skips.append(video['id']))
+    
+    assert [video['id'] for video in videos] == ['file0000000', 'file0000001']
+    assert skips == ['deleted-file']
+
+
+def test_deleted_video_leaves_kept_selection(drive):
+    folder = drive.fake_http.folder
+    listing = VideoManifest.from_videos(folder.files[:3])
+    folder.remove_video('file0000000')
+    
+    drive.get_next_videos(count=1, videos=listing, refresh=True)
+    requests = drive.fake_http.requests
+    videos = drive.get_next_videos(count=1, videos=listing, refresh=True)
+    
+    assert [video['id'] for video in videos] == ['file0000001']
+    # Only the remaining candidate is looked up again
+    assert drive.fake_http.requests == requests + 1
+    assert 'file0000000' in drive._selections[None].excluded_ids
+
+
+def test_manifest_selection_is_kept_across_calls(drive):
+    listing = VideoManifest.from_videos(drive.fake_http.folder.files)
+    
+    first = drive.get_next_videos(count=2, exclude_ids=['file0000000'], videos=listing)
+    selection = drive._selections[None]
+    second = drive.get_next_videos(
+        count=2, exclude_ids=['file0000000', 'file0000001'], videos=listing,
+        reject=lambda video: 'duplicate' if video['id'] == 'file0000002' else None
+    )
+    third = drive.get_next_videos(count=1, exclude_ids=['file0000000', 'file0000001'], videos=listing)
+    
+    assert [video['id'] for video in first] == ['file0000001', 'file0000002']
+    assert [video['id'] for video in second] == ['file0000003', 'file0000004']
+    # The rejected video stays excluded without being passed again
+    assert [video['id'] for video in third] == ['file0000003']
+    assert drive._selections[None] is selection
+    assert len(selection) == 247
+
+
+def test_manifest_selection_per_key(drive):
+    listing = VideoManifest.from_videos(drive.fake_http.folder.files)
+    
+    drive.get_next_videos(count=1, exclude_ids=['file0000000'], videos=listing, selection_key='a')
+    other = drive.get_next_videos(count=1, videos=listing, selection_key='b')
+    
+    assert [video['id'] for video in other] == ['file0000000']
+
+
+def test_manifest_folder_selection_matches_scan():
+    rng = random.Random(7)
+    videos = [
+        {'id': f"file{i:04d}", 'createdTime': f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}Z",
+         'folder_id': rng.choice(['a', 'b', 'c'])}
+        for i in range(300)
+    ]
+    manifest = VideoManifest.from_videos(videos)
+    excluded = {video['id'] for video in rng.sample(videos, 100)}
+    selection = manifest.selection(excluded)
+    
+    # Build folder 'a' before the later exclusions so its tree is updated too
+    next(selection.available('a'))
+    later = {video['id'] for video in rng.sample(videos, 50)}
+    selection.exclude(later)
+    excluded |= later
+    
+    for folder_id in ('a', 'b', 'c'):
+        expected = [v['id'] for v in videos if v['folder_id'] == folder_id and v['id'] not in excluded]
+        assert [v['id'] for v in selection.available(folder_id)] == expected
+    assert list(selection.available('missing')) == []
+
+
+def test_exhausted_manifest_selection_is_kept(drive):
+    listing = VideoManifest.from_videos(drive.fake_http.folder.files[:2])
+    
+    assert drive.get_next_videos(count=1, exclude_ids=['file0000000', 'file0000001'], videos=listing) == []
+    selection = drive._selections[None]
+    assert len(selection) == 0
+    assert drive.get_next_videos(count=1, exclude_ids=['file0000000', 'file0000001'], videos=listing) == []
+    
+    assert drive._selections[None] is selection
@@ -0,0 +1,75 @@
+"""
+Tests for the segmented Instagram upload transport against the fake rupload endpoint
+Run with: python -m pytest test_instagram_transport.py
+"""
+import json
+import pytest
+from resilience import classify_error, FATAL
+from instagram_transport import InstagramUploadTransport, UploadInterrupted
+from fakes import FakeInstagramClient, FakeRuploadServer, _analyze_fake_video
+
+
+SEGMENT_SIZE = 1000
+FILE_SIZE = 5500
+
+
+@pytest.fixture
+def server():
+    with FakeRuploadServer() as server:
+        yield server
+
+
+@pytest.fixture
+def transport(server):
+    return InstagramUploadTransport(
+        FakeInstagramClient(), segment_size=SEGMENT_SIZE, max_resumes=2, base_url=server.url,
+        analyze=_analyze_fake_video, sleep=lambda seconds: None
+    )
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(bytes(range(256)) * (FILE_SIZE // 256) + bytes(FILE_SIZE % 256))
+    return path
+
+
+def test_resumes_from_server_offset(server, transport, video):
+    upload = transport.start(video)
+    # The third segment (offset 2000) is cut off after 500 of its bytes
+    server.drop_posts(3)
+    
+    transport.transfer(upload)
+    
+    assert upload.complete
+    assert server.is_complete(upload.upload_id)
+    assert server.disconnects == 1
+    # Resumed at the 2500 bytes the server held, so no byte was sent twice
+    assert server.bytes_received == FILE_SIZE
+
+
+def test_interrupted_after_max_resumes(server, transport, video):
+    upload = transport.start(video)
+    server.drop_posts(2, 3, 4)
+    
+    with pytest.raises(UploadInterrupted) as raised:
+        transport.transfer(upload)
+    
+    assert not upload.complete
+    assert server.disconnects == 3
+    # The transfer's own resumes are used up; callers must not retry it
+    assert classify_error(raised.value)[0] == FATAL
+
+
+def test_clip_flag_follows_post_type(transport, video):
+    reel = transport.start(video)
+    post = transport.reupload(reel, clip=False)
+    
+    reel_params = json.loads(transport._headers(reel)['X-Instagram-Rupload-Params'])
+    post_params = json.loads(transport._headers(post)['X-Instagram-Rupload-Params'])
+    
+    assert reel_params['is_clips_video'] == '1'
+    assert 'is_clips_video' not in post_params
+    assert post.upload_id != reel.upload_id
+    assert (post.thumbnail, post.width, post.duration) == (reel.thumbnail, reel.width, reel.duration)
+    assert not post.generated_thumbnail
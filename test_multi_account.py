@@ -0,0 +1,71 @@
+"""
+Tests for the multi-account fan-out against the fake Drive API
+Run with: python -m pytest test_multi_account.py
+"""
+import pytest
+import resilience
+from simulation import VirtualClock
+from fakes import FakeDriveFolder, FakeDriveHttp, FakeDriveDownloader
+from mongo_tracker import MongoVideoTracker
+from multi_account import AccountWorker, run_accounts
+from main import create_scheduler
+
+mongomock = pytest.importorskip('mongomock')
+
+
+class FailingUploader:
+    def upload_video(self, path, caption):
+        return None
+    
+    def logout(self):
+        pass
+
+
+class CountingCaptions:
+    def __init__(self):
+        self.calls = 0
+    
+    def generate_caption_from_filename(self, name):
+        self.calls += 1
+        return {'caption': f"Caption for {name}", 'title': name}
+
+
+@pytest.fixture
+def setup():
+    resilience.set_run_budget(600)
+    clock = VirtualClock()
+    folder = FakeDriveFolder(file_count=10)
+    drive = FakeDriveDownloader(credentials_file=None, folder_id=folder.folder_id, http=FakeDriveHttp(folder))
+    tracker = MongoVideoTracker(None, database_name='test', client=mongomock.MongoClient(), clock=clock)
+    scheduler = create_scheduler({'videos_per_day': 4, 'min_interval_minutes': 30}, clock=clock, sleep=clock.sleep)
+    worker = AccountWorker({'username': 'account'}, tracker, scheduler, 4)
+    worker.uploader = FailingUploader()
+    return clock, drive, tracker, worker, CountingCaptions()
+
+
+def test_rate_limited_account_is_not_listed_or_captioned(setup):
+    clock, drive, tracker, worker, captions = setup
+    worker.scheduler.bucket.consume()
+    clock.sleep(worker.seconds_until_slot())
+    
+    uploaded, attempted = run_accounts({}, [worker], drive, captions, None, tracker)
+    
+    assert (uploaded, attempted) == (0, 0)
+    assert drive.fake_http.requests == 0
+    assert captions.calls == 0
+
+
+def test_daemon_waits_for_token_after_failed_upload(setup):
+    clock, drive, tracker, worker, captions = setup
+    clock.sleep(worker.seconds_until_slot())
+    started = clock()
+    
+    # The daemon loop: sleep until an account is ready, then run a cycle
+    for _ in range(3):
+        clock.sleep(worker.seconds_until_ready())
+        uploaded, attempted = run_accounts({}, [worker], drive, captions, None, tracker)
+        assert (uploaded, attempted) == (0, 1)
+    
+    # Each failed upload used the only token, so attempts are 30 min apart
+    assert (clock() - started).total_seconds() == pytest.approx(3600, abs=1)
+    assert captions.calls == 3
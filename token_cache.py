@@ -0,0 +1,287 @@
+"""
+Persistent Google credential cache
+Keeps Drive access tokens (and the OAuth refresh token) encrypted in MongoDB
+or a locked local file, so runs reuse a valid token instead of minting one
+and concurrent workers never race on a half-written token file
+"""
+import base64
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from cryptography.fernet import Fernet, InvalidToken
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from pymongo.errors import DuplicateKeyError
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single process assumed
+    fcntl = None
+
+
+# Environment variable with an explicit Fernet key for the cache
+KEY_ENV = 'TOKEN_CACHE_KEY'
+
+EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def derive_key(credentials_file):
+    """
+    Encryption key for the cache
+    
+    Uses TOKEN_CACHE_KEY when set, otherwise a key derived from the
+    credentials file, so the cache is only readable by someone who could
+    mint tokens anyway.
+    """
+    key = os.environ.get(KEY_ENV)
+    if key:
+        return key.encode()
+    with open(credentials_file, 'rb') as f:
+        digest = hashlib.sha256(b'ig-automation-token-cache\0' + f.read()).digest()
+    return base64.urlsafe_b64encode(digest)
+
+
+class FileTokenStore:
+    def __init__(self, path='token_cache.bin'):
+        """
+        Token store in a local file
+        
+        Every read-refresh-write runs under an exclusive lock on
+        '<path>.lock', so concurrent processes refresh one at a time and
+        the later ones pick up the fresh token.
+        
+        Args:
+            path: Cache file (entries are encrypted)
+        """
+        self.path = path
+    
+    @contextmanager
+    def lock(self, name):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def load(self, name):
+        """
+        Returns:
+            Tuple of (encrypted entry or None, version)
+        """
+        entry = self._read().get(name) or {}
+        return entry.get('blob'), entry.get('version', 0)
+    
+    def save(self, name, blob, version):
+        """
+        Store an entry if it is still at version (call under lock)
+        
+        Returns:
+            True if stored, False if another writer got there first
+        """
+        entries = self._read()
+        if (entries.get(name) or {}).get('version', 0) != version:
+            return False
+        entries[name] = {'blob': blob, 'version': version + 1}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, tmp_path = tempfile.mkstemp(prefix='.token_cache-', dir=directory)
+        with os.fdopen(handle, 'w') as f:
+            json.dump(entries, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+        return True
+
+
+class MongoTokenStore:
+    def __init__(self, database, collection_name='token_cache'):
+        """
+        Token store in MongoDB, shared by every run and CI job
+        
+        Writes are compare-and-swap on a version field: a worker whose
+        refresh lost the race discards its token and uses the stored one.
+        
+        Args:
+            database: pymongo Database
+            collection_name: Collection for cache entries
+        """
+        self.collection = database[collection_name]
+    
+    def lock(self, name):
+        return nullcontext()
+    
+    def load(self, name):
+        doc = self.collection.find_one({'_id': name}) or {}
+        return doc.get('blob'), doc.get('version', 0)
+    
+    def save(self, name, blob, version):
+        now = datetime.utcnow()
+        if version == 0:
+            try:
+                self.collection.insert_one({'_id': name, 'blob': blob, 'version': 1, 'updated_at': now})
+                return True
+            except DuplicateKeyError:
+                # Created by another worker meanwhile
+                return False
+        result = self.collection.update_one(
+            {'_id': name, 'version': version},
+            {'$set': {'blob': blob, 'updated_at': now}, '$inc': {'version': 1}}
+        )
+        return result.modified_count == 1
+
+
+class TokenCache:
+    def __init__(self, store, key, refresh_margin_seconds=300):
+        """
+        Initialize the token cache
+        
+        Args:
+            store: FileTokenStore or MongoTokenStore
+            key: Fernet key (see derive_key)
+            refresh_margin_seconds: Refresh tokens this long before they expire
+        """
+        self.store = store
+        self.fernet = Fernet(key)
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+    
+    def _load(self, name):
+        blob, version = self.store.load(name)
+        if not blob:
+            return None, version
+        try:
+            return json.loads(self.fernet.decrypt(blob.encode())), version
+        except (InvalidToken, ValueError):
+            # Written with another key (e.g. rotated credentials); replace it
+            return None, version
+    
+    def _save(self, name, data, version):
+        blob = self.fernet.encrypt(json.dumps(data).encode()).decode()
+        return self.store.save(name, blob, version)
+    
+    def _fresh(self, expiry):
+        return expiry is not None and expiry - self.refresh_margin > datetime.utcnow()
+    
+    def service_account_credentials(self, name, credentials):
+        """
+        Give service-account credentials a cached access token
+        
+        A new token is minted only when the cached one is missing or
+        within the refresh margin of its expiry.
+        
+        Args:
+            name: Cache entry name (e.g. the service account email)
+            credentials: google.oauth2.service_account.Credentials
+        
+        Returns:
+            The credentials, holding a valid access token
+        """
+        try:
+            with self.store.lock(name):
+                data, version = self._load(name)
+                if data:
+                    expiry = datetime.strptime(data['expiry'], EXPIRY_FORMAT)
+                    if self._fresh(expiry):
+                        credentials.token = data['token']
+                        credentials.expiry = expiry
+                        metrics.incr('token_cache_hits')
+                        return credentials
+                
+                credentials.refresh(Request())
+                metrics.incr('token_refreshes')
+                stored = self._save(name, {
+                    'token': credentials.token,
+                    'expiry': credentials.expiry.strftime(EXPIRY_FORMAT)
+                }, version)
+                if not stored:
+                    print("Note: Another worker refreshed the Drive token first")
+        except Exception as e:
+            # The cache only saves a round trip; never fail auth over it
+            print(f"Note: Token cache unavailable: {e}")
+            if not credentials.valid:
+                credentials.refresh(Request())
+        return credentials
+    
+    def user_credentials(self, name, scopes, authorize, legacy_pickle=None):
+        """
+        OAuth user credentials, refreshed ahead of expiry
+        
+        Args:
+            name: Cache entry name
+            scopes: OAuth scopes
+            authorize: Callable running the interactive consent flow,
+                       used when there is no usable refresh token
+            legacy_pickle: Old token.pickle to migrate (deleted afterwards)
+        
+        Returns:
+            google.oauth2.credentials.Credentials
+        """
+        with self.store.lock(name):
+            data, version = self._load(name)
+            creds = Credentials.from_authorized_user_info(data, scopes) if data else None
+            
+            if creds is None and legacy_pickle and os.path.exists(legacy_pickle):
+                with open(legacy_pickle, 'rb') as token:
+                    creds = pickle.load(token)
+                print(f"Migrating {legacy_pickle} to the token cache")
+            elif creds and creds.refresh_token and self._fresh(creds.expiry):
+                metrics.incr('token_cache_hits')
+                return creds
+            
+            if not creds or not creds.refresh_token:
+                creds = authorize()
+            elif not self._fresh(creds.expiry):
+                creds.refresh(Request())
+                metrics.incr('token_refreshes')
+            
+            if self._save(name, json.loads(creds.to_json()), version):
+                if legacy_pickle and os.path.exists(legacy_pickle):
+                    os.remove(legacy_pickle)
+            else:
+                # Another process refreshed meanwhile; prefer its token
+                data, _ = self._load(name)
+                if data:
+                    creds = Credentials.from_authorized_user_info(data, scopes)
+            return creds
+
+
+def create_token_cache(options, credentials_file, database=None):
+    """
+    Build the token cache from the 'token_cache' config section
+    
+    Args:
+        options: dict with backend ('mongo' or 'file'; default mongo when a
+                 database is given), path, collection and
+                 refresh_margin_seconds
+        credentials_file: Google credentials file (for the default key)
+        database: pymongo Database for the mongo backend
+    
+    Returns:
+        TokenCache
+    """
+    options = options or {}
+    backend = options.get('backend', 'mongo' if database is not None else 'file')
+    if backend == 'mongo':
+        if database is None:
+            raise ValueError("token_cache backend 'mongo' needs a MongoDB database")
+        store = MongoTokenStore(database, options.get('collection', 'token_cache'))
+    else:
+        store = FileTokenStore(options.get('path', 'token_cache.bin'))
+    return TokenCache(
+        store,
+        derive_key(credentials_file),
+        refresh_margin_seconds=options.get('refresh_margin_seconds', 300)
+    )